@@ -1,20 +1,17 @@
-import oracledb
 import os
+import sys
 from dotenv import load_dotenv
+from app import app
+
+# El paquete compartido "comun" vive en la raíz del repositorio
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from comun.db import Database
 
 load_dotenv()
 
-usuario = os.getenv("usuario")
-clave = os.getenv("clave")
-wallet_dir = r"wallet"
-wallet_password = os.getenv("wallet_password")
-dsn = os.getenv("dsn")
+# Pool de conexiones (POOL_MIN, POOL_MAX, POOL_INCREMENT... en el .env)
+db = Database.from_env()
+db.init_app(app)
 
-connection = oracledb.connect(
-    user=usuario,
-    password=clave,
-    dsn=dsn,
-    config_dir=wallet_dir,
-    wallet_location=wallet_dir,
-    wallet_password=wallet_password
-)
\ No newline at end of file
+# Cada request usa su propia conexión del pool a través de este proxy
+connection = db.connection
@@ -1,11 +1,10 @@
 from app import app
-from config import connection 
+from config import connection, db
 from flask import jsonify, request
 
 @app.route('/producto/<int:id_producto>', methods=['GET'])
 def valor_producto(id_producto):
-    cursor = connection.cursor()
-    cursor.execute("""
+    rows = db.fetch_all("""
         SELECT
             p.ID_PRODUCTO,
             p.NOMBRE,
@@ -19,9 +18,6 @@ def valor_producto(id_producto):
         WHERE p.ID_PRODUCTO = :id_producto
     """, {'id_producto': id_producto})
 
-    rows = cursor.fetchall()
-    cursor.close()
-
     if rows:
         resultado = {
             'id_producto': rows[0][0],
@@ -128,14 +124,10 @@ def agregar_a_carrito():
 
 @app.route('/carrito/<int:id_carrito>', methods=['GET'])
 def ver_carrito(id_carrito):
-    cursor = connection.cursor()
-
-    cursor.execute("SELECT 1 FROM CARRITOS WHERE ID_CARRITO = :id", {'id': id_carrito})
-    if not cursor.fetchone():
-        cursor.close()
+    if not db.fetch_one("SELECT 1 FROM CARRITOS WHERE ID_CARRITO = :id", {'id': id_carrito}):
         return jsonify({'error': 'El carrito no existe'}), 404
 
-    cursor.execute("""
+    rows = db.fetch_all("""
         SELECT 
             p.NOMBRE || ' - ' || p.MARCA AS nombre,
             cp.CANTIDAD,
@@ -147,9 +139,6 @@ def ver_carrito(id_carrito):
         ORDER BY p.NOMBRE
     """, {'carrito': id_carrito})
 
-    rows = cursor.fetchall()
-    cursor.close()
-
     carrito = []
     total_general = 0
 
@@ -218,15 +207,20 @@ def crear_detalle_pedido():
     for producto in productos:
         id_producto, cantidad, id_sucursal = producto
 
+        # Solo se rebaja si alcanza el stock; si no, se deshace todo el pedido
         cursor.execute("""
             UPDATE INVENTARIO
             SET STOCK = STOCK - :cantidad
-            WHERE ID_PRODUCTO = :id_producto AND ID_SUCURSAL = :id_sucursal
+            WHERE ID_PRODUCTO = :id_producto AND ID_SUCURSAL = :id_sucursal AND STOCK >= :cantidad
         """, {
             'cantidad': cantidad,
             'id_producto': id_producto,
             'id_sucursal': id_sucursal
         })
+        if cursor.rowcount == 0:
+            connection.rollback()
+            cursor.close()
+            return jsonify({'error': 'Stock insuficiente', 'id_producto': id_producto, 'id_sucursal': id_sucursal}), 409
 
     connection.commit()
     cursor.close()
@@ -241,8 +235,7 @@ def crear_detalle_pedido():
 
 @app.route('/detalle_pedido/<int:id_detalle>', methods=['GET'])
 def ver_detalle_pedido(id_detalle):
-    cursor = connection.cursor()
-    cursor.execute("""
+    rows = db.fetch_all("""
         SELECT dp.ID_DETALLE, dp.ID_CARRITO, dp.DIRECCION, dp.ESTADO,
                dp.ID_USUARIO, u.NOMBRE_COMPLETO,
                p.NOMBRE || ' - ' || p.MARCA AS nombre_producto,
@@ -255,9 +248,6 @@ def ver_detalle_pedido(id_detalle):
         WHERE dp.ID_DETALLE = :id_detalle
     """, {'id_detalle': id_detalle})
 
-    rows = cursor.fetchall()
-    cursor.close()
-
     if not rows:
         return jsonify({'error': 'Detalle de pedido no encontrado'}), 404
 
@@ -1,20 +1,87 @@
-import oracledb
 import os
+import sys
 from dotenv import load_dotenv
+from app import app
+
+# El paquete compartido "comun" vive en la raíz del repositorio
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from comun.db import Database
+from comun.cache import TTLCache
+from comun.busqueda import IndiceProductos
+from comun.bitacora import BitacoraWriter
+from comun.reservas import ReservasStock
+from comun.actividad import ActividadCarritos
+from comun.limpieza import PurgaCarritos
+from comun.carritos_invitado import crear_almacen
 
 load_dotenv()
 
-usuario = os.getenv("usuario")
-clave = os.getenv("clave")
-wallet_dir = r"wallet"
-wallet_password = os.getenv("wallet_password")
-dsn = os.getenv("dsn")
-
-connection = oracledb.connect(
-    user=usuario,
-    password=clave,
-    dsn=dsn,
-    config_dir=wallet_dir,
-    wallet_location=wallet_dir,
-    wallet_password=wallet_password
+# Pool de conexiones (POOL_MIN, POOL_MAX, POOL_INCREMENT... en el .env)
+db = Database.from_env()
+db.init_app(app)
+
+# Cada request usa su propia conexión del pool a través de este proxy
+connection = db.connection
+
+# Caché del catálogo (categorías, subcategorías, sucursales, productos disponibles)
+catalogo_cache = TTLCache(
+    maxsize=int(os.getenv("CACHE_MAX_ENTRADAS", "256")),
+    ttl=int(os.getenv("CACHE_TTL", "60"))
+)
+
+# Vista de cada carrito (/carritos/<id>/productos); las rutas que modifican el carrito la
+# descartan y el TTL corto acota lo desactualizado del stock por línea
+carritos_cache = TTLCache(
+    maxsize=int(os.getenv("CACHE_CARRITOS_MAX", "2000")),
+    ttl=int(os.getenv("CACHE_CARRITOS_TTL", "5"))
+)
+
+# Escritura de BITACORA en segundo plano, por lotes
+bitacora = BitacoraWriter(
+    db,
+    max_cola=int(os.getenv("BITACORA_MAX_COLA", "10000")),
+    lote=int(os.getenv("BITACORA_LOTE", "200")),
+    intervalo_ms=int(os.getenv("BITACORA_INTERVALO_MS", "500"))
+)
+
+# Reservas de stock del checkout: vencen a los RESERVA_TTL_MINUTOS si el pago no se confirma
+reservas = ReservasStock(
+    db,
+    ttl_minutos=int(os.getenv("RESERVA_TTL_MINUTOS", "20")),
+    intervalo=int(os.getenv("RESERVA_BARRIDO_SEGUNDOS", "60"))
 )
+
+# FECHA_ULTIMA_ACTIVIDAD de los carritos: se acumula en memoria y se escribe cada ACTIVIDAD_FLUSH_SEGUNDOS
+actividad_carritos = ActividadCarritos(
+    db,
+    intervalo=int(os.getenv("ACTIVIDAD_FLUSH_SEGUNDOS", "30"))
+)
+
+# Purga (borrado real) de carritos de invitados sin actividad en PURGA_CARRITOS_DIAS días
+purga_carritos = PurgaCarritos(
+    db,
+    actividad=actividad_carritos,
+    dias=int(os.getenv("PURGA_CARRITOS_DIAS", "30")),
+    lote=int(os.getenv("PURGA_CARRITOS_LOTE", "500")),
+    pausa_ms=int(os.getenv("PURGA_CARRITOS_PAUSA_MS", "200")),
+    intervalo=int(os.getenv("PURGA_CARRITOS_INTERVALO", "3600"))
+)
+
+# Carritos de invitados: oracle (por defecto, directo a CARRITOS), memoria (LRU del proceso) o
+# redis (CARRITOS_REDIS_URL). Con memoria o redis se escriben en CARRITOS recién al convertirlos o
+# al hacer el checkout, y mientras tanto:
+# - memoria solo sirve con un proceso (app.run, sin varios workers) y pierde los carritos al reiniciar;
+# - sus IDs (>= 10^12) no existen en CARRITOS, así que /carrito/<id> y /producto_carrito de la
+#   API Externa responden 404 para ellos y /carritos/estadisticas no los cuenta.
+carritos_invitado = crear_almacen(
+    os.getenv("CARRITOS_INVITADO", "oracle"),
+    max_carritos=int(os.getenv("CARRITOS_INVITADO_MAX", "50000")),
+    ttl_segundos=int(os.getenv("CARRITOS_INVITADO_TTL", str(7 * 24 * 3600))),
+    redis_url=os.getenv("CARRITOS_REDIS_URL", "redis://localhost:6379/0")
+)
+
+# crear_pedido en una sola llamada al procedimiento CHECKOUT_PEDIDO (ver actualizar_estructura_rendimiento.sql)
+CHECKOUT_PLSQL = os.getenv("CHECKOUT_PLSQL", "0") == "1"
+
+# Índice de búsqueda de productos (se construye al iniciar y lo mantienen las rutas de productos)
+indice_productos = IndiceProductos()
@@ -1,6 +1,82 @@
+import csv
+import hashlib
+import io
+from datetime import datetime, timedelta, timezone
 from flask import jsonify, request
 from app import app
-from config import connection
+from config import (connection, db, catalogo_cache, carritos_cache, indice_productos, bitacora, reservas, actividad_carritos,
+                    purga_carritos, carritos_invitado, CHECKOUT_PLSQL)
+from comun.reservas import SQL_RESERVADO, SQL_STOCK_DISPONIBLE
+from comun.carritos_invitado import (CarritoInvitadoNoEncontrado, es_carrito_invitado, buscar_linea, aplicar_linea,
+                                     quitar_linea, resumen_carrito, materializar_carrito)
+from comun.paginacion import parse_limit, encode_cursor, decode_cursor
+from comun.operaciones_carrito import combinar_operaciones_carrito
+
+
+def respuesta_catalogo(clave, key, loader):
+    """Responder desde la caché del catálogo con ETag/Last-Modified.
+
+    El JSON se serializa una vez por carga y se guarda junto con su hash, que
+    es el ETag: depende solo de los datos, así no cambia al recargar datos
+    iguales ni entre procesos. Si el cliente ya lo tiene se responde 304 sin
+    tocar la base.
+    """
+    def cargar():
+        cuerpo = app.json.dumps({clave: loader()})
+        return cuerpo, hashlib.sha1(cuerpo.encode('utf-8')).hexdigest()
+
+    (cuerpo, etag), _, cargado_en = catalogo_cache.get_or_load_entry(key, cargar)
+    modificado = datetime.fromtimestamp(int(cargado_en), timezone.utc)
+    if request.if_none_match:
+        sin_cambios = request.if_none_match.contains_weak(etag)
+    else:
+        sin_cambios = request.if_modified_since is not None and request.if_modified_since >= modificado
+    if sin_cambios:
+        respuesta = app.response_class(status=304)
+    else:
+        respuesta = app.response_class(cuerpo, mimetype='application/json')
+    respuesta.set_etag(etag, weak=True)
+    respuesta.last_modified = modificado
+    # El navegador guarda la respuesta pero revalida siempre con If-None-Match
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
+
+FORMATOS_STREAM = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+FILAS_POR_ENVIO = 500
+
+def respuesta_stream(nombre, sql, params=None):
+    """Enviar el resultado de una consulta a medida que se lee (?format=ndjson|csv).
+
+    Las filas se traen de a lotes y se escriben en bloques de FILAS_POR_ENVIO,
+    así la memoria no crece con el tamaño de la tabla.
+    """
+    formato = request.args.get('format')
+    if formato not in FORMATOS_STREAM:
+        return jsonify({'error': 'format debe ser ndjson o csv'}), 400
+    filas = db.stream(sql, params)
+
+    def generar():
+        buffer = io.StringIO()
+        if formato == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(filas.columns)
+            escribir = writer.writerow
+        else:
+            escribir = lambda fila: buffer.write(app.json.dumps(dict(zip(filas.columns, fila))) + '\n')
+        for i, fila in enumerate(filas, start=1):
+            escribir(fila)
+            if i % FILAS_POR_ENVIO == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    respuesta = app.response_class(generar(), mimetype=FORMATOS_STREAM[formato])
+    respuesta.call_on_close(filas.close)
+    if formato == 'csv':
+        respuesta.headers['Content-Disposition'] = f'attachment; filename={nombre}.csv'
+    return respuesta
 
 # ------------------- USUARIOS -------------------
 @app.route('/usuarios/registrar', methods=['POST'])
@@ -14,13 +90,10 @@ def registrar_usuario():
         rol = data.get('rol')
         if not all([rut, nombre, correo, contrasena, rol]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             INSERT INTO USUARIOS (RUT, NOMBRE_COMPLETO, CORREO, CONTRASENA, ROL)
             VALUES (:rut, :nombre, :correo, :contrasena, :rol)
-        """, rut=rut, nombre=nombre, correo=correo, contrasena=contrasena, rol=rol)
-        connection.commit()
-        cursor.close()
+        """, rut=rut, nombre=nombre, correo=correo, contrasena=contrasena, rol=rol, commit=True)
         return jsonify({'mensaje': 'Usuario registrado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -33,12 +106,9 @@ def login_usuario():
         contrasena = data.get('contrasena')
         if not all([correo, contrasena]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        usuario = db.fetch_one("""
             SELECT ID_USUARIO, NOMBRE_COMPLETO, CORREO, ROL FROM USUARIOS WHERE CORREO = :correo AND CONTRASENA = :contrasena
         """, correo=correo, contrasena=contrasena)
-        usuario = cursor.fetchone()
-        cursor.close()
         if usuario:
             return jsonify({
                 'id_usuario': usuario[0],
@@ -54,11 +124,10 @@ def login_usuario():
 @app.route('/usuarios', methods=['GET'])
 def obtener_usuarios():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_USUARIO, RUT, NOMBRE_COMPLETO, CORREO, ROL, FECHA_REGISTRO FROM USUARIOS")
-        columns = [col[0].lower() for col in cursor.description]
-        usuarios = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
+        sql = "SELECT ID_USUARIO, RUT, NOMBRE_COMPLETO, CORREO, ROL, FECHA_REGISTRO FROM USUARIOS"
+        if request.args.get('format'):
+            return respuesta_stream('usuarios', sql)
+        usuarios = db.fetch_all(sql, as_dict=True)
         return jsonify({'usuarios': usuarios})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -66,10 +135,7 @@ def obtener_usuarios():
 @app.route('/usuarios/<int:id_usuario>', methods=['GET'])
 def obtener_usuario(id_usuario):
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_USUARIO, RUT, NOMBRE_COMPLETO, CORREO, ROL, FECHA_REGISTRO FROM USUARIOS WHERE ID_USUARIO = :id", id=id_usuario)
-        row = cursor.fetchone()
-        cursor.close()
+        row = db.fetch_one("SELECT ID_USUARIO, RUT, NOMBRE_COMPLETO, CORREO, ROL, FECHA_REGISTRO FROM USUARIOS WHERE ID_USUARIO = :id", id=id_usuario)
         if row:
             columns = ['id_usuario', 'rut', 'nombre_completo', 'correo', 'rol', 'fecha_registro']
             return jsonify(dict(zip(columns, row)))
@@ -85,12 +151,9 @@ def actualizar_usuario(id_usuario):
         nombre = data.get('nombre_completo')
         correo = data.get('correo')
         rol = data.get('rol')
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             UPDATE USUARIOS SET NOMBRE_COMPLETO = :nombre, CORREO = :correo, ROL = :rol WHERE ID_USUARIO = :id
-        """, nombre=nombre, correo=correo, rol=rol, id=id_usuario)
-        connection.commit()
-        cursor.close()
+        """, nombre=nombre, correo=correo, rol=rol, id=id_usuario, commit=True)
         return jsonify({'mensaje': 'Usuario actualizado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -98,10 +161,7 @@ def actualizar_usuario(id_usuario):
 @app.route('/usuarios/<int:id_usuario>', methods=['DELETE'])
 def eliminar_usuario(id_usuario):
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM USUARIOS WHERE ID_USUARIO = :id", id=id_usuario)
-        connection.commit()
-        cursor.close()
+        db.execute("DELETE FROM USUARIOS WHERE ID_USUARIO = :id", id=id_usuario, commit=True)
         return jsonify({'mensaje': 'Usuario eliminado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -117,13 +177,11 @@ def crear_sucursal():
         region = data.get('region')
         if not nombre:
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             INSERT INTO SUCURSALES (NOMBRE, DIRECCION, COMUNA, REGION)
             VALUES (:nombre, :direccion, :comuna, :region)
-        """, nombre=nombre, direccion=direccion, comuna=comuna, region=region)
-        connection.commit()
-        cursor.close()
+        """, nombre=nombre, direccion=direccion, comuna=comuna, region=region, commit=True)
+        catalogo_cache.invalidate('sucursales')
         return jsonify({'mensaje': 'Sucursal creada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -131,22 +189,17 @@ def crear_sucursal():
 @app.route('/sucursales', methods=['GET'])
 def listar_sucursales():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_SUCURSAL, NOMBRE, DIRECCION, COMUNA, REGION FROM SUCURSALES")
-        columns = [col[0].lower() for col in cursor.description]
-        sucursales = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'sucursales': sucursales})
+        return respuesta_catalogo(
+            'sucursales', ('sucursales',),
+            lambda: db.fetch_all("SELECT ID_SUCURSAL, NOMBRE, DIRECCION, COMUNA, REGION FROM SUCURSALES", as_dict=True)
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/sucursales/<int:id_sucursal>', methods=['GET'])
 def obtener_sucursal(id_sucursal):
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_SUCURSAL, NOMBRE, DIRECCION, COMUNA, REGION FROM SUCURSALES WHERE ID_SUCURSAL = :id", id=id_sucursal)
-        row = cursor.fetchone()
-        cursor.close()
+        row = db.fetch_one("SELECT ID_SUCURSAL, NOMBRE, DIRECCION, COMUNA, REGION FROM SUCURSALES WHERE ID_SUCURSAL = :id", id=id_sucursal)
         if row:
             columns = ['id_sucursal', 'nombre', 'direccion', 'comuna', 'region']
             return jsonify(dict(zip(columns, row)))
@@ -163,12 +216,10 @@ def actualizar_sucursal(id_sucursal):
         direccion = data.get('direccion')
         comuna = data.get('comuna')
         region = data.get('region')
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             UPDATE SUCURSALES SET NOMBRE = :nombre, DIRECCION = :direccion, COMUNA = :comuna, REGION = :region WHERE ID_SUCURSAL = :id
-        """, nombre=nombre, direccion=direccion, comuna=comuna, region=region, id=id_sucursal)
-        connection.commit()
-        cursor.close()
+        """, nombre=nombre, direccion=direccion, comuna=comuna, region=region, id=id_sucursal, commit=True)
+        catalogo_cache.invalidate('sucursales', 'productos')
         return jsonify({'mensaje': 'Sucursal actualizada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -176,10 +227,8 @@ def actualizar_sucursal(id_sucursal):
 @app.route('/sucursales/<int:id_sucursal>', methods=['DELETE'])
 def eliminar_sucursal(id_sucursal):
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM SUCURSALES WHERE ID_SUCURSAL = :id", id=id_sucursal)
-        connection.commit()
-        cursor.close()
+        db.execute("DELETE FROM SUCURSALES WHERE ID_SUCURSAL = :id", id=id_sucursal, commit=True)
+        catalogo_cache.invalidate('sucursales', 'productos')
         return jsonify({'mensaje': 'Sucursal eliminada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -192,10 +241,8 @@ def crear_categoria():
         nombre = data.get('nombre')
         if not nombre:
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("INSERT INTO CATEGORIAS (NOMBRE) VALUES (:nombre)", nombre=nombre)
-        connection.commit()
-        cursor.close()
+        db.execute("INSERT INTO CATEGORIAS (NOMBRE) VALUES (:nombre)", nombre=nombre, commit=True)
+        catalogo_cache.invalidate('categorias')
         return jsonify({'mensaje': 'Categoría creada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -203,12 +250,10 @@ def crear_categoria():
 @app.route('/categorias', methods=['GET'])
 def listar_categorias():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_CATEGORIA, NOMBRE FROM CATEGORIAS")
-        columns = [col[0].lower() for col in cursor.description]
-        categorias = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'categorias': categorias})
+        return respuesta_catalogo(
+            'categorias', ('categorias',),
+            lambda: db.fetch_all("SELECT ID_CATEGORIA, NOMBRE FROM CATEGORIAS", as_dict=True)
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -220,10 +265,8 @@ def crear_subcategoria():
         nombre = data.get('nombre')
         if not all([id_categoria, nombre]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("INSERT INTO SUBCATEGORIAS (ID_CATEGORIA, NOMBRE) VALUES (:id_categoria, :nombre)", id_categoria=id_categoria, nombre=nombre)
-        connection.commit()
-        cursor.close()
+        db.execute("INSERT INTO SUBCATEGORIAS (ID_CATEGORIA, NOMBRE) VALUES (:id_categoria, :nombre)", id_categoria=id_categoria, nombre=nombre, commit=True)
+        catalogo_cache.invalidate('subcategorias')
         return jsonify({'mensaje': 'Subcategoría creada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -231,24 +274,20 @@ def crear_subcategoria():
 @app.route('/subcategorias', methods=['GET'])
 def listar_subcategorias():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_SUBCATEGORIA, ID_CATEGORIA, NOMBRE FROM SUBCATEGORIAS")
-        columns = [col[0].lower() for col in cursor.description]
-        subcategorias = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'subcategorias': subcategorias})
+        return respuesta_catalogo(
+            'subcategorias', ('subcategorias',),
+            lambda: db.fetch_all("SELECT ID_SUBCATEGORIA, ID_CATEGORIA, NOMBRE FROM SUBCATEGORIAS", as_dict=True)
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/categorias/<int:id_categoria>/subcategorias', methods=['GET'])
 def listar_subcategorias_por_categoria(id_categoria):
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_SUBCATEGORIA, NOMBRE FROM SUBCATEGORIAS WHERE ID_CATEGORIA = :id_categoria", id_categoria=id_categoria)
-        columns = [col[0].lower() for col in cursor.description]
-        subcategorias = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'subcategorias': subcategorias})
+        return respuesta_catalogo(
+            'subcategorias', ('subcategorias', id_categoria),
+            lambda: db.fetch_all("SELECT ID_SUBCATEGORIA, NOMBRE FROM SUBCATEGORIAS WHERE ID_CATEGORIA = :id_categoria", id_categoria=id_categoria, as_dict=True)
+        )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -259,12 +298,10 @@ def actualizar_categoria(id_categoria):
         nombre = data.get('nombre')
         if not nombre:
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             UPDATE CATEGORIAS SET NOMBRE = :nombre WHERE ID_CATEGORIA = :id_categoria
-        """, nombre=nombre, id_categoria=id_categoria)
-        connection.commit()
-        cursor.close()
+        """, nombre=nombre, id_categoria=id_categoria, commit=True)
+        catalogo_cache.invalidate('categorias')
         return jsonify({'mensaje': 'Categoría actualizada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -272,20 +309,92 @@ def actualizar_categoria(id_categoria):
 @app.route('/categorias/<int:id_categoria>', methods=['DELETE'])
 def eliminar_categoria(id_categoria):
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM CATEGORIAS WHERE ID_CATEGORIA = :id_categoria", id_categoria=id_categoria)
-        connection.commit()
-        cursor.close()
+        db.execute("DELETE FROM CATEGORIAS WHERE ID_CATEGORIA = :id_categoria", id_categoria=id_categoria, commit=True)
+        catalogo_cache.invalidate('categorias', 'subcategorias')
         return jsonify({'mensaje': 'Categoría eliminada correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ------------------- PRODUCTOS -------------------
+def filtro_pagina_productos(condicion=None):
+    """Condición que limita la consulta a una página de productos (keyset sobre NOMBRE, ID_PRODUCTO).
+
+    Usa los parámetros limit/after del request; devuelve (None, {}) si no se pidió
+    paginación, para mantener la respuesta completa de siempre.
+    """
+    if 'limit' not in request.args and 'after' not in request.args:
+        return None, {}
+    limite = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('after'), 2)
+    condiciones = [condicion] if condicion else []
+    params = {'limite': limite}
+    if after:
+        condiciones.append("(pp.NOMBRE > :after_nombre OR (pp.NOMBRE = :after_nombre AND pp.ID_PRODUCTO > :after_id))")
+        params.update(after_nombre=after[0], after_id=after[1])
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    return f"""p.ID_PRODUCTO IN (
+                SELECT pp.ID_PRODUCTO FROM PRODUCTOS pp {where}
+                ORDER BY pp.NOMBRE, pp.ID_PRODUCTO
+                FETCH FIRST :limite ROWS ONLY
+            )""", params
+
+def respuesta_pagina_productos(clave, filas, params, condicion=None):
+    """Armar la respuesta con el cursor de la página siguiente y, si se pide con total=1, el total"""
+    respuesta = {clave: filas}
+    if params:
+        ids = {fila['id_producto'] for fila in filas}
+        respuesta['siguiente'] = encode_cursor(filas[-1]['nombre'], filas[-1]['id_producto']) if len(ids) == params['limite'] else None
+    if request.args.get('total') in ('1', 'true'):
+        where = f"WHERE {condicion}" if condicion else ''
+        respuesta['total'] = db.fetch_one(f"SELECT COUNT(*) FROM PRODUCTOS pp {where}")[0]
+    return respuesta
+
+SQL_INDICE_PRODUCTOS = """
+    SELECT ID_PRODUCTO, NOMBRE, MARCA, DESCRIPCION, CODIGO_INTERNO, CODIGO_FABRICANTE,
+           PRECIO_UNITARIO, ID_CATEGORIA, IMAGEN
+    FROM PRODUCTOS
+"""
+
+def cargar_indice_productos(conn=None):
+    """Construir el índice de búsqueda con todos los productos"""
+    indice_productos.cargar(db.fetch_all(SQL_INDICE_PRODUCTOS, as_dict=True, conn=conn, arraysize=1000))
+
+def indexar_producto(id_producto):
+    """Actualizar en el índice de búsqueda un producto recién creado o modificado"""
+    if not indice_productos.cargado:
+        return
+    producto = db.fetch_one(SQL_INDICE_PRODUCTOS + " WHERE ID_PRODUCTO = :id_producto", id_producto=id_producto, as_dict=True)
+    if producto:
+        indice_productos.actualizar(producto)
+    else:
+        indice_productos.eliminar(id_producto)
+
+@app.route('/productos/buscar', methods=['GET'])
+def buscar_productos():
+    """Búsqueda por nombre, marca, descripción o código, ordenada por relevancia (q, limit, after)"""
+    consulta = request.args.get('q', '').strip()
+    if not consulta:
+        return jsonify({'error': 'Falta el parámetro q'}), 400
+    try:
+        limite = parse_limit(request.args.get('limit'), default=20)
+        after = decode_cursor(request.args.get('after'), 3)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        if not indice_productos.cargado:
+            cargar_indice_productos()
+        total, resultados = indice_productos.buscar(consulta, limite, after)
+        productos = [dict(producto, puntaje=puntaje) for _, puntaje, producto in resultados]
+        siguiente = encode_cursor(*resultados[-1][0]) if len(resultados) == limite else None
+        return jsonify({'productos': productos, 'total': total, 'siguiente': siguiente})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/productos', methods=['GET'])
 def obtener_productos():
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
+        filtro, params = filtro_pagina_productos()
+        productos = db.fetch_all(f"""
             SELECT 
                 p.ID_PRODUCTO,
                 p.CODIGO_FABRICANTE,
@@ -302,20 +411,19 @@ def obtener_productos():
             FROM PRODUCTOS p
             LEFT JOIN INVENTARIO i ON p.ID_PRODUCTO = i.ID_PRODUCTO
             LEFT JOIN SUCURSALES s ON i.ID_SUCURSAL = s.ID_SUCURSAL
-            ORDER BY p.NOMBRE
-        """)
-        columns = [col[0].lower() for col in cursor.description]
-        productos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'productos': productos})
+            {'WHERE ' + filtro if filtro else ''}
+            ORDER BY p.NOMBRE, p.ID_PRODUCTO
+        """, params, as_dict=True)
+        return jsonify(respuesta_pagina_productos('productos', productos, params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/productos/<int:id_producto>', methods=['GET'])
 def obtener_producto(id_producto):
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
+        productos = db.fetch_all("""
             SELECT 
                 p.ID_PRODUCTO,
                 p.CODIGO_FABRICANTE,
@@ -333,10 +441,7 @@ def obtener_producto(id_producto):
             LEFT JOIN INVENTARIO i ON p.ID_PRODUCTO = i.ID_PRODUCTO
             LEFT JOIN SUCURSALES s ON i.ID_SUCURSAL = s.ID_SUCURSAL
             WHERE p.ID_PRODUCTO = :id_producto
-        """, id_producto=id_producto)
-        columns = [col[0].lower() for col in cursor.description]
-        productos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
+        """, id_producto=id_producto, as_dict=True)
         
         if productos:
             return jsonify(productos[0])
@@ -360,13 +465,16 @@ def crear_producto():
         imagen = data.get('imagen')
         if not all([codigo_fabricante, marca, codigo_interno, nombre, descripcion, precio_unitario, stock_min, id_categoria]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
-            INSERT INTO PRODUCTOS (CODIGO_FABRICANTE, MARCA, CODIGO_INTERNO, NOMBRE, DESCRIPCION, PRECIO_UNITARIO, STOCK_MIN, ID_CATEGORIA, IMAGEN)
-            VALUES (:codigo_fabricante, :marca, :codigo_interno, :nombre, :descripcion, :precio_unitario, :stock_min, :id_categoria, :imagen)
-        """, codigo_fabricante=codigo_fabricante, marca=marca, codigo_interno=codigo_interno, nombre=nombre, descripcion=descripcion, precio_unitario=precio_unitario, stock_min=stock_min, id_categoria=id_categoria, imagen=imagen)
+        with connection.cursor() as cursor:
+            id_producto = cursor.var(int)
+            cursor.execute("""
+                INSERT INTO PRODUCTOS (CODIGO_FABRICANTE, MARCA, CODIGO_INTERNO, NOMBRE, DESCRIPCION, PRECIO_UNITARIO, STOCK_MIN, ID_CATEGORIA, IMAGEN)
+                VALUES (:codigo_fabricante, :marca, :codigo_interno, :nombre, :descripcion, :precio_unitario, :stock_min, :id_categoria, :imagen)
+                RETURNING ID_PRODUCTO INTO :id_producto
+            """, codigo_fabricante=codigo_fabricante, marca=marca, codigo_interno=codigo_interno, nombre=nombre, descripcion=descripcion, precio_unitario=precio_unitario, stock_min=stock_min, id_categoria=id_categoria, imagen=imagen, id_producto=id_producto)
         connection.commit()
-        cursor.close()
+        catalogo_cache.invalidate('productos')
+        indexar_producto(id_producto.getvalue()[0])
         return jsonify({'mensaje': 'Producto creado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -386,8 +494,7 @@ def actualizar_producto(id_producto):
         imagen = data.get('imagen')
         if not all([codigo_fabricante, marca, codigo_interno, nombre, descripcion, precio_unitario, stock_min, id_categoria]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             UPDATE PRODUCTOS SET
                 CODIGO_FABRICANTE = :codigo_fabricante,
                 MARCA = :marca,
@@ -399,9 +506,9 @@ def actualizar_producto(id_producto):
                 ID_CATEGORIA = :id_categoria,
                 IMAGEN = :imagen
             WHERE ID_PRODUCTO = :id_producto
-        """, codigo_fabricante=codigo_fabricante, marca=marca, codigo_interno=codigo_interno, nombre=nombre, descripcion=descripcion, precio_unitario=precio_unitario, stock_min=stock_min, id_categoria=id_categoria, imagen=imagen, id_producto=id_producto)
-        connection.commit()
-        cursor.close()
+        """, codigo_fabricante=codigo_fabricante, marca=marca, codigo_interno=codigo_interno, nombre=nombre, descripcion=descripcion, precio_unitario=precio_unitario, stock_min=stock_min, id_categoria=id_categoria, imagen=imagen, id_producto=id_producto, commit=True)
+        catalogo_cache.invalidate('productos')
+        indexar_producto(id_producto)
         return jsonify({'mensaje': 'Producto actualizado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -409,10 +516,9 @@ def actualizar_producto(id_producto):
 @app.route('/productos/<int:id_producto>', methods=['DELETE'])
 def eliminar_producto(id_producto):
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM PRODUCTOS WHERE ID_PRODUCTO = :id_producto", id_producto=id_producto)
-        connection.commit()
-        cursor.close()
+        db.execute("DELETE FROM PRODUCTOS WHERE ID_PRODUCTO = :id_producto", id_producto=id_producto, commit=True)
+        catalogo_cache.invalidate('productos')
+        indice_productos.eliminar(id_producto)
         return jsonify({'mensaje': 'Producto eliminado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -424,17 +530,24 @@ def obtener_stock():
         id_sucursal = request.args.get('sucursal')
         id_producto = request.args.get('producto')
         cursor = connection.cursor()
+        # disponible = stock menos las reservas vigentes de checkouts sin pagar
         if id_sucursal and id_producto:
-            cursor.execute("SELECT STOCK FROM INVENTARIO WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto", sucursal=id_sucursal, producto=id_producto)
+            cursor.execute(SQL_STOCK_DISPONIBLE, id_sucursal=id_sucursal, id_producto=id_producto)
             row = cursor.fetchone()
             cursor.close()
             if row:
-                return jsonify({'stock': row[0]})
+                return jsonify({'stock': row[0], 'reservado': row[1], 'disponible': row[2]})
             else:
                 return jsonify({'error': 'No existe inventario para ese producto en la sucursal'}), 404
         elif id_sucursal:
-            cursor.execute("SELECT ID_PRODUCTO, STOCK FROM INVENTARIO WHERE ID_SUCURSAL = :sucursal", sucursal=id_sucursal)
-            productos = [{'id_producto': row[0], 'stock': row[1]} for row in cursor.fetchall()]
+            cursor.execute(f"""
+                SELECT i.ID_PRODUCTO, i.STOCK, {SQL_RESERVADO.format(alias='i')}
+                FROM INVENTARIO i WHERE i.ID_SUCURSAL = :sucursal
+            """, sucursal=id_sucursal)
+            productos = [
+                {'id_producto': row[0], 'stock': row[1], 'reservado': row[2], 'disponible': row[1] - row[2]}
+                for row in cursor.fetchall()
+            ]
             cursor.close()
             return jsonify({'inventario': productos})
         else:
@@ -450,27 +563,24 @@ def ingresar_stock():
     cantidad = data.get('cantidad')
     if not all([id_sucursal, id_producto, cantidad]):
         return jsonify({'error': 'Faltan datos'}), 400
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT STOCK FROM INVENTARIO 
-        WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto
-    """, sucursal=id_sucursal, producto=id_producto)
-    row = cursor.fetchone()
-    if row:
-        nuevo_stock = row[0] + cantidad
+    # Suma o crea la fila en un solo viaje; el MERGE evita la carrera entre leer y escribir
+    with connection.cursor() as cursor:
+        nuevo_stock = cursor.var(int)
         cursor.execute("""
-            UPDATE INVENTARIO 
-            SET STOCK = :stock 
-            WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto
-        """, stock=nuevo_stock, sucursal=id_sucursal, producto=id_producto)
-    else:
-        cursor.execute("""
-            INSERT INTO INVENTARIO (ID_SUCURSAL, ID_PRODUCTO, STOCK)
-            VALUES (:sucursal, :producto, :stock)
-        """, sucursal=id_sucursal, producto=id_producto, stock=cantidad)
+            BEGIN
+                MERGE INTO INVENTARIO i
+                USING (SELECT :sucursal AS ID_SUCURSAL, :producto AS ID_PRODUCTO FROM DUAL) s
+                ON (i.ID_SUCURSAL = s.ID_SUCURSAL AND i.ID_PRODUCTO = s.ID_PRODUCTO)
+                WHEN MATCHED THEN UPDATE SET i.STOCK = i.STOCK + :cantidad
+                WHEN NOT MATCHED THEN INSERT (ID_SUCURSAL, ID_PRODUCTO, STOCK)
+                    VALUES (s.ID_SUCURSAL, s.ID_PRODUCTO, :cantidad);
+                SELECT STOCK INTO :nuevo_stock FROM INVENTARIO
+                WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto;
+            END;
+        """, sucursal=id_sucursal, producto=id_producto, cantidad=cantidad, nuevo_stock=nuevo_stock)
     connection.commit()
-    cursor.close()
-    return jsonify({'mensaje': 'Stock ingresado correctamente'})
+    catalogo_cache.invalidate('productos')
+    return jsonify({'mensaje': 'Stock ingresado correctamente', 'stock': nuevo_stock.getvalue()})
 
 @app.route('/rebajar_stock', methods=['POST'])
 def rebajar_stock():
@@ -480,34 +590,137 @@ def rebajar_stock():
     cantidad = data.get('cantidad')
     if not all([id_sucursal, id_producto, cantidad]):
         return jsonify({'error': 'Faltan datos'}), 400
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT STOCK FROM INVENTARIO 
-        WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto
-    """, sucursal=id_sucursal, producto=id_producto)
-    row = cursor.fetchone()
-    if not row:
-        cursor.close()
-        return jsonify({'error': 'Producto no existe en la sucursal'}), 404
-    stock_actual = row[0]
-    if stock_actual < cantidad:
-        cursor.close()
-        return jsonify({'error': 'Stock insuficiente'}), 400
-    nuevo_stock = stock_actual - cantidad
-    cursor.execute("""
-        UPDATE INVENTARIO 
-        SET STOCK = :stock 
-        WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto
-    """, stock=nuevo_stock, sucursal=id_sucursal, producto=id_producto)
+    # Con la fila de control tomada ningún checkout puede reservar entre la validación y el UPDATE;
+    # la condición solo rebaja lo que no está reservado, así no quedan reservas sin stock
+    reservas.bloquear(connection, [{'id_producto': id_producto, 'id_sucursal': id_sucursal}])
+    with connection.cursor() as cursor:
+        nuevo_stock = cursor.var(int)
+        cursor.execute(f"""
+            UPDATE INVENTARIO i
+            SET i.STOCK = i.STOCK - :cantidad
+            WHERE i.ID_SUCURSAL = :sucursal AND i.ID_PRODUCTO = :producto
+              AND i.STOCK - {SQL_RESERVADO.format(alias='i')} >= :cantidad
+            RETURNING i.STOCK INTO :nuevo_stock
+        """, cantidad=cantidad, sucursal=id_sucursal, producto=id_producto, nuevo_stock=nuevo_stock)
+        actualizadas = cursor.rowcount
+    if not actualizadas:
+        # Solo en el caso de error se consulta para distinguir la causa
+        stock = db.fetch_one(SQL_STOCK_DISPONIBLE, id_sucursal=id_sucursal, id_producto=id_producto)
+        connection.rollback()
+        if not stock:
+            return jsonify({'error': 'Producto no existe en la sucursal'}), 404
+        return jsonify({'error': 'Stock insuficiente', 'stock': stock[0], 'reservado': stock[1], 'disponible': stock[2]}), 400
     connection.commit()
-    cursor.close()
-    return jsonify({'mensaje': 'Stock rebajado correctamente'})
+    catalogo_cache.invalidate('productos')
+    return jsonify({'mensaje': 'Stock rebajado correctamente', 'stock': nuevo_stock.getvalue()[0]})
+
+MAX_FILAS_LOTE = 100000
+
+# Al fijar, una fila que dejaría el stock bajo lo reservado no se actualiza (0 filas)
+SQL_MERGE_INVENTARIO = """
+    MERGE INTO INVENTARIO i
+    USING (SELECT :id_sucursal AS ID_SUCURSAL, :id_producto AS ID_PRODUCTO, :cantidad AS CANTIDAD FROM DUAL) s
+    ON (i.ID_SUCURSAL = s.ID_SUCURSAL AND i.ID_PRODUCTO = s.ID_PRODUCTO)
+    WHEN MATCHED THEN UPDATE SET i.STOCK = {nuevo_stock} {condicion}
+    WHEN NOT MATCHED THEN INSERT (ID_SUCURSAL, ID_PRODUCTO, STOCK)
+        VALUES (s.ID_SUCURSAL, s.ID_PRODUCTO, s.CANTIDAD)
+"""
+
+def leer_filas_lote():
+    """Filas del lote como lista de (número de fila, dict), desde JSON o CSV.
+
+    JSON: {"filas": [...]} o directamente una lista. CSV: archivo en el campo
+    "archivo" (multipart) o el cuerpo con Content-Type text/csv, con encabezado
+    id_sucursal,id_producto,cantidad.
+    """
+    archivo = request.files.get('archivo')
+    if archivo is not None or request.mimetype == 'text/csv':
+        texto = archivo.read().decode('utf-8-sig') if archivo is not None else request.get_data(as_text=True)
+        delimitador = ';' if ';' in texto.split('\n', 1)[0] else ','
+        lector = csv.DictReader(io.StringIO(texto), delimiter=delimitador)
+        # La fila 1 es el encabezado
+        return [(numero, {k.strip().lower(): v for k, v in fila.items() if k}) for numero, fila in enumerate(lector, start=2)]
+    data = request.get_json(silent=True)
+    filas = data.get('filas') if isinstance(data, dict) else data
+    if not isinstance(filas, list):
+        raise ValueError('Se esperaba una lista de filas (JSON) o un archivo CSV')
+    return list(enumerate(filas, start=1))
+
+@app.route('/inventario/lote', methods=['POST'])
+def ingresar_stock_lote():
+    """Carga masiva de inventario en una sola transacción.
+
+    modo=sumar (por defecto) suma la cantidad al stock como /ingresar_stock;
+    modo=fijar reemplaza el stock (sincronización con bodega) sin bajarlo de
+    lo reservado por checkouts sin pagar. Las filas inválidas o rechazadas por la base se informan una a una; con
+    todo_o_nada=1 cualquier error deshace el lote completo.
+    """
+    modo = request.args.get('modo', 'sumar')
+    if modo not in ('sumar', 'fijar'):
+        return jsonify({'error': 'modo debe ser sumar o fijar'}), 400
+    todo_o_nada = request.args.get('todo_o_nada') in ('1', 'true')
+    try:
+        filas = leer_filas_lote()
+    except (ValueError, UnicodeError, csv.Error) as e:
+        return jsonify({'error': str(e)}), 400
+    if len(filas) > MAX_FILAS_LOTE:
+        return jsonify({'error': f'El lote supera el máximo de {MAX_FILAS_LOTE} filas'}), 413
+
+    errores = []
+    validas = []
+    numeros = []
+    for numero, fila in filas:
+        try:
+            valores = {campo: int(fila[campo]) for campo in ('id_sucursal', 'id_producto', 'cantidad')}
+        except (KeyError, TypeError, ValueError):
+            errores.append({'fila': numero, 'error': 'Se requieren id_sucursal, id_producto y cantidad enteros'})
+            continue
+        if valores['cantidad'] < 0 or (modo == 'sumar' and valores['cantidad'] == 0):
+            errores.append({'fila': numero, 'error': 'Cantidad inválida'})
+            continue
+        validas.append(valores)
+        numeros.append(numero)
+
+    if errores and todo_o_nada:
+        return jsonify({'procesadas': 0, 'errores': errores}), 400
+    try:
+        errores_db = []
+        rechazadas = []
+        if validas:
+            if modo == 'sumar':
+                sql = SQL_MERGE_INVENTARIO.format(nuevo_stock='i.STOCK + s.CANTIDAD', condicion='')
+            else:
+                # Igual que en /rebajar_stock: sin reservas nuevas mientras se fija el stock
+                reservas.bloquear(connection, validas)
+                sql = SQL_MERGE_INVENTARIO.format(
+                    nuevo_stock='s.CANTIDAD',
+                    condicion=f"WHERE s.CANTIDAD >= {SQL_RESERVADO.format(alias='i')}")
+            errores_db, filas_por_registro = db.executemany(sql, validas, batcherrors=True, arraydmlrowcounts=True)
+            con_error = {e.offset for e in errores_db}
+            rechazadas = [i for i, n in enumerate(filas_por_registro) if not n and i not in con_error]
+        errores.extend({'fila': numeros[e.offset], 'error': e.message} for e in errores_db)
+        errores.extend({'fila': numeros[i], 'error': 'El stock no puede quedar bajo lo reservado'} for i in rechazadas)
+        if (errores_db or rechazadas) and todo_o_nada:
+            db.rollback()
+            return jsonify({'procesadas': 0, 'errores': sorted(errores, key=lambda e: e['fila'])}), 400
+        db.commit()
+        procesadas = len(validas) - len(errores_db) - len(rechazadas)
+        if procesadas:
+            catalogo_cache.invalidate('productos')
+        return jsonify({
+            'procesadas': procesadas,
+            'errores': sorted(errores, key=lambda e: e['fila'])
+        })
+    except Exception as e:
+        db.rollback()
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/inventario/detalle', methods=['GET'])
 def inventario_detallado():
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
+        con_stock = "EXISTS (SELECT 1 FROM INVENTARIO ii WHERE ii.ID_PRODUCTO = pp.ID_PRODUCTO AND ii.STOCK > 0)"
+        filtro, params = filtro_pagina_productos(con_stock)
+        inventario = db.fetch_all(f"""
             SELECT 
                 p.ID_PRODUCTO,
                 p.NOMBRE,
@@ -525,12 +738,12 @@ def inventario_detallado():
             JOIN PRODUCTOS p ON i.ID_PRODUCTO = p.ID_PRODUCTO
             JOIN SUCURSALES s ON i.ID_SUCURSAL = s.ID_SUCURSAL
             WHERE i.STOCK > 0
-            ORDER BY p.NOMBRE, s.NOMBRE
-        """)
-        columns = [col[0].lower() for col in cursor.description]
-        inventario = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'inventario': inventario})
+            {'AND ' + filtro if filtro else ''}
+            ORDER BY p.NOMBRE, p.ID_PRODUCTO, s.NOMBRE
+        """, params, as_dict=True)
+        return jsonify(respuesta_pagina_productos('inventario', inventario, params, con_stock))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -538,8 +751,7 @@ def inventario_detallado():
 def obtener_productos_disponibles():
     """Endpoint específico para mostrar solo productos con stock disponible"""
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
+        return respuesta_catalogo('productos', ('productos', 'disponibles'), lambda: db.fetch_all("""
             SELECT DISTINCT
                 p.ID_PRODUCTO,
                 p.NOMBRE,
@@ -559,11 +771,7 @@ def obtener_productos_disponibles():
             WHERE i.STOCK > 0
             GROUP BY p.ID_PRODUCTO, p.NOMBRE, p.MARCA, p.DESCRIPCION, p.CODIGO_INTERNO, p.CODIGO_FABRICANTE, p.IMAGEN, p.PRECIO_UNITARIO, p.ID_CATEGORIA
             ORDER BY p.NOMBRE
-        """)
-        columns = [col[0].lower() for col in cursor.description]
-        productos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'productos': productos})
+        """, as_dict=True))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -574,15 +782,68 @@ def eliminar_inventario():
     if not id_sucursal or not id_producto:
         return jsonify({'error': 'Faltan parámetros'}), 400
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM INVENTARIO WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto", sucursal=id_sucursal, producto=id_producto)
-        connection.commit()
-        cursor.close()
+        db.execute("DELETE FROM INVENTARIO WHERE ID_SUCURSAL = :sucursal AND ID_PRODUCTO = :producto", sucursal=id_sucursal, producto=id_producto, commit=True)
+        catalogo_cache.invalidate('productos')
         return jsonify({'mensaje': 'Registro de inventario eliminado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # ------------------- CARRITOS -------------------
+def almacen_de(id_carrito):
+    """Almacén de invitados si el carrito vive ahí (ID desde ID_INVITADO_BASE); None si está en CARRITOS"""
+    if carritos_invitado is not None and es_carrito_invitado(id_carrito):
+        return carritos_invitado
+    return None
+
+def disponibles_lineas(pares):
+    """Disponible (stock menos reservas) por (id_producto, id_sucursal) en una sola consulta"""
+    if not pares:
+        return {}
+    binds = {}
+    tuplas = []
+    for n, (id_producto, id_sucursal) in enumerate(pares):
+        binds[f'p{n}'], binds[f's{n}'] = id_producto, id_sucursal
+        tuplas.append(f'(:p{n}, :s{n})')
+    filas = db.fetch_all(f"""
+        SELECT i.ID_PRODUCTO, i.ID_SUCURSAL, i.STOCK - {SQL_RESERVADO.format(alias='i')}
+        FROM INVENTARIO i
+        WHERE (i.ID_PRODUCTO, i.ID_SUCURSAL) IN ({', '.join(tuplas)})
+    """, binds)
+    return {(id_producto, id_sucursal): disponible for id_producto, id_sucursal, disponible in filas}
+
+def productos_carrito_invitado(carrito):
+    """Líneas del carrito del almacén con nombres y stock disponible, como las de la vista de CARRITOS"""
+    lineas = carrito['productos']
+    if not lineas:
+        return []
+    binds = {}
+    for n, linea in enumerate(lineas):
+        binds[f'p{n}'], binds[f's{n}'] = linea['id_producto'], linea['id_sucursal']
+    productos = ', '.join(f':p{n}' for n in range(len(lineas)))
+    sucursales = ', '.join(f':s{n}' for n in range(len(lineas)))
+    productos_info = {}
+    sucursales_info = {}
+    for tipo, id_fila, nombre, marca, imagen, descripcion in db.fetch_all(f"""
+        SELECT 'P', ID_PRODUCTO, NOMBRE, MARCA, IMAGEN, DESCRIPCION FROM PRODUCTOS WHERE ID_PRODUCTO IN ({productos})
+        UNION ALL
+        SELECT 'S', ID_SUCURSAL, NOMBRE, NULL, NULL, NULL FROM SUCURSALES WHERE ID_SUCURSAL IN ({sucursales})
+    """, binds):
+        if tipo == 'P':
+            productos_info[id_fila] = {'nombre': nombre, 'marca': marca, 'imagen': imagen, 'descripcion': descripcion}
+        else:
+            sucursales_info[id_fila] = nombre
+    # Igual que el JOIN de la consulta sobre CARRITO_PRODUCTOS: sin producto o sucursal la línea no se muestra
+    resultado = [
+        {**linea, **productos_info[linea['id_producto']], 'sucursal_nombre': sucursales_info[linea['id_sucursal']]}
+        for linea in lineas
+        if linea['id_producto'] in productos_info and linea['id_sucursal'] in sucursales_info
+    ]
+    disponibles = disponibles_lineas({(l['id_producto'], l['id_sucursal']) for l in resultado})
+    for linea in resultado:
+        linea['stock_disponible'] = disponibles.get((linea['id_producto'], linea['id_sucursal']), 0)
+    resultado.sort(key=lambda linea: linea['fecha_agregado'], reverse=True)
+    return resultado
+
 @app.route('/carritos', methods=['POST'])
 def crear_carrito():
     try:
@@ -593,8 +854,6 @@ def crear_carrito():
         
         print(f"🛒 Creando carrito - Usuario: {id_usuario}, Session: {session_id}")
         
-        cursor = connection.cursor()
-        
         # Validar que solo uno de los dos esté presente
         if id_usuario and session_id:
             return jsonify({'error': 'No se puede especificar usuario y session_id simultáneamente'}), 400
@@ -602,6 +861,18 @@ def crear_carrito():
         if not id_usuario and not session_id:
             return jsonify({'error': 'Debe especificar id_usuario o session_id'}), 400
         
+        # Los carritos de invitados viven en el almacén hasta que se convierten o se pagan
+        if session_id and carritos_invitado is not None:
+            carrito = carritos_invitado.crear(session_id, nombre_carrito)
+            print(f"✅ Carrito de invitado creado en {carritos_invitado.tipo} con ID: {carrito['id_carrito']}")
+            return jsonify({
+                'id_carrito': carrito['id_carrito'],
+                'mensaje': 'Carrito creado correctamente',
+                'tipo': 'invitado'
+            })
+
+        cursor = connection.cursor()
+        
         # Si es usuario registrado, verificar que existe
         if id_usuario:
             cursor.execute("SELECT COUNT(*) FROM USUARIOS WHERE ID_USUARIO = :id_usuario", id_usuario=id_usuario)
@@ -609,13 +880,14 @@ def crear_carrito():
                 return jsonify({'error': 'Usuario no encontrado'}), 404
         
         # Crear carrito
+        id_var = cursor.var(int)
         cursor.execute("""
             INSERT INTO CARRITOS (ID_USUARIO, SESSION_ID, NOMBRE_CARRITO, FECHA_CREACION, FECHA_ULTIMA_ACTIVIDAD)
             VALUES (:id_usuario, :session_id, :nombre_carrito, SYSDATE, SYSDATE)
             RETURNING ID_CARRITO INTO :id_carrito
-        """, id_usuario=id_usuario, session_id=session_id, nombre_carrito=nombre_carrito, id_carrito=cursor.var(int))
+        """, id_usuario=id_usuario, session_id=session_id, nombre_carrito=nombre_carrito, id_carrito=id_var)
         
-        id_carrito = cursor.var.getvalue()
+        id_carrito = id_var.getvalue()[0]
         connection.commit()
         cursor.close()
         
@@ -641,12 +913,17 @@ def obtener_carritos_usuario(id_usuario):
                 c.ESTADO,
                 c.FECHA_CREACION,
                 c.FECHA_ULTIMA_ACTIVIDAD,
-                COUNT(cp.ID_PRODUCTO) as NUM_PRODUCTOS,
-                SUM(cp.VALOR_TOTAL) as TOTAL_CARRITO
+                t.NUM_PRODUCTOS,
+                t.TOTAL_CARRITO
             FROM CARRITOS c
-            LEFT JOIN CARRITO_PRODUCTOS cp ON c.ID_CARRITO = cp.ID_CARRITO
+            -- Totales por carrito agregados sobre la PK de CARRITO_PRODUCTOS (ID_CARRITO, ...),
+            -- sin agrupar por las columnas de la cabecera
+            OUTER APPLY (
+                SELECT COUNT(*) as NUM_PRODUCTOS, SUM(cp.VALOR_TOTAL) as TOTAL_CARRITO
+                FROM CARRITO_PRODUCTOS cp
+                WHERE cp.ID_CARRITO = c.ID_CARRITO
+            ) t
             WHERE c.ID_USUARIO = :id_usuario AND c.ESTADO = 'ACTIVO'
-            GROUP BY c.ID_CARRITO, c.NOMBRE_CARRITO, c.ESTADO, c.FECHA_CREACION, c.FECHA_ULTIMA_ACTIVIDAD
             ORDER BY c.FECHA_ULTIMA_ACTIVIDAD DESC
         """, id_usuario=id_usuario)
         
@@ -662,6 +939,11 @@ def obtener_carritos_usuario(id_usuario):
 def obtener_carrito_invitado(session_id):
     """Obtener carrito de invitado por session_id"""
     try:
+        if carritos_invitado is not None:
+            carrito = carritos_invitado.por_sesion(session_id)
+            if carrito:
+                return jsonify(resumen_carrito(carrito))
+        # Carritos de invitados creados antes del almacén (o con CARRITOS_INVITADO=oracle)
         cursor = connection.cursor()
         cursor.execute("""
             SELECT 
@@ -693,15 +975,15 @@ def obtener_carrito_invitado(session_id):
 def actualizar_actividad_carrito(id_carrito):
     """Actualizar fecha de última actividad del carrito"""
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
-            UPDATE CARRITOS 
-            SET FECHA_ULTIMA_ACTIVIDAD = SYSDATE 
-            WHERE ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        connection.commit()
-        cursor.close()
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            almacen.modificar(id_carrito, lambda carrito: None)
+            return jsonify({'mensaje': 'Actividad actualizada'})
+        # Se escribe junto con los demás toques en el próximo flush
+        actividad_carritos.tocar(id_carrito)
         return jsonify({'mensaje': 'Actividad actualizada'})
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -709,6 +991,10 @@ def actualizar_actividad_carrito(id_carrito):
 def convertir_carrito_invitado(id_carrito, id_usuario):
     """Convertir carrito de invitado a carrito de usuario registrado"""
     try:
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            return convertir_carrito_almacen(almacen, id_carrito, id_usuario)
+
         cursor = connection.cursor()
         
         # Verificar que el carrito existe y es de invitado
@@ -740,12 +1026,27 @@ def convertir_carrito_invitado(id_carrito, id_usuario):
         """, id_usuario=id_usuario, id_carrito=id_carrito)
         
         connection.commit()
+        invalidar_carrito(id_carrito)
         cursor.close()
         
         return jsonify({'mensaje': 'Carrito convertido exitosamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def convertir_carrito_almacen(almacen, id_carrito, id_usuario):
+    """Escribir el carrito del almacén en CARRITOS ya convertido y sacarlo del almacén"""
+    carrito = almacen.obtener(id_carrito)
+    if not carrito:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
+    if not db.fetch_one("SELECT COUNT(*) FROM USUARIOS WHERE ID_USUARIO = :id_usuario", id_usuario=id_usuario)[0]:
+        return jsonify({'error': 'Usuario no encontrado'}), 404
+    id_nuevo, lineas = materializar_carrito(db, db.get_connection(), carrito, id_usuario=id_usuario, estado='CONVERTIDO')
+    db.commit()
+    almacen.eliminar(id_carrito, materializado=True)
+    print(f"✅ Carrito de invitado {id_carrito} convertido en el carrito {id_nuevo} ({lineas} productos)")
+    # El carrito cambia de ID al pasar a CARRITOS
+    return jsonify({'mensaje': 'Carrito convertido exitosamente', 'id_carrito': id_nuevo})
+
 @app.route('/carritos/<int:id_carrito>/productos', methods=['POST'])
 def agregar_producto_carrito(id_carrito):
     try:
@@ -758,6 +1059,19 @@ def agregar_producto_carrito(id_carrito):
         if not all([id_producto, id_sucursal, cantidad, valor_unitario, valor_total]):
             return jsonify({'error': 'Faltan datos'}), 400
         
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            def agregar(carrito):
+                existia = buscar_linea(carrito, id_producto) is not None
+                aplicar_linea(carrito, id_producto, id_sucursal, cantidad, valor_unitario, 1)
+                return existia
+            if almacen.modificar(id_carrito, agregar):
+                mensaje = 'Cantidad actualizada en el carrito'
+            else:
+                mensaje = 'Producto agregado al carrito'
+            print(f"✅ {mensaje} - Carrito de invitado: {id_carrito}, Producto: {id_producto}")
+            return jsonify({'mensaje': mensaje})
+
         cursor = connection.cursor()
         
         # Verificar que el carrito existe y está activo
@@ -787,9 +1101,10 @@ def agregar_producto_carrito(id_carrito):
             
             cursor.execute("""
                 UPDATE CARRITO_PRODUCTOS 
-                SET CANTIDAD = :cantidad, VALOR_TOTAL = :valor_total, FECHA_AGREGADO = SYSDATE
+                SET ID_SUCURSAL = :id_sucursal, CANTIDAD = :cantidad, VALOR_TOTAL = :valor_total, FECHA_AGREGADO = SYSDATE
                 WHERE ID_CARRITO = :id_carrito AND ID_PRODUCTO = :id_producto
-            """, cantidad=nueva_cantidad, valor_total=nuevo_valor_total, id_carrito=id_carrito, id_producto=id_producto)
+            """, id_sucursal=id_sucursal, cantidad=nueva_cantidad, valor_total=nuevo_valor_total,
+                id_carrito=id_carrito, id_producto=id_producto)
             
             mensaje = 'Cantidad actualizada en el carrito'
         else:
@@ -801,17 +1116,14 @@ def agregar_producto_carrito(id_carrito):
             
             mensaje = 'Producto agregado al carrito'
         
-        # Actualizar fecha de última actividad del carrito
-        cursor.execute("""
-            UPDATE CARRITOS 
-            SET FECHA_ULTIMA_ACTIVIDAD = SYSDATE 
-            WHERE ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        
         connection.commit()
         cursor.close()
+        invalidar_carrito(id_carrito)
+        actividad_carritos.tocar(id_carrito)
         print(f"✅ {mensaje} - Carrito: {id_carrito}, Producto: {id_producto}")
         return jsonify({'mensaje': mensaje})
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
     except Exception as e:
         print(f"❌ Error agregando producto al carrito: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -819,11 +1131,15 @@ def agregar_producto_carrito(id_carrito):
 @app.route('/carritos/<int:id_carrito>/productos/<int:id_producto>', methods=['DELETE'])
 def eliminar_producto_carrito(id_carrito, id_producto):
     try:
-        cursor = connection.cursor()
-        cursor.execute("DELETE FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito AND ID_PRODUCTO = :id_producto", id_carrito=id_carrito, id_producto=id_producto)
-        connection.commit()
-        cursor.close()
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            almacen.modificar(id_carrito, lambda carrito: quitar_linea(carrito, id_producto))
+            return jsonify({'mensaje': 'Producto eliminado del carrito'})
+        db.execute("DELETE FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito AND ID_PRODUCTO = :id_producto", id_carrito=id_carrito, id_producto=id_producto, commit=True)
+        invalidar_carrito(id_carrito)
         return jsonify({'mensaje': 'Producto eliminado del carrito'})
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -838,11 +1154,15 @@ def actualizar_cantidad_carrito(id_carrito, id_producto):
         if not nueva_cantidad or nueva_cantidad <= 0:
             return jsonify({'error': 'La cantidad debe ser mayor a 0'}), 400
         
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            return actualizar_cantidad_almacen(almacen, id_carrito, id_producto, nueva_cantidad)
+
         cursor = connection.cursor()
         
-        # Verificar stock disponible
-        cursor.execute("""
-            SELECT i.STOCK 
+        # Verificar stock disponible (descontando lo reservado por checkouts en curso)
+        cursor.execute(f"""
+            SELECT i.STOCK - {SQL_RESERVADO.format(alias='i')}
             FROM INVENTARIO i 
             JOIN CARRITO_PRODUCTOS cp ON i.ID_PRODUCTO = cp.ID_PRODUCTO AND i.ID_SUCURSAL = cp.ID_SUCURSAL
             WHERE cp.ID_CARRITO = :id_carrito AND cp.ID_PRODUCTO = :id_producto
@@ -866,86 +1186,279 @@ def actualizar_cantidad_carrito(id_carrito, id_producto):
             WHERE ID_CARRITO = :id_carrito AND ID_PRODUCTO = :id_producto
         """, cantidad=nueva_cantidad, id_carrito=id_carrito, id_producto=id_producto)
         
-        # Actualizar fecha de última actividad del carrito
-        cursor.execute("""
-            UPDATE CARRITOS 
-            SET FECHA_ULTIMA_ACTIVIDAD = SYSDATE 
-            WHERE ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        
         connection.commit()
         cursor.close()
+        invalidar_carrito(id_carrito)
+        actividad_carritos.tocar(id_carrito)
         
         return jsonify({'mensaje': 'Cantidad actualizada correctamente'})
         
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/carritos/<int:id_carrito>/productos', methods=['GET'])
-def listar_productos_carrito(id_carrito):
+def actualizar_cantidad_almacen(almacen, id_carrito, id_producto, nueva_cantidad):
+    """actualizar_cantidad_carrito para un carrito del almacén; el stock se sigue validando en Oracle"""
+    carrito = almacen.obtener(id_carrito)
+    if not carrito:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
+    linea = buscar_linea(carrito, id_producto)
+    stock = linea and db.fetch_one(SQL_STOCK_DISPONIBLE, id_producto=id_producto, id_sucursal=linea['id_sucursal'])
+    if not stock:
+        return jsonify({'error': 'Producto no encontrado en inventario'}), 400
+    if stock[2] < nueva_cantidad:
+        return jsonify({'error': f'No hay suficiente stock disponible. Stock actual: {stock[2]}'}), 400
+    almacen.modificar(id_carrito, lambda carrito: aplicar_linea(carrito, id_producto, None, nueva_cantidad, None, 0))
+    return jsonify({'mensaje': 'Cantidad actualizada correctamente'})
+
+MAX_OPERACIONES_CARRITO = 500
+
+# sumar=1 suma la cantidad a la línea existente; sumar=0 la reemplaza
+SQL_MERGE_CARRITO = """
+    MERGE INTO CARRITO_PRODUCTOS cp
+    USING (SELECT :id_carrito AS ID_CARRITO, :id_producto AS ID_PRODUCTO, :id_sucursal AS ID_SUCURSAL,
+                  :cantidad AS CANTIDAD, :valor_unitario AS VALOR_UNITARIO, :sumar AS SUMAR FROM DUAL) s
+    ON (cp.ID_CARRITO = s.ID_CARRITO AND cp.ID_PRODUCTO = s.ID_PRODUCTO)
+    WHEN MATCHED THEN UPDATE SET
+        cp.ID_SUCURSAL = NVL(s.ID_SUCURSAL, cp.ID_SUCURSAL),
+        cp.CANTIDAD = CASE WHEN s.SUMAR = 1 THEN cp.CANTIDAD + s.CANTIDAD ELSE s.CANTIDAD END,
+        cp.VALOR_UNITARIO = NVL(s.VALOR_UNITARIO, cp.VALOR_UNITARIO),
+        cp.VALOR_TOTAL = CASE WHEN s.SUMAR = 1 THEN cp.CANTIDAD + s.CANTIDAD ELSE s.CANTIDAD END
+                         * NVL(s.VALOR_UNITARIO, cp.VALOR_UNITARIO),
+        cp.FECHA_AGREGADO = SYSDATE
+    WHEN NOT MATCHED THEN INSERT (ID_CARRITO, ID_PRODUCTO, ID_SUCURSAL, CANTIDAD, VALOR_UNITARIO, VALOR_TOTAL, FECHA_AGREGADO)
+        VALUES (s.ID_CARRITO, s.ID_PRODUCTO, s.ID_SUCURSAL, s.CANTIDAD, s.VALOR_UNITARIO,
+                s.CANTIDAD * s.VALOR_UNITARIO, SYSDATE)
+"""
+
+@app.route('/carritos/<int:id_carrito>/productos', methods=['PATCH'])
+def modificar_productos_carrito(id_carrito):
+    """Aplicar varias operaciones sobre el carrito en una sola transacción.
+
+    Cuerpo: {"operaciones": [{"op": "agregar"|"fijar"|"eliminar", "id_producto",
+    "cantidad", "id_sucursal", "valor_unitario"}, ...]}. Todas se aplican o
+    ninguna: una operación inválida, una línea inexistente para fijar o un
+    producto sin stock disponible deshacen el lote completo.
+    """
+    data = request.get_json(silent=True)
+    operaciones = data.get('operaciones') if isinstance(data, dict) else data
+    if not isinstance(operaciones, list) or not operaciones:
+        return jsonify({'error': 'Se esperaba una lista de operaciones'}), 400
+    if len(operaciones) > MAX_OPERACIONES_CARRITO:
+        return jsonify({'error': f'El lote supera el máximo de {MAX_OPERACIONES_CARRITO} operaciones'}), 413
+
+    upserts, eliminados, errores = combinar_operaciones_carrito(operaciones)
+    if errores:
+        return jsonify({'error': 'Operaciones inválidas', 'errores': errores}), 400
+    almacen = almacen_de(id_carrito)
+    if almacen:
+        return modificar_productos_almacen(almacen, id_carrito, upserts, eliminados)
     try:
-        cursor = connection.cursor()
-        
-        # Verificar que el carrito existe y está activo
-        cursor.execute("""
-            SELECT c.ESTADO, c.ID_USUARIO, c.SESSION_ID, c.NOMBRE_CARRITO
-            FROM CARRITOS c WHERE c.ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        
-        carrito_info = cursor.fetchone()
-        if not carrito_info:
+        carrito = db.fetch_one("SELECT ESTADO FROM CARRITOS WHERE ID_CARRITO = :id_carrito", id_carrito=id_carrito)
+        if not carrito:
             return jsonify({'error': 'Carrito no encontrado'}), 404
-        
-        if carrito_info[0] != 'ACTIVO':
+        if carrito[0] != 'ACTIVO':
             return jsonify({'error': 'El carrito no está activo'}), 400
-        
-        # Obtener productos del carrito
-        cursor.execute("""
-            SELECT 
-                cp.ID_PRODUCTO,
-                cp.ID_SUCURSAL,
-                cp.CANTIDAD,
-                cp.VALOR_UNITARIO,
-                cp.VALOR_TOTAL,
-                cp.FECHA_AGREGADO,
-                p.NOMBRE,
-                p.MARCA,
-                p.IMAGEN,
-                p.DESCRIPCION,
-                s.NOMBRE as SUCURSAL_NOMBRE
-            FROM CARRITO_PRODUCTOS cp
-            JOIN PRODUCTOS p ON cp.ID_PRODUCTO = p.ID_PRODUCTO
-            JOIN SUCURSALES s ON cp.ID_SUCURSAL = s.ID_SUCURSAL
-            WHERE cp.ID_CARRITO = :id_carrito
-            ORDER BY cp.FECHA_AGREGADO DESC
-        """, id_carrito=id_carrito)
-        
-        columns = [col[0].lower() for col in cursor.description]
-        productos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        # Calcular total del carrito
-        total_carrito = sum(p['valor_total'] for p in productos)
-        
-        cursor.close()
-        
+
+        if eliminados:
+            db.executemany(
+                "DELETE FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito AND ID_PRODUCTO = :id_producto",
+                [{'id_carrito': id_carrito, 'id_producto': id_producto} for id_producto in eliminados]
+            )
+        if upserts:
+            errores_db, _ = db.executemany(SQL_MERGE_CARRITO, [
+                {'id_carrito': id_carrito,
+                 **{campo: op[campo] for campo in ('id_producto', 'id_sucursal', 'cantidad', 'valor_unitario', 'sumar')}}
+                for op in upserts
+            ], batcherrors=True)
+            if errores_db:
+                db.rollback()
+                # fijar sobre un producto que no está en el carrito intenta insertar sin sucursal/valor
+                return jsonify({'error': 'Operaciones rechazadas', 'errores': [
+                    {'operacion': upserts[e.offset]['operacion'], 'error': e.message} for e in errores_db
+                ]}), 400
+
+            # Las cantidades finales de las líneas tocadas no pueden superar el disponible
+            # (stock menos reservas); las demás líneas del carrito no bloquean el lote
+            modificados = {op['id_producto'] for op in upserts}
+            sin_stock = [row for row in db.fetch_all(f"""
+                SELECT cp.ID_PRODUCTO, cp.CANTIDAD, NVL(i.STOCK, 0) - {SQL_RESERVADO.format(alias='cp')}
+                FROM CARRITO_PRODUCTOS cp
+                LEFT JOIN INVENTARIO i ON i.ID_PRODUCTO = cp.ID_PRODUCTO AND i.ID_SUCURSAL = cp.ID_SUCURSAL
+                WHERE cp.ID_CARRITO = :id_carrito
+                  AND cp.CANTIDAD > NVL(i.STOCK, 0) - {SQL_RESERVADO.format(alias='cp')}
+            """, id_carrito=id_carrito) if row[0] in modificados]
+            if sin_stock:
+                db.rollback()
+                return jsonify({'error': 'No hay suficiente stock disponible', 'faltantes': [
+                    {'id_producto': row[0], 'cantidad': row[1], 'disponible': max(row[2], 0)} for row in sin_stock
+                ]}), 409
+
+        db.commit()
+        invalidar_carrito(id_carrito)
+        actividad_carritos.tocar(id_carrito)
+        print(f"✅ Carrito {id_carrito}: {len(upserts)} líneas actualizadas, {len(eliminados)} eliminadas")
         return jsonify({
-            'productos': productos,
-            'total_carrito': total_carrito,
-            'num_productos': len(productos),
-            'carrito_info': {
-                'id_carrito': id_carrito,
-                'estado': carrito_info[0],
-                'id_usuario': carrito_info[1],
-                'session_id': carrito_info[2],
-                'nombre_carrito': carrito_info[3]
-            }
+            'mensaje': 'Carrito actualizado',
+            'actualizadas': len(upserts),
+            'eliminadas': len(eliminados)
         })
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error modificando el carrito {id_carrito}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def aplicar_operaciones_carrito(carrito, upserts, eliminados):
+    """Aplicar a un carrito del almacén el resultado de combinar_operaciones_carrito; devuelve las operaciones rechazadas"""
+    for id_producto in eliminados:
+        quitar_linea(carrito, id_producto)
+    return [op for op in upserts if not aplicar_linea(
+        carrito, op['id_producto'], op['id_sucursal'], op['cantidad'], op['valor_unitario'], op['sumar'])]
+
+def modificar_productos_almacen(almacen, id_carrito, upserts, eliminados):
+    """PATCH /carritos/<id>/productos sobre un carrito del almacén, con las mismas validaciones (todo o nada)"""
+    try:
+        carrito = almacen.obtener(id_carrito)
+        if not carrito:
+            return jsonify({'error': 'Carrito no encontrado'}), 404
+        rechazadas = aplicar_operaciones_carrito(carrito, upserts, eliminados)
+        if rechazadas:
+            return jsonify({'error': 'Operaciones rechazadas', 'errores': [
+                {'operacion': op['operacion'], 'error': 'El producto no está en el carrito; se requieren id_sucursal y valor_unitario'}
+                for op in rechazadas
+            ]}), 400
+
+        modificadas = [buscar_linea(carrito, op['id_producto']) for op in upserts]
+        disponibles = disponibles_lineas({(l['id_producto'], l['id_sucursal']) for l in modificadas})
+        sin_stock = [l for l in modificadas if l['cantidad'] > disponibles.get((l['id_producto'], l['id_sucursal']), 0)]
+        if sin_stock:
+            return jsonify({'error': 'No hay suficiente stock disponible', 'faltantes': [
+                {'id_producto': l['id_producto'], 'cantidad': l['cantidad'],
+                 'disponible': max(disponibles.get((l['id_producto'], l['id_sucursal']), 0), 0)} for l in sin_stock
+            ]}), 409
+
+        # Se aplican de nuevo sobre el estado actual del almacén; la reserva del checkout vuelve a validar el stock
+        almacen.modificar(id_carrito, lambda actual: aplicar_operaciones_carrito(actual, upserts, eliminados))
+        print(f"✅ Carrito de invitado {id_carrito}: {len(upserts)} líneas actualizadas, {len(eliminados)} eliminadas")
+        return jsonify({
+            'mensaje': 'Carrito actualizado',
+            'actualizadas': len(upserts),
+            'eliminadas': len(eliminados)
+        })
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
+    except Exception as e:
+        print(f"❌ Error modificando el carrito {id_carrito}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+COLUMNAS_LINEA_CARRITO = ('id_producto', 'id_sucursal', 'cantidad', 'valor_unitario', 'valor_total',
+                          'fecha_agregado', 'nombre', 'marca', 'imagen', 'descripcion', 'sucursal_nombre',
+                          'stock_disponible')
+
+# Cabecera, líneas con nombres y stock disponible, y totales en una sola consulta: los totales
+# salen de funciones analíticas y la cabecera se repite en cada fila (una fila sin líneas si
+# el carrito está vacío)
+SQL_VISTA_CARRITO = f"""
+    SELECT c.ESTADO, c.ID_USUARIO, c.SESSION_ID, c.NOMBRE_CARRITO,
+           cp.ID_PRODUCTO, cp.ID_SUCURSAL, cp.CANTIDAD, cp.VALOR_UNITARIO, cp.VALOR_TOTAL, cp.FECHA_AGREGADO,
+           p.NOMBRE, p.MARCA, p.IMAGEN, p.DESCRIPCION, s.NOMBRE AS SUCURSAL_NOMBRE,
+           NVL(i.STOCK, 0) - {SQL_RESERVADO.format(alias='cp')} AS STOCK_DISPONIBLE,
+           COUNT(cp.ID_PRODUCTO) OVER () AS NUM_PRODUCTOS,
+           NVL(SUM(cp.VALOR_TOTAL) OVER (), 0) AS TOTAL_CARRITO
+    FROM CARRITOS c
+    LEFT JOIN (CARRITO_PRODUCTOS cp
+               JOIN PRODUCTOS p ON p.ID_PRODUCTO = cp.ID_PRODUCTO
+               JOIN SUCURSALES s ON s.ID_SUCURSAL = cp.ID_SUCURSAL)
+        ON cp.ID_CARRITO = c.ID_CARRITO
+    LEFT JOIN INVENTARIO i ON i.ID_PRODUCTO = cp.ID_PRODUCTO AND i.ID_SUCURSAL = cp.ID_SUCURSAL
+    WHERE c.ID_CARRITO = :id_carrito
+    ORDER BY cp.FECHA_AGREGADO DESC
+"""
+
+class CarritoNoEncontrado(Exception):
+    """El carrito no existe en CARRITOS; se lanza para que la ausencia no quede en caché"""
+
+def cargar_vista_carrito(id_carrito):
+    """Carrito completo de CARRITOS en un viaje a la base"""
+    filas = db.fetch_all(SQL_VISTA_CARRITO, id_carrito=id_carrito)
+    if not filas:
+        raise CarritoNoEncontrado(id_carrito)
+    estado, id_usuario, session_id, nombre_carrito = filas[0][:4]
+    return {
+        'carrito_info': {
+            'id_carrito': id_carrito,
+            'estado': estado,
+            'id_usuario': id_usuario,
+            'session_id': session_id,
+            'nombre_carrito': nombre_carrito
+        },
+        'lineas': [fila[4:16] for fila in filas if fila[4] is not None],
+        'num_productos': filas[0][16],
+        'total_carrito': filas[0][17]
+    }
+
+def invalidar_carrito(id_carrito):
+    """Descartar la vista guardada del carrito; la llaman las rutas que lo modifican"""
+    carritos_cache.discard(('carrito', int(id_carrito)))
+
+@app.route('/carritos/<int:id_carrito>/productos', methods=['GET'])
+def listar_productos_carrito(id_carrito):
+    try:
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            carrito = almacen.obtener(id_carrito)
+            if not carrito:
+                return jsonify({'error': 'Carrito no encontrado'}), 404
+            productos = productos_carrito_invitado(carrito)
+            return jsonify({
+                'productos': productos,
+                'total_carrito': sum(p['valor_total'] for p in productos),
+                'num_productos': len(productos),
+                'carrito_info': {
+                    'id_carrito': id_carrito,
+                    'estado': carrito['estado'],
+                    'id_usuario': None,
+                    'session_id': carrito['session_id'],
+                    'nombre_carrito': carrito['nombre_carrito']
+                }
+            })
+
+        try:
+            vista, version, _ = carritos_cache.get_or_load_entry(
+                ('carrito', id_carrito), lambda: cargar_vista_carrito(id_carrito))
+        except CarritoNoEncontrado:
+            return jsonify({'error': 'Carrito no encontrado'}), 404
+
+        if vista['carrito_info']['estado'] != 'ACTIVO':
+            return jsonify({'error': 'El carrito no está activo'}), 400
+
+        if request.if_none_match and request.if_none_match.contains_weak(version):
+            respuesta = app.response_class(status=304)
+        elif request.args.get('formato') == 'compacto':
+            # Las líneas como arreglos con los nombres de columna una sola vez
+            respuesta = jsonify({**vista, 'columnas': COLUMNAS_LINEA_CARRITO})
+        else:
+            respuesta = jsonify({
+                'productos': [dict(zip(COLUMNAS_LINEA_CARRITO, linea)) for linea in vista['lineas']],
+                'total_carrito': vista['total_carrito'],
+                'num_productos': vista['num_productos'],
+                'carrito_info': vista['carrito_info']
+            })
+        respuesta.set_etag(version, weak=True)
+        respuesta.headers['Cache-Control'] = 'no-cache'
+        return respuesta
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/carritos/<int:id_carrito>/vaciar', methods=['DELETE'])
 def vaciar_carrito(id_carrito):
     try:
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            almacen.modificar(id_carrito, lambda carrito: carrito.update(productos=[]))
+            return jsonify({'mensaje': 'Carrito vaciado correctamente'})
+
         cursor = connection.cursor()
         
         # Verificar que el carrito existe y está activo
@@ -960,98 +1473,123 @@ def vaciar_carrito(id_carrito):
         
         cursor.execute("DELETE FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito", id_carrito=id_carrito)
         
-        # Actualizar fecha de última actividad
-        cursor.execute("""
-            UPDATE CARRITOS 
-            SET FECHA_ULTIMA_ACTIVIDAD = SYSDATE 
-            WHERE ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        
         connection.commit()
         cursor.close()
+        invalidar_carrito(id_carrito)
+        actividad_carritos.tocar(id_carrito)
         return jsonify({'mensaje': 'Carrito vaciado correctamente'})
+    except CarritoInvitadoNoEncontrado:
+        return jsonify({'error': 'Carrito no encontrado'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/carritos/limpiar_invitados', methods=['DELETE'])
 def limpiar_carritos_invitados_antiguos():
-    """Limpiar carritos de invitados con más de 30 días de inactividad"""
+    """Borrar ahora los carritos de invitados inactivos (PURGA_CARRITOS_DIAS, 30 por defecto) y sus productos.
+
+    Es la misma pasada que hace la purga de fondo (comun/limpieza.py): lotes con
+    commit por lote. El avance se ve en /diagnostico/purga.
+    """
     try:
-        cursor = connection.cursor()
-        
-        # Marcar carritos de invitados antiguos como eliminados
-        cursor.execute("""
-            UPDATE CARRITOS 
-            SET ESTADO = 'ELIMINADO' 
-            WHERE SESSION_ID IS NOT NULL 
-            AND FECHA_ULTIMA_ACTIVIDAD < SYSDATE - 30
-            AND ESTADO = 'ACTIVO'
-        """)
-        
-        carritos_limpiados = cursor.rowcount
-        connection.commit()
-        cursor.close()
-        
+        resultado = purga_carritos.ejecutar_ciclo()
+        if resultado is None:
+            return jsonify({'error': 'Ya hay una purga de carritos en curso', 'en_curso': purga_carritos.stats()['en_curso']}), 409
+        carritos_limpiados, lineas = resultado
         return jsonify({
-            'mensaje': f'Se limpiaron {carritos_limpiados} carritos de invitados antiguos'
+            'mensaje': f'Se limpiaron {carritos_limpiados} carritos de invitados antiguos',
+            'carritos': carritos_limpiados,
+            'productos': lineas
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/carritos/estadisticas', methods=['GET'])
 def estadisticas_carritos():
-    """Obtener estadísticas de carritos"""
+    """Obtener estadísticas de carritos.
+
+    Se leen de las vistas materializadas MV_RESUMEN_* (refrescadas cada minuto, ver
+    actualizar_estructura_rendimiento.sql); con ?fresh=1, o si las vistas no existen,
+    se calculan en vivo sobre las tablas.
+    """
     try:
-        cursor = connection.cursor()
-        
-        # Carritos activos por tipo
-        cursor.execute("""
-            SELECT 
-                CASE 
+        fresh = request.args.get('fresh') in ('1', 'true')
+        fuente = 'en_vivo'
+        tipos_carrito = None
+        if not fresh:
+            try:
+                resumen = db.fetch_one("""
+                    SELECT NVL(SUM(REGISTRADOS), 0), NVL(SUM(CANTIDAD - REGISTRADOS), 0)
+                    FROM MV_RESUMEN_CARRITOS WHERE ESTADO = 'ACTIVO'
+                """)
+                total_productos = db.fetch_one("""
+                    SELECT NVL(SUM(NUM_PRODUCTOS), 0) FROM MV_RESUMEN_CARRITO_PRODUCTOS WHERE ESTADO = 'ACTIVO'
+                """)[0]
+                carritos_top = db.fetch_all("""
+                    SELECT ID_CARRITO, NOMBRE_CARRITO, NUM_PRODUCTOS, TOTAL_VALOR
+                    FROM MV_RESUMEN_CARRITO_PRODUCTOS
+                    WHERE ESTADO = 'ACTIVO'
+                    ORDER BY NUM_PRODUCTOS DESC
+                    FETCH FIRST 5 ROWS ONLY
+                """)
+                # Mismo formato que la consulta en vivo: solo los tipos que tienen carritos
+                tipos_carrito = [(tipo, cantidad) for tipo, cantidad in
+                                 zip(('USUARIOS_REGISTRADOS', 'INVITADOS'), resumen) if cantidad]
+                fuente = 'resumen'
+            except Exception as e:
+                print(f"⚠️ Resumen de carritos no disponible, se calcula en vivo: {e}")
+        
+        if tipos_carrito is None:
+            cursor = connection.cursor()
+            
+            # Carritos activos por tipo
+            cursor.execute("""
+                SELECT 
+                    CASE 
+                        WHEN ID_USUARIO IS NOT NULL THEN 'USUARIOS_REGISTRADOS'
+                        ELSE 'INVITADOS'
+                    END as TIPO,
+                    COUNT(*) as CANTIDAD
+                FROM CARRITOS 
+                WHERE ESTADO = 'ACTIVO'
+                GROUP BY CASE 
                     WHEN ID_USUARIO IS NOT NULL THEN 'USUARIOS_REGISTRADOS'
                     ELSE 'INVITADOS'
-                END as TIPO,
-                COUNT(*) as CANTIDAD
-            FROM CARRITOS 
-            WHERE ESTADO = 'ACTIVO'
-            GROUP BY CASE 
-                WHEN ID_USUARIO IS NOT NULL THEN 'USUARIOS_REGISTRADOS'
-                ELSE 'INVITADOS'
-            END
-        """)
-        
-        tipos_carrito = cursor.fetchall()
-        
-        # Total de productos en carritos activos
-        cursor.execute("""
-            SELECT COUNT(*) as TOTAL_PRODUCTOS
-            FROM CARRITO_PRODUCTOS cp
-            JOIN CARRITOS c ON cp.ID_CARRITO = c.ID_CARRITO
-            WHERE c.ESTADO = 'ACTIVO'
-        """)
-        
-        total_productos = cursor.fetchone()[0]
-        
-        # Carritos con más productos
-        cursor.execute("""
-            SELECT 
-                c.ID_CARRITO,
-                c.NOMBRE_CARRITO,
-                COUNT(cp.ID_PRODUCTO) as NUM_PRODUCTOS,
-                SUM(cp.VALOR_TOTAL) as TOTAL_VALOR
-            FROM CARRITOS c
-            JOIN CARRITO_PRODUCTOS cp ON c.ID_CARRITO = cp.ID_CARRITO
-            WHERE c.ESTADO = 'ACTIVO'
-            GROUP BY c.ID_CARRITO, c.NOMBRE_CARRITO
-            ORDER BY NUM_PRODUCTOS DESC
-            FETCH FIRST 5 ROWS ONLY
-        """)
-        
-        carritos_top = cursor.fetchall()
-        
-        cursor.close()
+                END
+            """)
+            
+            tipos_carrito = cursor.fetchall()
+            
+            # Total de productos en carritos activos
+            cursor.execute("""
+                SELECT COUNT(*) as TOTAL_PRODUCTOS
+                FROM CARRITO_PRODUCTOS cp
+                JOIN CARRITOS c ON cp.ID_CARRITO = c.ID_CARRITO
+                WHERE c.ESTADO = 'ACTIVO'
+            """)
+            
+            total_productos = cursor.fetchone()[0]
+            
+            # Carritos con más productos
+            cursor.execute("""
+                SELECT 
+                    c.ID_CARRITO,
+                    c.NOMBRE_CARRITO,
+                    COUNT(cp.ID_PRODUCTO) as NUM_PRODUCTOS,
+                    SUM(cp.VALOR_TOTAL) as TOTAL_VALOR
+                FROM CARRITOS c
+                JOIN CARRITO_PRODUCTOS cp ON c.ID_CARRITO = cp.ID_CARRITO
+                WHERE c.ESTADO = 'ACTIVO'
+                GROUP BY c.ID_CARRITO, c.NOMBRE_CARRITO
+                ORDER BY NUM_PRODUCTOS DESC
+                FETCH FIRST 5 ROWS ONLY
+            """)
+            
+            carritos_top = cursor.fetchall()
+            
+            cursor.close()
         
         return jsonify({
+            'fuente': fuente,
             'tipos_carrito': [{'tipo': row[0], 'cantidad': row[1]} for row in tipos_carrito],
             'total_productos_en_carritos': total_productos,
             'carritos_con_mas_productos': [
@@ -1067,6 +1605,39 @@ def estadisticas_carritos():
         return jsonify({'error': str(e)}), 500
 
 # ------------------- PEDIDOS -------------------
+ERRORES_CHECKOUT = {
+    'CARRITO_NO_EXISTE': ('Carrito {id_carrito} no encontrado', 400),
+    'CARRITO_VACIO': ('El carrito está vacío', 400),
+    'USUARIO_NO_EXISTE': ('Usuario no encontrado', 400),
+    'STOCK_INSUFICIENTE': ('Stock disponible insuficiente para uno o más productos del carrito', 409)
+}
+
+def crear_pedido_plsql(id_usuario, id_carrito, direccion, metodo_pago, monto_total, id_carrito_invitado=None):
+    """Checkout completo en una llamada al procedimiento CHECKOUT_PEDIDO (un solo viaje a la base).
+
+    Si el carrito venía del almacén de invitados ya está escrito en la transacción
+    y el COMMIT del procedimiento lo confirma junto con el pedido.
+    """
+    with connection.cursor() as cursor:
+        id_detalle = cursor.var(int)
+        id_pedido = cursor.var(int)
+        resultado = cursor.var(str)
+        cursor.callproc('CHECKOUT_PEDIDO', [id_usuario, id_carrito, direccion, metodo_pago, monto_total,
+                                            id_detalle, id_pedido, resultado, reservas.ttl_minutos])
+    if resultado.getvalue() != 'OK':
+        mensaje, status = ERRORES_CHECKOUT.get(resultado.getvalue(), ('Error al crear el pedido', 500))
+        return jsonify({'error': mensaje.format(id_carrito=id_carrito)}), status
+    invalidar_carrito(id_carrito)
+    if id_carrito_invitado:
+        carritos_invitado.eliminar(id_carrito_invitado, materializado=True)
+    print(f"🎉 Pedido {id_pedido.getvalue()} creado exitosamente (PL/SQL)")
+    return jsonify({
+        'id_pedido': id_pedido.getvalue(),
+        'mensaje': 'Pedido creado correctamente',
+        'detalle_id': id_detalle.getvalue(),
+        'id_carrito': id_carrito
+    })
+
 @app.route('/pedidos', methods=['POST'])
 def crear_pedido():
     try:
@@ -1082,61 +1653,77 @@ def crear_pedido():
         if not all([id_usuario, id_carrito, direccion]):
             return jsonify({'error': 'Faltan datos requeridos: id_usuario, id_carrito, direccion'}), 400
         
+        # Crear pago asociado (usando WEBPAY como método por defecto ya que TRANSBANK no está en las restricciones)
+        metodo_pago_db = 'WEBPAY' if metodo_pago == 'TRANSBANK' else metodo_pago
+        
+        # Un carrito del almacén de invitados se escribe en CARRITOS dentro de la transacción del
+        # pedido (sin confirmar): si el checkout falla, el release del request lo deshace
+        id_carrito_invitado = None
+        almacen = almacen_de(id_carrito)
+        if almacen:
+            carrito = almacen.obtener(int(id_carrito))
+            if not carrito:
+                return jsonify({'error': ERRORES_CHECKOUT['CARRITO_NO_EXISTE'][0].format(id_carrito=id_carrito)}), 400
+            if not carrito['productos']:
+                return jsonify({'error': ERRORES_CHECKOUT['CARRITO_VACIO'][0]}), 400
+            id_carrito_invitado = carrito['id_carrito']
+            id_carrito, _ = materializar_carrito(db, db.get_connection(), carrito)
+            print(f"📦 Carrito de invitado {id_carrito_invitado} escrito en CARRITOS como {id_carrito}")
+
+        # ?modo=plsql|sentencias permite comparar ambos caminos (ver benchmark_checkout.py)
+        modo = request.args.get('modo') or ('plsql' if CHECKOUT_PLSQL else 'sentencias')
+        if modo == 'plsql':
+            return crear_pedido_plsql(id_usuario, id_carrito, direccion, metodo_pago_db, monto_total,
+                                      id_carrito_invitado)
+        
         cursor = connection.cursor()
         
-        # Verificar que el carrito existe en la tabla CARRITOS
-        cursor.execute("SELECT COUNT(*) FROM CARRITOS WHERE ID_CARRITO = :id_carrito", id_carrito=id_carrito)
-        carrito_exists = cursor.fetchone()[0]
+        # Verificar en una sola consulta que el carrito existe, que tiene productos y que el usuario existe
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM CARRITOS WHERE ID_CARRITO = :id_carrito),
+                (SELECT COUNT(*) FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito),
+                (SELECT COUNT(*) FROM USUARIOS WHERE ID_USUARIO = :id_usuario)
+            FROM DUAL
+        """, id_carrito=id_carrito, id_usuario=id_usuario)
+        carrito_exists, productos_count, usuario_exists = cursor.fetchone()
         
         if carrito_exists == 0:
             print(f"❌ Carrito {id_carrito} no existe en tabla CARRITOS")
             return jsonify({'error': f'Carrito {id_carrito} no encontrado'}), 400
         
-        # Verificar que el carrito tiene productos
-        cursor.execute("""
-            SELECT COUNT(*) FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito
-        """, id_carrito=id_carrito)
-        
-        productos_count = cursor.fetchone()[0]
         print(f"📦 Productos en carrito {id_carrito}: {productos_count}")
         
         if productos_count == 0:
             return jsonify({'error': 'El carrito está vacío'}), 400
         
-        # Verificar que el usuario existe
-        cursor.execute("SELECT COUNT(*) FROM USUARIOS WHERE ID_USUARIO = :id_usuario", id_usuario=id_usuario)
-        usuario_exists = cursor.fetchone()[0]
-        
         if usuario_exists == 0:
             return jsonify({'error': 'Usuario no encontrado'}), 400
         
-        # Obtener el siguiente ID para DETALLE_PEDIDO
-        cursor.execute("SELECT NVL(MAX(ID_DETALLE), 0) + 1 FROM DETALLE_PEDIDO")
-        next_id = cursor.fetchone()[0]
-        
-        # Obtener el siguiente ID para PEDIDOS
-        cursor.execute("SELECT NVL(MAX(ID_PEDIDO), 0) + 1 FROM PEDIDOS")
-        next_pedido_id = cursor.fetchone()[0]
-        
-        # Crear detalle de pedido
+        # Los IDs los asigna la base (identidad/secuencia) y se recuperan con RETURNING,
+        # así dos checkouts simultáneos no pueden obtener el mismo ID
+        id_detalle_var = cursor.var(int)
         cursor.execute("""
-            INSERT INTO DETALLE_PEDIDO (ID_DETALLE, ID_CARRITO, DIRECCION, ID_USUARIO, ESTADO) 
-            VALUES (:id_detalle, :id_carrito, :direccion, :id_usuario, 'PENDIENTE')
-        """, id_detalle=next_id, id_carrito=id_carrito, direccion=direccion, id_usuario=id_usuario)
+            INSERT INTO DETALLE_PEDIDO (ID_CARRITO, DIRECCION, ID_USUARIO, ESTADO) 
+            VALUES (:id_carrito, :direccion, :id_usuario, 'PENDIENTE')
+            RETURNING ID_DETALLE INTO :id_detalle
+        """, id_carrito=id_carrito, direccion=direccion, id_usuario=id_usuario, id_detalle=id_detalle_var)
+        next_id = id_detalle_var.getvalue()[0]
         
         print(f"✅ Detalle de pedido creado: {next_id}")
         
         # Crear pedido
+        id_pedido_var = cursor.var(int)
         cursor.execute("""
-            INSERT INTO PEDIDOS (ID_PEDIDO, ID_USUARIO, ID_DETALLE, FECHA_PEDIDO) 
-            VALUES (:id_pedido, :id_usuario, :id_detalle, SYSDATE)
-        """, id_pedido=next_pedido_id, id_usuario=id_usuario, id_detalle=next_id)
+            INSERT INTO PEDIDOS (ID_USUARIO, ID_DETALLE, FECHA_PEDIDO) 
+            VALUES (:id_usuario, :id_detalle, SYSDATE)
+            RETURNING ID_PEDIDO INTO :id_pedido
+        """, id_usuario=id_usuario, id_detalle=next_id, id_pedido=id_pedido_var)
         
-        id_pedido = next_pedido_id
+        id_pedido = id_pedido_var.getvalue()[0]
         print(f"✅ Pedido creado: {id_pedido}")
         
-        # Crear pago asociado (usando WEBPAY como método por defecto ya que TRANSBANK no está en las restricciones)
-        metodo_pago_db = 'WEBPAY' if metodo_pago == 'TRANSBANK' else metodo_pago
+        # Crear pago asociado
         cursor.execute("""
             INSERT INTO PAGOS (ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO) 
             VALUES (:id_pedido, :monto_total, :metodo_pago, 'PENDIENTE')
@@ -1144,21 +1731,30 @@ def crear_pedido():
         
         print(f"✅ Pago registrado para pedido: {id_pedido}")
         
-        # Registrar en bitácora
-        cursor.execute("""
-            INSERT INTO BITACORA (ID_USUARIO, ACCION, FECHA_ACCION)
-            VALUES (:id_usuario, 'Pedido creado #' || :id_pedido, SYSDATE)
-        """, id_usuario=id_usuario, id_pedido=id_pedido)
+        # Reservar el stock del carrito hasta que el pago se confirme o la reserva venza
+        faltantes = reservas.reservar(connection, id_pedido, id_carrito)
+        if faltantes:
+            connection.rollback()
+            cursor.close()
+            return jsonify({'error': ERRORES_CHECKOUT['STOCK_INSUFICIENTE'][0], 'faltantes': faltantes}), 409
         
         connection.commit()
         cursor.close()
+        # Las reservas del pedido cambian el stock disponible que muestra la vista del carrito
+        invalidar_carrito(id_carrito)
+        if id_carrito_invitado:
+            carritos_invitado.eliminar(id_carrito_invitado, materializado=True)
+        
+        # Registrar en bitácora (en segundo plano, fuera del tiempo de respuesta)
+        bitacora.registrar(f'Pedido creado #{id_pedido}', id_usuario=id_usuario)
         
         print(f"🎉 Pedido {id_pedido} creado exitosamente")
         
         return jsonify({
             'id_pedido': id_pedido, 
             'mensaje': 'Pedido creado correctamente',
-            'detalle_id': next_id
+            'detalle_id': next_id,
+            'id_carrito': id_carrito
         })
         
     except Exception as e:
@@ -1171,11 +1767,10 @@ def crear_pedido():
 @app.route('/pedidos', methods=['GET'])
 def listar_pedidos():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_PEDIDO, ID_USUARIO, FECHA_PEDIDO, ID_DETALLE FROM PEDIDOS")
-        columns = [col[0].lower() for col in cursor.description]
-        pedidos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
+        sql = "SELECT ID_PEDIDO, ID_USUARIO, FECHA_PEDIDO, ID_DETALLE FROM PEDIDOS"
+        if request.args.get('format'):
+            return respuesta_stream('pedidos', sql)
+        pedidos = db.fetch_all(sql, as_dict=True)
         return jsonify({'pedidos': pedidos})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1183,10 +1778,7 @@ def listar_pedidos():
 @app.route('/pedidos/<int:id_pedido>', methods=['GET'])
 def obtener_pedido(id_pedido):
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_PEDIDO, ID_USUARIO, FECHA_PEDIDO, ID_DETALLE FROM PEDIDOS WHERE ID_PEDIDO = :id_pedido", id_pedido=id_pedido)
-        row = cursor.fetchone()
-        cursor.close()
+        row = db.fetch_one("SELECT ID_PEDIDO, ID_USUARIO, FECHA_PEDIDO, ID_DETALLE FROM PEDIDOS WHERE ID_PEDIDO = :id_pedido", id_pedido=id_pedido)
         if row:
             columns = ['id_pedido', 'id_usuario', 'fecha_pedido', 'id_detalle']
             return jsonify(dict(zip(columns, row)))
@@ -1198,8 +1790,7 @@ def obtener_pedido(id_pedido):
 @app.route('/usuarios/<int:id_usuario>/pedidos', methods=['GET'])
 def listar_pedidos_usuario(id_usuario):
     try:
-        cursor = connection.cursor()
-        cursor.execute("""
+        pedidos = db.fetch_all("""
             SELECT 
                 p.ID_PEDIDO, 
                 p.FECHA_PEDIDO, 
@@ -1211,10 +1802,7 @@ def listar_pedidos_usuario(id_usuario):
             LEFT JOIN PAGOS pg ON p.ID_PEDIDO = pg.ID_PEDIDO
             WHERE p.ID_USUARIO = :id_usuario
             ORDER BY p.FECHA_PEDIDO DESC
-        """, id_usuario=id_usuario)
-        columns = [col[0].lower() for col in cursor.description]
-        pedidos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
+        """, id_usuario=id_usuario, as_dict=True)
         return jsonify({'pedidos': pedidos})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1226,10 +1814,7 @@ def actualizar_estado_pedido(id_pedido):
         estado = data.get('estado')
         if estado not in ['PENDIENTE', 'CONFIRMADO', 'ENVIADO', 'ENTREGADO', 'CANCELADO']:
             return jsonify({'error': 'Estado no válido'}), 400
-        cursor = connection.cursor()
-        cursor.execute("UPDATE DETALLE_PEDIDO SET ESTADO = :estado WHERE ID_DETALLE = (SELECT ID_DETALLE FROM PEDIDOS WHERE ID_PEDIDO = :id_pedido)", estado=estado, id_pedido=id_pedido)
-        connection.commit()
-        cursor.close()
+        db.execute("UPDATE DETALLE_PEDIDO SET ESTADO = :estado WHERE ID_DETALLE = (SELECT ID_DETALLE FROM PEDIDOS WHERE ID_PEDIDO = :id_pedido)", estado=estado, id_pedido=id_pedido, commit=True)
         return jsonify({'mensaje': 'Estado de pedido actualizado'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1245,13 +1830,10 @@ def registrar_pago():
         estado_pago = data.get('estado_pago')
         if not all([id_pedido, monto_total, metodo_pago, estado_pago]):
             return jsonify({'error': 'Faltan datos'}), 400
-        cursor = connection.cursor()
-        cursor.execute("""
+        db.execute("""
             INSERT INTO PAGOS (ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO)
             VALUES (:id_pedido, :monto_total, :metodo_pago, :estado_pago)
-        """, id_pedido=id_pedido, monto_total=monto_total, metodo_pago=metodo_pago, estado_pago=estado_pago)
-        connection.commit()
-        cursor.close()
+        """, id_pedido=id_pedido, monto_total=monto_total, metodo_pago=metodo_pago, estado_pago=estado_pago, commit=True)
         return jsonify({'mensaje': 'Pago registrado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1259,11 +1841,10 @@ def registrar_pago():
 @app.route('/pagos', methods=['GET'])
 def listar_pagos():
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_PAGO, ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO, FECHA_PAGO FROM PAGOS")
-        columns = [col[0].lower() for col in cursor.description]
-        pagos = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
+        sql = "SELECT ID_PAGO, ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO, FECHA_PAGO FROM PAGOS"
+        if request.args.get('format'):
+            return respuesta_stream('pagos', sql)
+        pagos = db.fetch_all(sql, as_dict=True)
         return jsonify({'pagos': pagos})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1271,10 +1852,7 @@ def listar_pagos():
 @app.route('/pagos/<int:id_pago>', methods=['GET'])
 def obtener_pago(id_pago):
     try:
-        cursor = connection.cursor()
-        cursor.execute("SELECT ID_PAGO, ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO, FECHA_PAGO FROM PAGOS WHERE ID_PAGO = :id_pago", id_pago=id_pago)
-        row = cursor.fetchone()
-        cursor.close()
+        row = db.fetch_one("SELECT ID_PAGO, ID_PEDIDO, MONTO_TOTAL, METODO_PAGO, ESTADO_PAGO, FECHA_PAGO FROM PAGOS WHERE ID_PAGO = :id_pago", id_pago=id_pago)
         if row:
             columns = ['id_pago', 'id_pedido', 'monto_total', 'metodo_pago', 'estado_pago', 'fecha_pago']
             return jsonify(dict(zip(columns, row)))
@@ -1292,7 +1870,6 @@ def actualizar_pago(id_pago):
         monto_total = data.get('monto_total')
         if not estado_pago and not metodo_pago and not monto_total:
             return jsonify({'error': 'No hay campos para actualizar'}), 400
-        cursor = connection.cursor()
         sets = []
         params = {'id_pago': id_pago}
         if estado_pago:
@@ -1305,11 +1882,9 @@ def actualizar_pago(id_pago):
             sets.append('MONTO_TOTAL = :monto_total')
             params['monto_total'] = monto_total
         set_clause = ', '.join(sets)
-        cursor.execute(f"""
+        db.execute(f"""
             UPDATE PAGOS SET {set_clause} WHERE ID_PAGO = :id_pago
-        """, params)
-        connection.commit()
-        cursor.close()
+        """, params, commit=True)
         return jsonify({'mensaje': 'Pago actualizado correctamente'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1317,19 +1892,56 @@ def actualizar_pago(id_pago):
 
 
 # ------------------- BITÁCORA -------------------
+def parse_fecha(valor, fin_de_dia=False):
+    """Fecha ISO (AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS); con fin_de_dia una fecha sin hora cubre el día completo"""
+    fecha = datetime.fromisoformat(valor)
+    if fin_de_dia and len(valor) == 10:
+        fecha += timedelta(days=1)
+    return fecha
+
 @app.route('/bitacora', methods=['GET'])
 def listar_bitacora():
+    """Bitácora de la más reciente a la más antigua.
+
+    Filtros: usuario, accion (prefijo), desde y hasta (fechas ISO, hasta inclusive).
+    Con limit/after se pagina por keyset sobre (FECHA_ACCION, ID_LOG).
+    """
     try:
-        id_usuario = request.args.get('usuario')
-        cursor = connection.cursor()
-        if id_usuario:
-            cursor.execute("SELECT ID_LOG, ID_USUARIO, ACCION, FECHA_ACCION FROM BITACORA WHERE ID_USUARIO = :id_usuario", id_usuario=id_usuario)
-        else:
-            cursor.execute("SELECT ID_LOG, ID_USUARIO, ACCION, FECHA_ACCION FROM BITACORA")
-        columns = [col[0].lower() for col in cursor.description]
-        logs = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        cursor.close()
-        return jsonify({'bitacora': logs})
+        condiciones = []
+        params = {}
+        if request.args.get('usuario'):
+            condiciones.append("ID_USUARIO = :id_usuario")
+            params['id_usuario'] = request.args.get('usuario')
+        if request.args.get('accion'):
+            condiciones.append("ACCION LIKE :prefijo ESCAPE '\\'")
+            prefijo = request.args.get('accion').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params['prefijo'] = prefijo + '%'
+        if request.args.get('desde'):
+            condiciones.append("FECHA_ACCION >= :desde")
+            params['desde'] = parse_fecha(request.args.get('desde'))
+        if request.args.get('hasta'):
+            condiciones.append("FECHA_ACCION < :hasta")
+            params['hasta'] = parse_fecha(request.args.get('hasta'), fin_de_dia=True)
+        paginar = 'limit' in request.args or 'after' in request.args
+        if paginar:
+            after = decode_cursor(request.args.get('after'), 2)
+            if after:
+                condiciones.append("(FECHA_ACCION < :after_fecha OR (FECHA_ACCION = :after_fecha AND ID_LOG < :after_id))")
+                params.update(after_fecha=datetime.fromisoformat(str(after[0])), after_id=after[1])
+        where = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        sql = f"SELECT ID_LOG, ID_USUARIO, ACCION, FECHA_ACCION FROM BITACORA{where} ORDER BY FECHA_ACCION DESC, ID_LOG DESC"
+        if request.args.get('format'):
+            return respuesta_stream('bitacora', sql, params)
+        if not paginar:
+            return jsonify({'bitacora': db.fetch_all(sql, params, as_dict=True)})
+        params['limite'] = parse_limit(request.args.get('limit'))
+        logs = db.fetch_all(sql + " FETCH FIRST :limite ROWS ONLY", params, as_dict=True)
+        siguiente = None
+        if len(logs) == params['limite']:
+            siguiente = encode_cursor(logs[-1]['fecha_accion'].isoformat(), logs[-1]['id_log'])
+        return jsonify({'bitacora': logs, 'siguiente': siguiente})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1368,5 +1980,70 @@ def diagnostico_carritos():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/diagnostico/db', methods=['GET'])
+def diagnostico_db():
+    """Estado del pool de conexiones y tiempos acumulados por consulta"""
+    try:
+        return jsonify({
+            'pool': db.pool_info(),
+            'consultas': db.stats.snapshot()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/diagnostico/bitacora', methods=['GET'])
+def diagnostico_bitacora():
+    """Métricas de la cola de escritura de BITACORA"""
+    return jsonify(bitacora.stats())
+
+@app.route('/diagnostico/reservas', methods=['GET'])
+def diagnostico_reservas():
+    """Reservas de stock activas y métricas del barrido de vencidas"""
+    try:
+        activas = db.fetch_one("""
+            SELECT COUNT(*), NVL(SUM(CANTIDAD), 0) FROM RESERVAS_STOCK
+            WHERE ESTADO = 'ACTIVA' AND FECHA_EXPIRACION > SYSDATE
+        """)
+        return jsonify({'activas': activas[0], 'unidades_reservadas': activas[1], **reservas.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/diagnostico/actividad', methods=['GET'])
+def diagnostico_actividad():
+    """Toques de actividad de carritos pendientes y escritos por lotes"""
+    return jsonify(actividad_carritos.stats())
+
+@app.route('/diagnostico/purga', methods=['GET'])
+def diagnostico_purga():
+    """Avance y métricas de la purga de carritos de invitados"""
+    try:
+        return jsonify({'pendientes': purga_carritos.pendientes(), **purga_carritos.stats()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/diagnostico/carritos_invitado', methods=['GET'])
+def diagnostico_carritos_invitado():
+    """Almacén de carritos de invitados (memoria o redis)"""
+    if carritos_invitado is None:
+        return jsonify({'tipo': 'oracle'})
+    try:
+        return jsonify(carritos_invitado.stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/diagnostico/cache', methods=['GET'])
+def diagnostico_cache():
+    """Contadores de la caché del catálogo y de la vista de carritos"""
+    return jsonify({'catalogo': catalogo_cache.stats(), 'carritos': carritos_cache.stats()})
+
 if __name__ == "__main__":
+    try:
+        with db.acquire() as conn:
+            cargar_indice_productos(conn)
+        print(f"Índice de búsqueda cargado: {len(indice_productos)} productos")
+    except Exception as e:
+        # Se vuelve a intentar en la primera búsqueda
+        print(f"No se pudo cargar el índice de búsqueda: {e}")
+    reservas.iniciar()
+    purga_carritos.iniciar()
     app.run()
\ No newline at end of file
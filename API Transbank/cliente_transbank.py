@@ -0,0 +1,162 @@
+"""
+Cliente Webpay Plus de larga vida: una sola sesión HTTP con keep-alive para
+todas las llamadas, timeouts, reintentos con jitter y métricas de latencia.
+
+Reemplaza a crear un Transaction(options) del SDK por request, que abría una
+conexión TLS nueva a Webpay en cada pago.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+WEBPAY_ENDPOINT = '/rswebpaytransaction/api/webpay/v1.2/transactions'
+HOSTS = {
+    'TEST': 'https://webpay3gint.transbank.cl',
+    'LIVE': 'https://webpay3g.transbank.cl'
+}
+# Muestras por operación para calcular p50/p99
+MUESTRAS_LATENCIA = 1000
+
+
+class ErrorTransbank(Exception):
+    """Respuesta de error de Webpay o falla de red tras agotar los reintentos"""
+
+    def __init__(self, mensaje, codigo=None):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.codigo = codigo
+
+
+def _no_enviada(error):
+    """La conexión falló antes de enviar el request: reintentar no puede duplicar nada"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    motivo = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(motivo, NewConnectionError)
+
+
+class ClienteWebpay:
+    """Cliente seguro entre hilos; se crea uno por proceso y se reutiliza.
+
+    Reintentos: status (GET) se reintenta ante cualquier error de red, timeout
+    o respuesta 5xx. create, commit y refund no son idempotentes en Webpay, así
+    que solo se reintentan si la conexión no llegó a establecerse.
+    """
+
+    def __init__(self, commerce_code, api_key, host, timeout_conexion=3, timeout_lectura=30,
+                 reintentos=2, espera_base=0.2, pool=20):
+        self.host = host.rstrip('/')
+        self.timeout = (timeout_conexion, timeout_lectura)
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._sesion = requests.Session()
+        self._sesion.headers.update({
+            'Tbk-Api-Key-Id': commerce_code,
+            'Tbk-Api-Key-Secret': api_key,
+            'Content-Type': 'application/json'
+        })
+        # El pool de urllib3 es seguro entre hilos y mantiene vivas hasta `pool` conexiones
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool, max_retries=0)
+        self._sesion.mount('https://', adaptador)
+        self._sesion.mount('http://', adaptador)
+        self._lock = threading.Lock()
+        self._metricas = {}
+
+    # ------------------- OPERACIONES -------------------
+    def crear(self, buy_order, session_id, amount, return_url):
+        return self._llamar('create', 'POST', WEBPAY_ENDPOINT, json={
+            'buy_order': buy_order,
+            'session_id': session_id,
+            'amount': amount,
+            'return_url': return_url
+        })
+
+    def confirmar(self, token):
+        return self._llamar('commit', 'PUT', f"{WEBPAY_ENDPOINT}/{token}")
+
+    def estado(self, token):
+        return self._llamar('status', 'GET', f"{WEBPAY_ENDPOINT}/{token}", idempotente=True)
+
+    def reembolsar(self, token, amount):
+        return self._llamar('refund', 'POST', f"{WEBPAY_ENDPOINT}/{token}/refunds", json={'amount': amount})
+
+    # ------------------- HTTP -------------------
+    def _llamar(self, operacion, metodo, ruta, json=None, idempotente=False):
+        intento = 0
+        while True:
+            inicio = time.perf_counter()
+            try:
+                response = self._sesion.request(metodo, self.host + ruta, json=json, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                self._registrar(operacion, inicio, error=True)
+                if intento < self.reintentos and (idempotente or _no_enviada(e)):
+                    intento = self._esperar_reintento(operacion, intento, e)
+                    continue
+                raise ErrorTransbank(f"Error de red en {operacion}: {e}") from e
+
+            self._registrar(operacion, inicio, error=response.status_code >= 400)
+            if response.status_code >= 500 and idempotente and intento < self.reintentos:
+                intento = self._esperar_reintento(operacion, intento, f"HTTP {response.status_code}")
+                continue
+            return self._procesar(response)
+
+    def _esperar_reintento(self, operacion, intento, motivo):
+        # Jitter completo: espera aleatoria entre 0 y base * 2^intento
+        espera = random.uniform(0, self.espera_base * 2 ** intento)
+        logger.warning(f"⚠️ Reintentando {operacion} de Transbank en {espera:.2f}s ({motivo})")
+        with self._lock:
+            self._metricas[operacion]['reintentos'] += 1
+        time.sleep(espera)
+        return intento + 1
+
+    @staticmethod
+    def _procesar(response):
+        try:
+            cuerpo = response.json() if response.text else {}
+        except ValueError:
+            cuerpo = {}
+        if response.status_code not in (200, 204):
+            mensaje = cuerpo.get('error_message') or cuerpo.get('description') or response.text
+            raise ErrorTransbank(mensaje, response.status_code)
+        return cuerpo
+
+    # ------------------- MÉTRICAS -------------------
+    def _registrar(self, operacion, inicio, error=False):
+        ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            metrica = self._metricas.get(operacion)
+            if metrica is None:
+                metrica = self._metricas[operacion] = {
+                    'llamadas': 0, 'errores': 0, 'reintentos': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'muestras': deque(maxlen=MUESTRAS_LATENCIA)
+                }
+            metrica['llamadas'] += 1
+            metrica['errores'] += int(error)
+            metrica['total_ms'] += ms
+            metrica['max_ms'] = max(metrica['max_ms'], ms)
+            metrica['muestras'].append(ms)
+
+    def stats(self):
+        with self._lock:
+            resultado = {}
+            for operacion, metrica in self._metricas.items():
+                muestras = sorted(metrica['muestras'])
+                resultado[operacion] = {
+                    'llamadas': metrica['llamadas'],
+                    'errores': metrica['errores'],
+                    'reintentos': metrica['reintentos'],
+                    'avg_ms': round(metrica['total_ms'] / metrica['llamadas'], 2),
+                    'p50_ms': round(muestras[len(muestras) // 2], 2),
+                    'p99_ms': round(muestras[min(len(muestras) - 1, int(len(muestras) * 0.99))], 2),
+                    'max_ms': round(metrica['max_ms'], 2)
+                }
+            return {'host': self.host, 'operaciones': resultado}
@@ -34,6 +34,21 @@ SIMULATION_SUCCESS_RATE = float(os.getenv('SIMULATION_SUCCESS_RATE', '0.6'))
 SIMULATION_PENDING_RATE = float(os.getenv('SIMULATION_PENDING_RATE', '0.2'))
 SIMULATION_FAILURE_RATE = float(os.getenv('SIMULATION_FAILURE_RATE', '0.2'))
 
+# Servidor Webpay simulado (webpay_simulado.py): latencia por operación como "mediana_ms,p99_ms"
+SIMULATION_HOST = os.getenv('SIMULATION_HOST', '127.0.0.1')
+SIMULATION_PORT = int(os.getenv('SIMULATION_PORT', '8888'))
+SIMULATION_LATENCIA = {
+    operacion: tuple(float(v) for v in os.getenv(f'SIMULATION_LATENCIA_{operacion.upper()}', defecto).split(','))
+    for operacion, defecto in (
+        ('create', '80,400'),
+        ('commit', '250,1500'),
+        ('status', '60,300'),
+        ('refund', '200,1200')
+    )
+}
+# Transacciones que el simulador mantiene en memoria (las más antiguas se descartan)
+SIMULATION_MAX_TRANSACCIONES = int(os.getenv('SIMULATION_MAX_TRANSACCIONES', '200000'))
+
 # URLs de Transbank
 TRANSBANK_URLS = {
     'integration': {
@@ -90,6 +105,10 @@ class Config:
     SIMULATION_SUCCESS_RATE = SIMULATION_SUCCESS_RATE
     SIMULATION_PENDING_RATE = SIMULATION_PENDING_RATE
     SIMULATION_FAILURE_RATE = SIMULATION_FAILURE_RATE
+    SIMULATION_HOST = SIMULATION_HOST
+    SIMULATION_PORT = SIMULATION_PORT
+    SIMULATION_LATENCIA = SIMULATION_LATENCIA
+    SIMULATION_MAX_TRANSACCIONES = SIMULATION_MAX_TRANSACCIONES
     
     # URLs de Transbank
     TRANSBANK_URLS = TRANSBANK_URLS
@@ -1,21 +1,24 @@
 from flask import Flask, request, jsonify, redirect
 from flask_cors import CORS
-import oracledb
 import os
+import sys
 from dotenv import load_dotenv
 import logging
+import json
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime
+import oracledb
+
+# El paquete compartido "comun" vive en la raíz del repositorio
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from comun.db import Database
+from comun.bitacora import BitacoraWriter
+from comun.reservas import ReservasStock
 
-# Importar correctamente la librería de Transbank
-try:
-    from transbank.webpay.webpay_plus.transaction import Transaction
-    from transbank.common.options import WebpayOptions
-    from transbank.common.integration_type import IntegrationType
-    TRANSBANK_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️  Transbank SDK no disponible: {e}")
-    TRANSBANK_AVAILABLE = False
+from cliente_transbank import ClienteWebpay, HOSTS
+from reconciliacion import ReconciliadorPagos
 
 load_dotenv()
 
@@ -34,41 +37,38 @@ COMMERCE_CODE = os.getenv('TRANSBANK_COMMERCE_CODE', '597055555532')
 API_KEY = os.getenv('TRANSBANK_API_KEY', '579B532A7440BB0C9079DED94D31EA1615BACEB56610332264630D42D0A36B1C')
 ENVIRONMENT = os.getenv('TRANSBANK_ENVIRONMENT', 'TEST')
 
-# Crear opciones de Transbank
-transbank_options = None
-if TRANSBANK_AVAILABLE:
-    try:
-        transbank_options = WebpayOptions(
-            commerce_code=COMMERCE_CODE,
-            api_key=API_KEY,
-            integration_type=IntegrationType.TEST if ENVIRONMENT == 'TEST' else IntegrationType.LIVE
-        )
-        logger.info(f"✅ Transbank configurado: {ENVIRONMENT} - {COMMERCE_CODE}")
-    except Exception as e:
-        logger.error(f"❌ Error configurando Transbank: {e}")
-        TRANSBANK_AVAILABLE = False
-
-# Configuración de base de datos Oracle
-DB_CONFIG = {
-    'user': os.getenv("usuario"),
-    'password': os.getenv("clave"),
-    'dsn': os.getenv("dsn"),
-    'config_dir': r"wallet",
-    'wallet_location': r"wallet",
-    'wallet_password': os.getenv("wallet_password")
-}
-
-# Variable global para la conexión
-connection = None
+# Cliente Webpay compartido por todos los requests (sesión HTTP con keep-alive).
+# TRANSBANK_HOST permite usar otro host, por ejemplo el servidor simulado
+# (webpay_simulado.py) para pruebas de carga
+TRANSBANK_HOST = os.getenv('TRANSBANK_HOST') or HOSTS['TEST' if ENVIRONMENT == 'TEST' else 'LIVE']
+cliente_webpay = ClienteWebpay(
+    COMMERCE_CODE,
+    API_KEY,
+    TRANSBANK_HOST,
+    timeout_conexion=float(os.getenv('TRANSBANK_TIMEOUT_CONEXION', '3')),
+    timeout_lectura=float(os.getenv('TRANSBANK_TIMEOUT_LECTURA', '30')),
+    reintentos=int(os.getenv('TRANSBANK_REINTENTOS', '2')),
+    pool=int(os.getenv('TRANSBANK_POOL', '20'))
+)
+TRANSBANK_AVAILABLE = bool(COMMERCE_CODE and API_KEY)
+logger.info(f"✅ Transbank configurado: {ENVIRONMENT} - {COMMERCE_CODE} - {TRANSBANK_HOST}")
+
+# Pool de conexiones Oracle compartido con las otras APIs
+db = Database.from_env()
+db.init_app(app)
+
+# Escritura de BITACORA en segundo plano, por lotes
+bitacora = BitacoraWriter(
+    db,
+    max_cola=int(os.getenv("BITACORA_MAX_COLA", "10000")),
+    lote=int(os.getenv("BITACORA_LOTE", "200")),
+    intervalo_ms=int(os.getenv("BITACORA_INTERVALO_MS", "500"))
+)
 
 def get_db_connection():
-    """Obtener conexión a la base de datos"""
-    global connection
+    """Obtener la conexión del request actual desde el pool"""
     try:
-        if connection is None or not connection.ping():
-            connection = oracledb.connect(**DB_CONFIG)
-            logger.info("✅ Conexión a Oracle establecida")
-        return connection
+        return db.get_connection()
     except Exception as e:
         logger.error(f"❌ Error conectando a Oracle: {e}")
         return None
@@ -76,25 +76,28 @@ def get_db_connection():
 def execute_db_query(query, params=None, fetch=False):
     """Ejecutar consulta en la base de datos de forma segura"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return None
-        
-        cursor = conn.cursor()
-        cursor.execute(query, params or {})
-        
+        if fetch == 'all':
+            return db.fetch_all(query, params or {})
         if fetch:
-            result = cursor.fetchall() if fetch == 'all' else cursor.fetchone()
-        else:
-            conn.commit()
-            result = True
-        
-        cursor.close()
-        return result
+            return db.fetch_one(query, params or {})
+        db.execute(query, params or {}, commit=True)
+        return True
     except Exception as e:
         logger.error(f"❌ Error en consulta DB: {e}")
         return None
 
+# Reservas de stock creadas en el checkout (API Interna): el pago las confirma o las libera.
+# El barrido de vencidas corre en la API Interna
+reservas = ReservasStock(db, ttl_minutos=int(os.getenv("RESERVA_TTL_MINUTOS", "20")))
+
+# Confirmaciones: Transaction.commit corre en un pool de hilos y el request espera
+# como máximo TRANSBANK_CONFIRMAR_ESPERA segundos antes de responder "processing"
+confirmaciones_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('TRANSBANK_CONFIRMAR_WORKERS', '8')),
+    thread_name_prefix='transbank-confirmar'
+)
+CONFIRMAR_ESPERA = float(os.getenv('TRANSBANK_CONFIRMAR_ESPERA', '8'))
+
 @app.route('/transbank/health', methods=['GET'])
 def health():
     """Health check completo"""
@@ -107,13 +110,16 @@ def health():
         'timestamp': datetime.now().isoformat(),
         'environment': ENVIRONMENT,
         'commerce_code': COMMERCE_CODE,
-        'transbank_sdk': TRANSBANK_AVAILABLE,
+        'transbank_configurado': TRANSBANK_AVAILABLE,
+        'transbank': cliente_webpay.stats(),
         'database': db_status,
+        'bitacora': bitacora.stats(),
         'endpoints': {
             'crear_transaccion': '/transbank/crear-transaccion',
             'confirmar': '/transbank/confirmar/{id_pedido}',
             'estado_pedido': '/transbank/estado-pedido/{id_pedido}',
-            'estadisticas': '/transbank/estadisticas'
+            'estadisticas': '/transbank/estadisticas',
+            'reconciliacion': '/transbank/reconciliacion'
         }
     })
 
@@ -123,8 +129,8 @@ def crear_transaccion():
     try:
         if not TRANSBANK_AVAILABLE:
             return jsonify({
-                'error': 'Transbank SDK no disponible',
-                'message': 'Instala la librería: pip install transbank-sdk'
+                'error': 'Transbank no configurado',
+                'message': 'Define TRANSBANK_COMMERCE_CODE y TRANSBANK_API_KEY'
             }), 500
         
         data = request.get_json()
@@ -158,8 +164,7 @@ def crear_transaccion():
         logger.info(f"💳 Creando transacción Transbank: Pedido {id_pedido}, Monto ${amount:,}")
         
         # Crear transacción con Transbank
-        transaction = Transaction(transbank_options)
-        response = transaction.create(
+        response = cliente_webpay.crear(
             buy_order=buy_order,
             session_id=session_id,
             amount=amount,
@@ -168,24 +173,24 @@ def crear_transaccion():
         
         logger.info(f"✅ Transacción creada - Token: {response.get('token', 'N/A')[:20]}...")
         
-        # Actualizar estado del pago a PROCESANDO
-        execute_db_query("""
+        # Actualizar estado del pago a PROCESANDO; el token y la hora quedan para la reconciliación.
+        # Solo desde PENDIENTE: un pago que la reconciliación ya dio por fallido liberó su reserva
+        actualizadas = db.execute("""
             UPDATE PAGOS 
-            SET ESTADO_PAGO = 'PROCESANDO'
-            WHERE ID_PEDIDO = :id_pedido
-        """, {'id_pedido': id_pedido})
+            SET ESTADO_PAGO = 'PROCESANDO',
+                TOKEN_WS = :token,
+                FECHA_PAGO = SYSDATE
+            WHERE ID_PEDIDO = :id_pedido AND ESTADO_PAGO = 'PENDIENTE'
+        """, id_pedido=id_pedido, token=response['token'], commit=True)
+        if not actualizadas:
+            logger.warning(f"⚠️ Pago del pedido {id_pedido} ya no está pendiente; transacción descartada")
+            return jsonify({'error': f'El pago del pedido {id_pedido} ya no está pendiente'}), 409
         
         # Registrar en bitácora
-        execute_db_query("""
-            INSERT INTO BITACORA (ID_USUARIO, ACCION, FECHA_ACCION)
-            SELECT p.ID_USUARIO, 
-                   'Transacción Transbank iniciada - Pedido #' || :id_pedido || ' - Token: ' || :token,
-                   SYSDATE
-            FROM PEDIDOS p WHERE p.ID_PEDIDO = :id_pedido
-        """, {
-            'id_pedido': id_pedido,
-            'token': response.get('token', 'N/A')[:20]
-        })
+        bitacora.registrar(
+            f"Transacción Transbank iniciada - Pedido #{id_pedido} - Token: {response.get('token', 'N/A')[:20]}",
+            id_pedido=id_pedido
+        )
         
         return jsonify({
             'success': True,
@@ -206,9 +211,164 @@ def crear_transaccion():
             'type': type(e).__name__
         }), 500
 
+# Resultados de reclamar_confirmacion cuando este request queda a cargo del token
+RECLAMO_NUEVO = 'NUEVO'
+RECLAMO_REINTENTO = 'REINTENTO'
+
+def reclamar_confirmacion(token, id_pedido):
+    """Registrar el token en TRANSBANK_CONFIRMACIONES para procesarlo una sola vez.
+
+    Devuelve RECLAMO_NUEVO si este request quedó a cargo de procesarlo, o la
+    fila (ESTADO, REDIRECCION) si el token ya se había recibido antes. Un token
+    que terminó en ERROR (falla nuestra, no de Transbank) se vuelve a reclamar
+    (RECLAMO_REINTENTO) para que el reintento del navegador lo procese de nuevo.
+    """
+    try:
+        db.execute("""
+            INSERT INTO TRANSBANK_CONFIRMACIONES (TOKEN, ID_PEDIDO, ESTADO)
+            VALUES (:token, :id_pedido, 'PROCESANDO')
+        """, token=token, id_pedido=id_pedido, commit=True)
+        return RECLAMO_NUEVO
+    except oracledb.IntegrityError:
+        # Solo un request gana el UPDATE condicional; los demás ven PROCESANDO y esperan
+        reclamadas = db.execute("""
+            UPDATE TRANSBANK_CONFIRMACIONES
+            SET ESTADO = 'PROCESANDO', REDIRECCION = NULL, FECHA_ACTUALIZACION = SYSDATE
+            WHERE TOKEN = :token AND ESTADO = 'ERROR'
+        """, token=token, commit=True)
+        if reclamadas:
+            logger.info(f"🔁 Reintentando confirmación con error previo: {token[:20]}...")
+            return RECLAMO_REINTENTO
+        return db.fetch_one(
+            "SELECT ESTADO, REDIRECCION FROM TRANSBANK_CONFIRMACIONES WHERE TOKEN = :token",
+            token=token
+        )
+    except oracledb.DatabaseError as e:
+        # Sin la tabla (actualizar_estructura_rendimiento.sql no aplicado) se procesa como antes
+        logger.warning(f"⚠️ No se pudo registrar la confirmación {token[:20]}: {e}")
+        return RECLAMO_NUEVO
+
+def guardar_respuesta_webpay(token, response):
+    """Guardar la respuesta de Webpay antes de tocar la base: si lo que sigue falla, el
+    reintento ya sabe que el commit se hizo y no lo repite"""
+    execute_db_query("""
+        UPDATE TRANSBANK_CONFIRMACIONES
+        SET RESPUESTA_WEBPAY = :respuesta, FECHA_ACTUALIZACION = SYSDATE
+        WHERE TOKEN = :token
+    """, {'respuesta': json.dumps(response, default=str), 'token': token})
+
+def respuesta_webpay_reintento(token):
+    """Respuesta de Webpay para un token reclamado tras un ERROR, sin repetir el commit.
+
+    Usa la respuesta guardada del commit o, si no alcanzó a guardarse, la consulta
+    de estado (como la reconciliación). Solo si Webpay dice que el token sigue
+    INITIALIZED el commit no llegó a hacerse y se hace ahora.
+    """
+    fila = execute_db_query(
+        "SELECT RESPUESTA_WEBPAY FROM TRANSBANK_CONFIRMACIONES WHERE TOKEN = :token",
+        {'token': token},
+        fetch='one'
+    )
+    if fila and fila[0]:
+        return json.loads(fila[0])
+    response = cliente_webpay.estado(token)
+    if response.get('status') == 'INITIALIZED':
+        response = cliente_webpay.confirmar(token)
+    return response
+
+def guardar_resultado_confirmacion(token, estado, redireccion):
+    execute_db_query("""
+        UPDATE TRANSBANK_CONFIRMACIONES
+        SET ESTADO = :estado, REDIRECCION = :redireccion, FECHA_ACTUALIZACION = SYSDATE
+        WHERE TOKEN = :token
+    """, {'estado': estado, 'redireccion': redireccion, 'token': token})
+
+def esperar_resultado_confirmacion(token, espera):
+    """Esperar (acotado) a que otro request termine de procesar el mismo token"""
+    limite = time.monotonic() + espera
+    while time.monotonic() < limite:
+        fila = execute_db_query(
+            "SELECT REDIRECCION FROM TRANSBANK_CONFIRMACIONES WHERE TOKEN = :token",
+            {'token': token},
+            fetch='one'
+        )
+        if fila and fila[0]:
+            return fila[0]
+        time.sleep(0.25)
+    return None
+
+def procesar_confirmacion(id_pedido, token, reintento=False):
+    """Confirmar con Transbank, actualizar la base y guardar la redirección resultante"""
+    with app.app_context():
+        estado = 'ERROR'
+        redireccion = f"http://localhost:5173/payment-success?order_id={id_pedido}&status=error&message=server_error"
+        try:
+            # Confirmar transacción con Transbank (una sola vez: Webpay rechaza un segundo commit)
+            if reintento:
+                response = respuesta_webpay_reintento(token)
+            else:
+                response = cliente_webpay.confirmar(token)
+            guardar_respuesta_webpay(token, response)
+            
+            logger.info(f"📊 Respuesta de confirmación: Status={response.get('status')}, Amount={response.get('amount')}")
+            
+            # Verificar el estado de la transacción
+            if response.get('status') == 'AUTHORIZED':
+                # PAGO EXITOSO
+                logger.info(f"✅ Pago autorizado para pedido {id_pedido}")
+                
+                # Actualizar base de datos
+                success = process_successful_payment(id_pedido, response)
+                
+                if success:
+                    # Redirigir a página de éxito
+                    auth_code = response.get('authorization_code', 'N/A')
+                    estado = 'EXITOSO'
+                    redireccion = f"http://localhost:5173/payment-success?order_id={id_pedido}&status=success&auth_code={auth_code}"
+                else:
+                    logger.error(f"❌ Error actualizando base de datos para pedido {id_pedido}")
+                    redireccion = f"http://localhost:5173/payment-success?order_id={id_pedido}&status=error&message=db_update_failed"
+            
+            else:
+                # PAGO FALLIDO
+                logger.warning(f"❌ Pago no autorizado para pedido {id_pedido}: {response.get('status')}")
+                
+                # Actualizar estado del pago, liberar el stock reservado y registrar en bitácora,
+                # en una transacción
+                db.execute("""
+                    UPDATE PAGOS 
+                    SET ESTADO_PAGO = 'FALLIDO', 
+                        FECHA_PAGO = SYSDATE 
+                    WHERE ID_PEDIDO = :id_pedido AND ESTADO_PAGO <> 'PAGADO'
+                """, id_pedido=id_pedido)
+                reservas.liberar(db.get_connection(), id_pedido)
+                bitacora.registrar(
+                    f"Pago Transbank fallido - Pedido #{id_pedido} - Status: {response.get('status', 'UNKNOWN')}",
+                    id_pedido=id_pedido,
+                    conn=db.get_connection()
+                )
+                db.commit()
+                
+                estado = 'FALLIDO'
+                redireccion = f"http://localhost:5173/payment-success?order_id={id_pedido}&status=failed&reason={response.get('status', 'unknown')}"
+        
+        except Exception as e:
+            logger.error(f"❌ Error confirmando transacción: {e}")
+            logger.error(traceback.format_exc())
+        
+        guardar_resultado_confirmacion(token, estado, redireccion)
+        return redireccion
+
 @app.route('/transbank/confirmar/<int:id_pedido>', methods=['POST', 'GET'])
 def confirmar_transaccion(id_pedido):
-    """Confirmar transacción después del pago en Transbank"""
+    """Confirmar transacción después del pago en Transbank.
+
+    Cada token se procesa una sola vez: los reintentos del navegador reciben la
+    misma redirección guardada en TRANSBANK_CONFIRMACIONES. Si Transbank tarda
+    más de CONFIRMAR_ESPERA segundos se redirige con status=processing y la
+    confirmación termina en segundo plano.
+    """
+    procesando = f"http://localhost:5173/payment-success?order_id={id_pedido}&status=processing"
     try:
         # Obtener token desde la respuesta de Transbank
         token = request.form.get('token_ws') or request.args.get('token_ws')
@@ -220,56 +380,22 @@ def confirmar_transaccion(id_pedido):
         logger.info(f"🔄 Confirmando transacción: Pedido {id_pedido}, Token: {token[:20]}...")
         
         if not TRANSBANK_AVAILABLE:
-            logger.error("❌ Transbank SDK no disponible")
+            logger.error("❌ Transbank no configurado")
             return redirect(f"http://localhost:5173/payment-success?order_id={id_pedido}&status=error&message=sdk_unavailable")
         
-        # Confirmar transacción con Transbank
-        transaction = Transaction(transbank_options)
-        response = transaction.commit(token)
+        reclamo = reclamar_confirmacion(token, id_pedido)
+        if reclamo not in (RECLAMO_NUEVO, RECLAMO_REINTENTO):
+            estado, redireccion = reclamo
+            logger.info(f"🔁 Confirmación repetida para pedido {id_pedido} (estado {estado})")
+            return redirect(redireccion or esperar_resultado_confirmacion(token, CONFIRMAR_ESPERA) or procesando)
         
-        logger.info(f"📊 Respuesta de confirmación: Status={response.get('status')}, Amount={response.get('amount')}")
-        
-        # Verificar el estado de la transacción
-        if response.get('status') == 'AUTHORIZED':
-            # PAGO EXITOSO
-            logger.info(f"✅ Pago autorizado para pedido {id_pedido}")
-            
-            # Actualizar base de datos
-            success = process_successful_payment(id_pedido, response)
-            
-            if success:
-                # Redirigir a página de éxito
-                auth_code = response.get('authorization_code', 'N/A')
-                return redirect(f"http://localhost:5173/payment-success?order_id={id_pedido}&status=success&auth_code={auth_code}")
-            else:
-                logger.error(f"❌ Error actualizando base de datos para pedido {id_pedido}")
-                return redirect(f"http://localhost:5173/payment-success?order_id={id_pedido}&status=error&message=db_update_failed")
-        
-        else:
-            # PAGO FALLIDO
-            logger.warning(f"❌ Pago no autorizado para pedido {id_pedido}: {response.get('status')}")
-            
-            # Actualizar estado del pago
-            execute_db_query("""
-                UPDATE PAGOS 
-                SET ESTADO_PAGO = 'FALLIDO', 
-                    FECHA_PAGO = SYSDATE 
-                WHERE ID_PEDIDO = :id_pedido
-            """, {'id_pedido': id_pedido})
-            
-            # Registrar en bitácora
-            execute_db_query("""
-                INSERT INTO BITACORA (ID_USUARIO, ACCION, FECHA_ACCION)
-                SELECT p.ID_USUARIO, 
-                       'Pago Transbank fallido - Pedido #' || :id_pedido || ' - Status: ' || :status,
-                       SYSDATE
-                FROM PEDIDOS p WHERE p.ID_PEDIDO = :id_pedido
-            """, {
-                'id_pedido': id_pedido,
-                'status': response.get('status', 'UNKNOWN')
-            })
-            
-            return redirect(f"http://localhost:5173/payment-success?order_id={id_pedido}&status=failed&reason={response.get('status', 'unknown')}")
+        futuro = confirmaciones_executor.submit(procesar_confirmacion, id_pedido, token,
+                                                reclamo == RECLAMO_REINTENTO)
+        try:
+            return redirect(futuro.result(timeout=CONFIRMAR_ESPERA))
+        except FuturesTimeoutError:
+            logger.warning(f"⏳ Transbank no respondió en {CONFIRMAR_ESPERA}s para pedido {id_pedido}; sigue en segundo plano")
+            return redirect(procesando)
         
     except Exception as e:
         logger.error(f"❌ Error confirmando transacción: {e}")
@@ -285,13 +411,19 @@ def process_successful_payment(id_pedido, response):
         
         cursor = conn.cursor()
         
-        # 1. Actualizar estado del pago
+        # 1. Actualizar estado del pago; si ya estaba PAGADO (otro token del mismo pedido)
+        #    no se repite nada, así el stock se rebaja una sola vez
         cursor.execute("""
             UPDATE PAGOS 
             SET ESTADO_PAGO = 'PAGADO', 
                 FECHA_PAGO = SYSDATE
-            WHERE ID_PEDIDO = :id_pedido
+            WHERE ID_PEDIDO = :id_pedido AND ESTADO_PAGO <> 'PAGADO'
         """, {'id_pedido': id_pedido})
+        if cursor.rowcount == 0:
+            conn.rollback()
+            cursor.close()
+            logger.info(f"🔁 Pedido {id_pedido} ya estaba pagado; no se vuelve a procesar")
+            return True
         
         # 2. Actualizar estado del pedido
         cursor.execute("""
@@ -311,34 +443,30 @@ def process_successful_payment(id_pedido, response):
         
         productos = cursor.fetchall()
         
-        # 4. Actualizar inventario (rebajar stock)
-        for producto in productos:
-            id_producto, id_sucursal, cantidad = producto
-            cursor.execute("""
-                UPDATE INVENTARIO 
-                SET STOCK = STOCK - :cantidad 
-                WHERE ID_PRODUCTO = :id_producto AND ID_SUCURSAL = :id_sucursal
-            """, {
-                'cantidad': cantidad,
-                'id_producto': id_producto,
-                'id_sucursal': id_sucursal
-            })
-            logger.info(f"📦 Stock actualizado: Producto {id_producto}, Sucursal {id_sucursal}, Cantidad -{cantidad}")
+        # 4. Actualizar inventario (rebajar stock) en un solo viaje, sin tomar lo reservado
+        #    por otros pedidos; el conteo por línea indica qué productos no alcanzaron
+        filas = [
+            {'cantidad': cantidad, 'id_producto': id_producto, 'id_sucursal': id_sucursal}
+            for id_producto, id_sucursal, cantidad in productos
+        ]
+        sin_stock = reservas.rebajar(conn, id_pedido, filas)
+        if sin_stock:
+            conn.rollback()
+            cursor.close()
+            registrar_sobreventa(conn, id_pedido, sin_stock)
+            return False
+        logger.info(f"📦 Stock actualizado para {len(filas)} productos del pedido {id_pedido}")
         
-        # 5. Registrar en bitácora
-        cursor.execute("""
-            INSERT INTO BITACORA (ID_USUARIO, ACCION, FECHA_ACCION)
-            SELECT p.ID_USUARIO, 
-                   'Pago Transbank EXITOSO - Pedido #' || :id_pedido || 
-                   ' - Autorización: ' || :auth_code || 
-                   ' - Monto: $' || :amount,
-                   SYSDATE
-            FROM PEDIDOS p WHERE p.ID_PEDIDO = :id_pedido
-        """, {
-            'id_pedido': id_pedido,
-            'auth_code': response.get('authorization_code', 'N/A'),
-            'amount': response.get('amount', 0)
-        })
+        # 5. La reserva del checkout queda confirmada (el stock ya se rebajó)
+        reservas.confirmar(conn, id_pedido)
+        
+        # 6. Registrar en bitácora dentro de la misma transacción (se confirma junto con el pago)
+        bitacora.registrar(
+            f"Pago Transbank EXITOSO - Pedido #{id_pedido} - Autorización: "
+            f"{response.get('authorization_code', 'N/A')} - Monto: ${response.get('amount', 0)}",
+            id_pedido=id_pedido,
+            conn=conn
+        )
         
         conn.commit()
         cursor.close()
@@ -353,6 +481,87 @@ def process_successful_payment(id_pedido, response):
             conn.rollback()
         return False
 
+# Pago autorizado en Webpay que no se pudo despachar por falta de stock: queda para
+# revisión manual y la reconciliación ya no lo vuelve a tomar en cada pasada
+ESTADO_SOBREVENTA = 'APROBADO'
+
+def registrar_sobreventa(conn, id_pedido, sin_stock):
+    """Dejar el pago en ESTADO_SOBREVENTA, liberar su reserva y registrar la alerta, en una transacción"""
+    detalle = ', '.join(f"producto {fila['id_producto']} x{fila['cantidad']} (sucursal {fila['id_sucursal']})"
+                        for fila in sin_stock)
+    logger.error(f"❌ Sobreventa en pedido {id_pedido}: {detalle}")
+    db.execute("""
+        UPDATE PAGOS SET ESTADO_PAGO = :estado
+        WHERE ID_PEDIDO = :id_pedido AND ESTADO_PAGO <> 'PAGADO'
+    """, estado=ESTADO_SOBREVENTA, id_pedido=id_pedido, conn=conn)
+    reservas.liberar(conn, id_pedido)
+    bitacora.registrar(f"ALERTA sobreventa - Pedido #{id_pedido} - Pago autorizado sin stock: {detalle}"[:255],
+                       id_pedido=id_pedido, conn=conn)
+    conn.commit()
+
+def finalizar_pago_reconciliado(id_pedido, response):
+    """Registrar un pago que Webpay autorizó pero cuyo navegador nunca volvió"""
+    with app.app_context():
+        return process_successful_payment(id_pedido, response)
+
+def expirar_pago(id_pedido, motivo):
+    """Dar por fallido un pago atrasado que ya no se va a completar"""
+    with app.app_context():
+        actualizadas = db.execute("""
+            UPDATE PAGOS 
+            SET ESTADO_PAGO = 'FALLIDO', 
+                FECHA_PAGO = SYSDATE 
+            WHERE ID_PEDIDO = :id_pedido AND ESTADO_PAGO IN ('PROCESANDO', 'PENDIENTE')
+        """, id_pedido=id_pedido)
+        if actualizadas:
+            reservas.liberar(db.get_connection(), id_pedido)
+            bitacora.registrar(f"Pago Transbank expirado - Pedido #{id_pedido} - {motivo}",
+                               id_pedido=id_pedido, conn=db.get_connection())
+        db.commit()
+    if actualizadas:
+        logger.info(f"⌛ Pago del pedido {id_pedido} expirado: {motivo}")
+
+# Pagos PROCESANDO/PENDIENTE cuyo navegador no volvió: se consultan en Webpay y se cierran
+reconciliador = ReconciliadorPagos(
+    db,
+    cliente_webpay,
+    finalizar_pago_reconciliado,
+    expirar_pago,
+    antiguedad_min=int(os.getenv('TRANSBANK_RECONCILIAR_MINUTOS', '15')),
+    lote=int(os.getenv('TRANSBANK_RECONCILIAR_LOTE', '100')),
+    concurrencia=int(os.getenv('TRANSBANK_RECONCILIAR_CONCURRENCIA', '4')),
+    intervalo=int(os.getenv('TRANSBANK_RECONCILIAR_INTERVALO', '60'))
+)
+RECONCILIAR = os.getenv('TRANSBANK_RECONCILIAR', '1') == '1'
+
+@app.before_request
+def iniciar_reconciliacion():
+    """Arrancar la reconciliación con el primer request del proceso.
+
+    Así corre igual con start.py, app.run sin debug o un servidor WSGI; con el
+    reloader de debug solo el proceso hijo atiende requests. iniciar() no
+    arranca un segundo hilo si ya hay uno vivo.
+    """
+    if RECONCILIAR:
+        reconciliador.iniciar()
+
+@app.route('/transbank/reconciliacion', methods=['GET'])
+def estado_reconciliacion():
+    """Métricas de la reconciliación de pagos atrasados"""
+    return jsonify(reconciliador.stats())
+
+@app.route('/transbank/reconciliacion/ejecutar', methods=['POST'])
+def ejecutar_reconciliacion():
+    """Ejecutar un ciclo de reconciliación ahora"""
+    try:
+        revisados = reconciliador.ejecutar_ciclo()
+        if revisados is None:
+            return jsonify({'error': 'Ya hay una reconciliación en curso'}), 409
+        return jsonify({'success': True, 'revisados': revisados, 'stats': reconciliador.stats()})
+    except Exception as e:
+        logger.error(f"❌ Error en reconciliación manual: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/transbank/estado-pedido/<int:id_pedido>', methods=['GET'])
 def estado_pedido(id_pedido):
     """Obtener estado actual del pedido"""
@@ -395,25 +604,53 @@ def estado_pedido(id_pedido):
 def estadisticas():
     """Obtener estadísticas de transacciones"""
     try:
-        # Estadísticas de pagos
-        stats_pagos = execute_db_query("""
-            SELECT 
-                COUNT(*) as total_pagos,
-                SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN 1 ELSE 0 END) as pagos_exitosos,
-                SUM(CASE WHEN ESTADO_PAGO = 'PENDIENTE' THEN 1 ELSE 0 END) as pagos_pendientes,
-                SUM(CASE WHEN ESTADO_PAGO = 'FALLIDO' THEN 1 ELSE 0 END) as pagos_fallidos,
-                COALESCE(SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN MONTO_TOTAL ELSE 0 END), 0) as monto_total
-            FROM PAGOS
-        """, fetch='one')
-        
-        # Estadísticas de pedidos
-        stats_pedidos = execute_db_query("""
-            SELECT 
-                COUNT(*) as total_pedidos,
-                SUM(CASE WHEN ESTADO = 'CONFIRMADO' THEN 1 ELSE 0 END) as pedidos_confirmados,
-                SUM(CASE WHEN ESTADO = 'PENDIENTE' THEN 1 ELSE 0 END) as pedidos_pendientes
-            FROM DETALLE_PEDIDO
-        """, fetch='one')
+        # Por defecto desde las vistas materializadas MV_RESUMEN_* (refrescadas cada minuto);
+        # con ?fresh=1, o si no existen, se calcula en vivo sobre PAGOS y DETALLE_PEDIDO
+        fresh = request.args.get('fresh') in ('1', 'true')
+        fuente = 'en_vivo'
+        stats_pagos = stats_pedidos = None
+        if not fresh:
+            try:
+                stats_pagos = db.fetch_one("""
+                    SELECT 
+                        NVL(SUM(CANTIDAD), 0),
+                        NVL(SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN CANTIDAD END), 0),
+                        NVL(SUM(CASE WHEN ESTADO_PAGO = 'PENDIENTE' THEN CANTIDAD END), 0),
+                        NVL(SUM(CASE WHEN ESTADO_PAGO = 'FALLIDO' THEN CANTIDAD END), 0),
+                        NVL(SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN MONTO END), 0)
+                    FROM MV_RESUMEN_PAGOS
+                """)
+                stats_pedidos = db.fetch_one("""
+                    SELECT 
+                        NVL(SUM(CANTIDAD), 0),
+                        NVL(SUM(CASE WHEN ESTADO = 'CONFIRMADO' THEN CANTIDAD END), 0),
+                        NVL(SUM(CASE WHEN ESTADO = 'PENDIENTE' THEN CANTIDAD END), 0)
+                    FROM MV_RESUMEN_PEDIDOS
+                """)
+                fuente = 'resumen'
+            except Exception as e:
+                logger.warning(f"⚠️ Resumen de estadísticas no disponible, se calcula en vivo: {e}")
+        
+        if fuente == 'en_vivo':
+            # Estadísticas de pagos
+            stats_pagos = execute_db_query("""
+                SELECT 
+                    COUNT(*) as total_pagos,
+                    SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN 1 ELSE 0 END) as pagos_exitosos,
+                    SUM(CASE WHEN ESTADO_PAGO = 'PENDIENTE' THEN 1 ELSE 0 END) as pagos_pendientes,
+                    SUM(CASE WHEN ESTADO_PAGO = 'FALLIDO' THEN 1 ELSE 0 END) as pagos_fallidos,
+                    COALESCE(SUM(CASE WHEN ESTADO_PAGO = 'PAGADO' THEN MONTO_TOTAL ELSE 0 END), 0) as monto_total
+                FROM PAGOS
+            """, fetch='one')
+            
+            # Estadísticas de pedidos
+            stats_pedidos = execute_db_query("""
+                SELECT 
+                    COUNT(*) as total_pedidos,
+                    SUM(CASE WHEN ESTADO = 'CONFIRMADO' THEN 1 ELSE 0 END) as pedidos_confirmados,
+                    SUM(CASE WHEN ESTADO = 'PENDIENTE' THEN 1 ELSE 0 END) as pedidos_pendientes
+                FROM DETALLE_PEDIDO
+            """, fetch='one')
         
         # Transacciones recientes
         transacciones_recientes = execute_db_query("""
@@ -434,6 +671,7 @@ def estadisticas():
         return jsonify({
             'success': True,
             'periodo': 'Últimos 30 días',
+            'fuente': fuente,
             'timestamp': datetime.now().isoformat(),
             'pagos': {
                 'total': stats_pagos[0] if stats_pagos else 0,
@@ -470,19 +708,18 @@ def test_connection():
         if not TRANSBANK_AVAILABLE:
             return jsonify({
                 'status': 'error',
-                'message': 'Transbank SDK no disponible',
-                'solution': 'Ejecuta: pip install transbank-sdk'
+                'message': 'Transbank no configurado',
+                'solution': 'Define TRANSBANK_COMMERCE_CODE y TRANSBANK_API_KEY'
             }), 500
         
-        # Solo verificar que podemos instanciar la clase
-        transaction = Transaction(transbank_options)
-        
+        # Solo informar la configuración y las métricas del cliente, sin llamar a Webpay
         return jsonify({
             'status': 'ok',
             'message': 'Conexión con Transbank disponible',
             'environment': ENVIRONMENT,
             'commerce_code': COMMERCE_CODE,
-            'integration_type': 'TEST' if ENVIRONMENT == 'TEST' else 'LIVE'
+            'integration_type': 'TEST' if ENVIRONMENT == 'TEST' else 'LIVE',
+            'cliente': cliente_webpay.stats()
         })
         
     except Exception as e:
@@ -504,6 +741,8 @@ def not_found(error):
             'POST /transbank/confirmar/{id_pedido}',
             'GET /transbank/estado-pedido/{id_pedido}',
             'GET /transbank/estadisticas',
+            'GET /transbank/reconciliacion',
+            'POST /transbank/reconciliacion/ejecutar',
             'GET /transbank/test-connection'
         ]
     }), 404
@@ -521,8 +760,8 @@ if __name__ == '__main__':
     print("=" * 50)
     print(f"🔧 Ambiente: {ENVIRONMENT}")
     print(f"🏪 Commerce Code: {COMMERCE_CODE}")
-    print(f"📦 Transbank SDK: {'✅ Disponible' if TRANSBANK_AVAILABLE else '❌ No disponible'}")
-    print(f"🗄️  Base de datos: {'✅ Conectada' if get_db_connection() else '❌ No conectada'}")
+    print(f"📦 Transbank: {'✅ Configurado' if TRANSBANK_AVAILABLE else '❌ No configurado'} ({TRANSBANK_HOST})")
+    print(f"🗄️  Base de datos: {'✅ Conectada' if db.is_available() else '❌ No conectada'}")
     print(f"🌐 Puerto: 5001")
     print(f"🔗 Health check: http://localhost:5001/transbank/health")
     print("=" * 50)
@@ -0,0 +1,194 @@
+"""
+Reconciliación de pagos Transbank que quedaron en PROCESANDO o PENDIENTE porque
+el navegador nunca volvió a /transbank/confirmar/<id>.
+
+Un hilo de fondo recorre los pagos atrasados por lotes, consulta su estado en
+Webpay con concurrencia acotada y los finaliza (PAGADO) o los da por fallidos.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cliente_transbank import ErrorTransbank
+
+logger = logging.getLogger(__name__)
+
+# Pagos Transbank atrasados, del más antiguo al más nuevo (keyset por FECHA_PAGO, ID_PAGO)
+SQL_PAGOS_ATRASADOS = """
+    SELECT ID_PAGO, ID_PEDIDO, TOKEN_WS, FECHA_PAGO
+    FROM PAGOS
+    WHERE ESTADO_PAGO IN ('PROCESANDO', 'PENDIENTE')
+      AND METODO_PAGO IN ('TRANSBANK', 'WEBPAY')
+      AND FECHA_PAGO < SYSDATE - :minutos / 1440
+      AND (FECHA_PAGO > :fecha OR (FECHA_PAGO = :fecha AND ID_PAGO > :id_pago))
+    ORDER BY FECHA_PAGO, ID_PAGO
+    FETCH FIRST :lote ROWS ONLY
+"""
+
+# Punto de partida del keyset (anterior a cualquier FECHA_PAGO)
+_FECHA_MINIMA = datetime(1900, 1, 1)
+
+# Estados de Webpay que ya no van a terminar en un pago autorizado
+ESTADOS_FALLIDOS = ('FAILED', 'REVERSED', 'NULLIFIED')
+
+
+class ReconciliadorPagos:
+    """Recorre los pagos atrasados cada `intervalo` segundos.
+
+    - AUTHORIZED en Webpay: se llama a finalizar(id_pedido, respuesta), que
+      registra el pago como si el navegador hubiera vuelto (es idempotente). Si
+      no hay stock, finalizar deja el pago fuera de PROCESANDO/PENDIENTE con una
+      alerta en la bitácora, así no se reintenta en cada ciclo.
+    - FAILED/REVERSED/NULLIFIED, INITIALIZED (el comprador abandonó y Webpay ya
+      no acepta el commit), token desconocido o sin token: expirar(id_pedido, motivo).
+    - Error de red: el pago queda para el ciclo siguiente.
+    """
+
+    def __init__(self, db, cliente, finalizar, expirar, antiguedad_min=15, lote=100,
+                 concurrencia=4, intervalo=60):
+        self.db = db
+        self.cliente = cliente
+        self.finalizar = finalizar
+        self.expirar = expirar
+        self.antiguedad_min = antiguedad_min
+        self.lote = lote
+        self.concurrencia = concurrencia
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._ejecutando = threading.Lock()
+        self._hilo = None
+        self.ciclos = 0
+        self.revisados = 0
+        self.finalizados = 0
+        self.expirados = 0
+        self.reintentar = 0
+        self.errores = 0
+        self.ultimo_ciclo = None
+        self.lag_segundos = 0
+        self.pagos_por_segundo = 0
+
+    def iniciar(self):
+        """Arrancar el hilo de fondo; se puede llamar en cada request, solo lo arranca una vez"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='reconciliador-pagos', daemon=True)
+                self._hilo.start()
+                logger.info(f"🔁 Reconciliación de pagos cada {self.intervalo}s (atrasados > {self.antiguedad_min} min)")
+
+    def _ejecutar(self):
+        while True:
+            try:
+                self.ejecutar_ciclo()
+            except Exception as e:
+                logger.error(f"❌ Error en la reconciliación de pagos: {e}")
+            time.sleep(self.intervalo)
+
+    def ejecutar_ciclo(self):
+        """Revisar todos los pagos atrasados una vez; devuelve cuántos se revisaron (None si ya había un ciclo en curso)"""
+        if not self._ejecutando.acquire(blocking=False):
+            return None
+        try:
+            inicio = time.perf_counter()
+            revisados = 0
+            ultimo = {'fecha': None, 'id_pago': 0}
+            mas_antiguo = None
+            with ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix='reconciliar') as executor:
+                while True:
+                    with self.db.acquire() as conn:
+                        filas = self.db.fetch_all(SQL_PAGOS_ATRASADOS, {
+                            'minutos': self.antiguedad_min,
+                            'fecha': ultimo['fecha'] or _FECHA_MINIMA,
+                            'id_pago': ultimo['id_pago'],
+                            'lote': self.lote
+                        }, conn=conn)
+                    if not filas:
+                        break
+                    if mas_antiguo is None:
+                        mas_antiguo = filas[0][3]
+                    list(executor.map(self._reconciliar, filas))
+                    revisados += len(filas)
+                    ultimo = {'fecha': filas[-1][3], 'id_pago': filas[-1][0]}
+                    if len(filas) < self.lote:
+                        break
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self.ciclos += 1
+                self.revisados += revisados
+                self.ultimo_ciclo = {
+                    'revisados': revisados,
+                    'duracion_ms': round(duracion * 1000, 2),
+                    'fin': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }
+                # Antigüedad del pago atrasado más viejo al empezar el ciclo
+                self.lag_segundos = round(time.time() - mas_antiguo.timestamp()) if mas_antiguo else 0
+                if revisados:
+                    self.pagos_por_segundo = round(revisados / duracion, 2)
+            if revisados:
+                logger.info(f"🔁 Reconciliación: {revisados} pagos revisados en {duracion:.1f}s")
+            return revisados
+        finally:
+            self._ejecutando.release()
+
+    def _reconciliar(self, fila):
+        _, id_pedido, token, _ = fila
+        try:
+            if not token:
+                self._expirar(id_pedido, 'sin transacción Transbank')
+                return
+            try:
+                respuesta = self.cliente.estado(token)
+            except ErrorTransbank as e:
+                if e.codigo in (404, 422):
+                    # Token vencido o desconocido para Webpay
+                    self._expirar(id_pedido, f"token rechazado por Webpay ({e.codigo})")
+                    return
+                raise
+            estado = respuesta.get('status')
+            if estado == 'AUTHORIZED':
+                if self.finalizar(id_pedido, respuesta):
+                    with self._lock:
+                        self.finalizados += 1
+                    logger.info(f"✅ Reconciliación: pedido {id_pedido} autorizado en Webpay, pago registrado")
+                else:
+                    with self._lock:
+                        self.errores += 1
+            elif estado in ESTADOS_FALLIDOS or estado == 'INITIALIZED':
+                self._expirar(id_pedido, f"estado Webpay {estado}")
+            else:
+                with self._lock:
+                    self.reintentar += 1
+        except ErrorTransbank as e:
+            logger.warning(f"⚠️ Reconciliación: no se pudo consultar el pedido {id_pedido}: {e}")
+            with self._lock:
+                self.reintentar += 1
+        except Exception as e:
+            logger.error(f"❌ Reconciliación del pedido {id_pedido}: {e}")
+            with self._lock:
+                self.errores += 1
+
+    def _expirar(self, id_pedido, motivo):
+        self.expirar(id_pedido, motivo)
+        with self._lock:
+            self.expirados += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'activo': self._hilo is not None and self._hilo.is_alive(),
+                'intervalo_segundos': self.intervalo,
+                'antiguedad_min': self.antiguedad_min,
+                'ciclos': self.ciclos,
+                'revisados': self.revisados,
+                'finalizados': self.finalizados,
+                'expirados': self.expirados,
+                'reintentar': self.reintentar,
+                'errores': self.errores,
+                'lag_segundos': self.lag_segundos,
+                'pagos_por_segundo': self.pagos_por_segundo,
+                'ultimo_ciclo': self.ultimo_ciclo
+            }
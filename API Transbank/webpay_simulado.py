@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Servidor Webpay Plus simulado para pruebas de carga sin red.
+
+Implementa los endpoints REST v1.2 que usa cliente_transbank.py (create, commit,
+status y refund) y la página de pago a la que se redirige al comprador. Para que la API
+Transbank lo use, iniciarla con TRANSBANK_HOST=http://127.0.0.1:8888
+
+El resultado de cada transacción se sortea al crearla con las proporciones
+SIMULATION_SUCCESS_RATE / SIMULATION_PENDING_RATE / SIMULATION_FAILURE_RATE:
+- éxito: commit devuelve AUTHORIZED
+- rechazo: commit devuelve FAILED (response_code -1)
+- pendiente: el comprador abandona el pago; la página no vuelve al comercio,
+  status queda en INITIALIZED y commit responde 422 como Webpay
+"""
+
+import math
+import random
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+
+from flask import Flask, jsonify, redirect, request
+
+from config import Config
+
+WEBPAY_ENDPOINT = '/rswebpaytransaction/api/webpay/v1.2/transactions'
+# Percentil 99 de la normal estándar, para llevar (mediana, p99) a una lognormal
+Z_P99 = 2.326
+
+app = Flask(__name__)
+
+
+class SimuladorWebpay:
+    """Estado en memoria de las transacciones simuladas, seguro entre hilos"""
+
+    def __init__(self, config):
+        self.latencias = config.SIMULATION_LATENCIA
+        self.max_transacciones = config.SIMULATION_MAX_TRANSACCIONES
+        total = config.SIMULATION_SUCCESS_RATE + config.SIMULATION_PENDING_RATE + config.SIMULATION_FAILURE_RATE
+        self.resultados = ['AUTHORIZED', 'INITIALIZED', 'FAILED']
+        self.pesos = [
+            config.SIMULATION_SUCCESS_RATE / total,
+            config.SIMULATION_PENDING_RATE / total,
+            config.SIMULATION_FAILURE_RATE / total
+        ]
+        self._transacciones = OrderedDict()
+        # RLock: las rutas lo toman para revisar y cambiar el estado de una transacción a la vez
+        self.lock = threading.RLock()
+        self._contadores = Counter()
+        self._latencia_total_ms = Counter()
+        self.inicio = time.time()
+
+    def esperar(self, operacion):
+        """Dormir una latencia lognormal con la mediana y el p99 configurados"""
+        mediana, p99 = self.latencias[operacion]
+        sigma = math.log(p99 / mediana) / Z_P99 if p99 > mediana > 0 else 0
+        ms = random.lognormvariate(math.log(mediana), sigma) if mediana > 0 else 0
+        time.sleep(ms / 1000)
+        with self.lock:
+            self._contadores[operacion] += 1
+            self._latencia_total_ms[operacion] += ms
+
+    def contar(self, evento):
+        with self.lock:
+            self._contadores[evento] += 1
+
+    def crear(self, datos):
+        token = secrets.token_hex(32)
+        transaccion = {
+            'buy_order': datos['buy_order'],
+            'session_id': datos['session_id'],
+            'amount': datos['amount'],
+            'return_url': datos['return_url'],
+            'resultado': random.choices(self.resultados, self.pesos)[0],
+            'status': 'INITIALIZED',
+            'balance': datos['amount'],
+            'creada': datetime.now(timezone.utc)
+        }
+        with self.lock:
+            self._transacciones[token] = transaccion
+            while len(self._transacciones) > self.max_transacciones:
+                self._transacciones.popitem(last=False)
+        return token
+
+    def obtener(self, token):
+        with self.lock:
+            return self._transacciones.get(token)
+
+    def stats(self):
+        with self.lock:
+            estados = Counter(t['status'] for t in self._transacciones.values())
+            return {
+                'transacciones': len(self._transacciones),
+                'estados': dict(estados),
+                'operaciones': dict(self._contadores),
+                'latencia_media_ms': {
+                    op: round(self._latencia_total_ms[op] / self._contadores[op], 1)
+                    for op in self._latencia_total_ms if self._contadores[op]
+                },
+                'proporciones': dict(zip(self.resultados, (round(p, 3) for p in self.pesos))),
+                'segundos_activo': round(time.time() - self.inicio)
+            }
+
+
+simulador = SimuladorWebpay(Config)
+
+
+def error(mensaje, status=422):
+    return jsonify({'error_message': mensaje}), status
+
+
+def respuesta_transaccion(transaccion):
+    """Cuerpo de commit/status con la forma que devuelve Webpay"""
+    autorizada = transaccion['status'] in ('AUTHORIZED', 'REVERSED', 'NULLIFIED')
+    fecha = transaccion.get('fecha_transaccion') or transaccion['creada']
+    cuerpo = {
+        'vci': 'TSY' if autorizada else None,
+        'amount': transaccion['amount'],
+        'status': transaccion['status'],
+        'buy_order': transaccion['buy_order'],
+        'session_id': transaccion['session_id'],
+        'card_detail': {'card_number': Config.TEST_DATA['card_number'][-4:]},
+        'accounting_date': fecha.strftime('%m%d'),
+        'transaction_date': fecha.isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'payment_type_code': 'VN',
+        'installments_number': 0
+    }
+    if transaccion['status'] != 'INITIALIZED':
+        cuerpo['authorization_code'] = transaccion.get('authorization_code')
+        cuerpo['response_code'] = 0 if autorizada else -1
+    if transaccion['balance'] != transaccion['amount']:
+        cuerpo['balance'] = transaccion['balance']
+    return cuerpo
+
+
+@app.before_request
+def verificar_credenciales():
+    if request.path.startswith(WEBPAY_ENDPOINT):
+        if not request.headers.get('Tbk-Api-Key-Id') or not request.headers.get('Tbk-Api-Key-Secret'):
+            return error('Not Authorized', 401)
+
+
+@app.route(WEBPAY_ENDPOINT, methods=['POST'])
+@app.route(WEBPAY_ENDPOINT + '/', methods=['POST'])
+def crear():
+    simulador.esperar('create')
+    datos = request.get_json(force=True, silent=True) or {}
+    for campo in ('buy_order', 'session_id', 'amount', 'return_url'):
+        if datos.get(campo) in (None, ''):
+            return error(f"{campo} is required!")
+    token = simulador.crear(datos)
+    return jsonify({'token': token, 'url': f"{request.host_url}webpayserver/initTransaction"})
+
+
+@app.route(WEBPAY_ENDPOINT + '/<token>', methods=['PUT'])
+def confirmar(token):
+    simulador.esperar('commit')
+    transaccion = simulador.obtener(token)
+    if transaccion is None:
+        return error(f"Transaction not found for token {token}", 404)
+    with simulador.lock:
+        if transaccion['status'] != 'INITIALIZED':
+            simulador.contar('commit_repetido')
+            return error('Transaction already locked by another process')
+        if transaccion['resultado'] == 'INITIALIZED':
+            return error('Invalid status 0 for transaction while authorizing. Commerce have not been notified')
+        transaccion['status'] = transaccion['resultado']
+        transaccion['fecha_transaccion'] = datetime.now(timezone.utc)
+        if transaccion['status'] == 'AUTHORIZED':
+            transaccion['authorization_code'] = f"{random.randint(0, 999999):06d}"
+        simulador.contar(f"commit_{transaccion['status'].lower()}")
+        return jsonify(respuesta_transaccion(transaccion))
+
+
+@app.route(WEBPAY_ENDPOINT + '/<token>', methods=['GET'])
+def estado(token):
+    simulador.esperar('status')
+    transaccion = simulador.obtener(token)
+    if transaccion is None:
+        return error(f"Transaction not found for token {token}", 404)
+    return jsonify(respuesta_transaccion(transaccion))
+
+
+@app.route(WEBPAY_ENDPOINT + '/<token>/refunds', methods=['POST'])
+def reembolsar(token):
+    simulador.esperar('refund')
+    transaccion = simulador.obtener(token)
+    if transaccion is None:
+        return error(f"Transaction not found for token {token}", 404)
+    monto = (request.get_json(force=True, silent=True) or {}).get('amount')
+    with simulador.lock:
+        if transaccion['status'] not in ('AUTHORIZED', 'NULLIFIED'):
+            return error(f"Invalid status {transaccion['status']} for refund")
+        if not monto or monto <= 0 or monto > transaccion['balance']:
+            return error('Invalid amount')
+        # Reversa si es total y del mismo día; si no, anulación (posiblemente parcial)
+        mismo_dia = transaccion['fecha_transaccion'].date() == datetime.now(timezone.utc).date()
+        if monto == transaccion['amount'] == transaccion['balance'] and mismo_dia:
+            transaccion['status'] = 'REVERSED'
+            transaccion['balance'] = 0
+            simulador.contar('refund_reversed')
+            return jsonify({'type': 'REVERSED'})
+        transaccion['status'] = 'NULLIFIED'
+        transaccion['balance'] -= monto
+        simulador.contar('refund_nullified')
+        return jsonify({
+            'type': 'NULLIFIED',
+            'authorization_code': transaccion['authorization_code'],
+            'authorization_date': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+            'nullified_amount': monto,
+            'balance': transaccion['balance'],
+            'response_code': 0
+        })
+
+
+@app.route('/webpayserver/initTransaction', methods=['GET', 'POST'])
+def pagina_pago():
+    """Formulario de pago: vuelve al comercio con token_ws salvo que el pago quede abandonado"""
+    token = request.values.get('token_ws', '')
+    transaccion = simulador.obtener(token)
+    if transaccion is None:
+        return 'Token inválido', 404
+    if transaccion['resultado'] == 'INITIALIZED':
+        simulador.contar('pago_abandonado')
+        return '<p>Pago simulado abandonado: el comprador no volvió al comercio.</p>'
+    return redirect(f"{transaccion['return_url']}?token_ws={token}", code=303)
+
+
+@app.route('/simulador/stats', methods=['GET'])
+def stats():
+    return jsonify(simulador.stats())
+
+
+if __name__ == '__main__':
+    print("🧪 Servidor Webpay Plus simulado")
+    print("=" * 50)
+    print(f"🎲 Proporciones: {simulador.stats()['proporciones']}")
+    print(f"⏱️  Latencias (mediana, p99 ms): {Config.SIMULATION_LATENCIA}")
+    print(f"🔗 Usar con: TRANSBANK_HOST=http://{Config.SIMULATION_HOST}:{Config.SIMULATION_PORT}")
+    print("=" * 50)
+
+    app.run(host=Config.SIMULATION_HOST, port=Config.SIMULATION_PORT, threaded=True)
@@ -102,7 +102,7 @@ CREATE TABLE CARRITO_PRODUCTOS (
 
 -- DETALLE_PEDIDO
 CREATE TABLE DETALLE_PEDIDO (
-    ID_DETALLE NUMBER PRIMARY KEY, 
+    ID_DETALLE NUMBER GENERATED BY DEFAULT ON NULL AS IDENTITY PRIMARY KEY,
     ID_CARRITO NUMBER NOT NULL,
     DIRECCION VARCHAR2(150) NOT NULL,
     ESTADO VARCHAR2(20) DEFAULT 'PENDIENTE' 
@@ -1,5 +1,5 @@
 import React, { createContext, useContext, useState, useEffect, useCallback, ReactNode } from 'react';
-import { ProductoCarrito, AgregarAlCarritoRequest } from '../types';
+import { ProductoCarrito, AgregarAlCarritoRequest, OperacionCarrito } from '../types';
 import { carritoService, productoService } from '../services/api';
 import toast from 'react-hot-toast';
 
@@ -11,6 +11,7 @@ interface CartContextType {
   removeFromCart: (productId: number) => Promise<boolean>;
   updateQuantity: (productId: number, cantidad: number) => Promise<boolean>;
   clearCart: () => Promise<boolean>;
+  applyOperations: (operaciones: OperacionCarrito[]) => Promise<boolean>;
   getCartTotal: () => number;
   getCartItemCount: () => number;
   refreshCart: () => Promise<void>;
@@ -177,6 +178,29 @@ export const CartProvider: React.FC<CartProviderProps> = ({ children }) => {
     }
   }, [cartId]);
 
+  // Aplica varios cambios en un solo request y una sola transacción
+  const applyOperations = useCallback(async (operaciones: OperacionCarrito[]): Promise<boolean> => {
+    if (operaciones.length === 0) return true;
+
+    try {
+      setLoading(true);
+      let currentCartId = cartId;
+      if (!currentCartId) {
+        currentCartId = await createCart();
+      }
+      await carritoService.aplicarOperaciones(currentCartId, operaciones);
+      const { productos } = await carritoService.obtenerProductos(currentCartId);
+      setCartItems(productos);
+      return true;
+    } catch (error: any) {
+      const errorMessage = error.response?.data?.error || 'Error al actualizar el carrito';
+      toast.error(errorMessage);
+      return false;
+    } finally {
+      setLoading(false);
+    }
+  }, [cartId]);
+
   const getCartTotal = useCallback((): number => {
     return cartItems.reduce((total, item) => total + item.valor_total, 0);
   }, [cartItems]);
@@ -193,6 +217,7 @@ export const CartProvider: React.FC<CartProviderProps> = ({ children }) => {
     removeFromCart,
     updateQuantity,
     clearCart,
+    applyOperations,
     getCartTotal,
     getCartItemCount,
     refreshCart,
@@ -1,29 +1,24 @@
 import React, { useEffect, useState } from 'react';
 import { bitacoraService, usuarioService } from '../services/api';
-import { Usuario } from '../types';
+import { BitacoraFiltros, BitacoraLog, Usuario } from '../types';
 import toast from 'react-hot-toast';
 
-interface BitacoraLog {
-  id_log: number;
-  id_usuario: number;
-  accion: string;
-  fecha_accion: string;
-}
+const TAMANO_PAGINA = 100;
 
 const AdminBitacora: React.FC = () => {
   const [logs, setLogs] = useState<BitacoraLog[]>([]);
   const [usuarios, setUsuarios] = useState<Usuario[]>([]);
+  const [filtros, setFiltros] = useState<BitacoraFiltros>({});
+  const [siguiente, setSiguiente] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [cargandoMas, setCargandoMas] = useState(false);
 
-  const fetchAll = async () => {
+  const fetchLogs = async (filtrosActivos: BitacoraFiltros) => {
     setLoading(true);
     try {
-      const [logRes, usuRes] = await Promise.all([
-        bitacoraService.obtenerBitacora(),
-        usuarioService.obtenerUsuarios(),
-      ]);
+      const logRes = await bitacoraService.obtenerBitacoraPaginada(filtrosActivos, { limit: TAMANO_PAGINA });
       setLogs(logRes.bitacora);
-      setUsuarios(usuRes.usuarios);
+      setSiguiente(logRes.siguiente);
     } catch {
       toast.error('Error al cargar la bitácora');
     } finally {
@@ -31,13 +26,73 @@ const AdminBitacora: React.FC = () => {
     }
   };
 
+  const fetchMas = async () => {
+    if (!siguiente) return;
+    setCargandoMas(true);
+    try {
+      const logRes = await bitacoraService.obtenerBitacoraPaginada(filtros, { limit: TAMANO_PAGINA, after: siguiente });
+      setLogs(prev => [...prev, ...logRes.bitacora]);
+      setSiguiente(logRes.siguiente);
+    } catch {
+      toast.error('Error al cargar la bitácora');
+    } finally {
+      setCargandoMas(false);
+    }
+  };
+
   useEffect(() => {
-    fetchAll();
+    usuarioService.obtenerUsuarios()
+      .then(usuRes => setUsuarios(usuRes.usuarios))
+      .catch(() => toast.error('Error al cargar los usuarios'));
+    fetchLogs({});
   }, []);
 
+  const aplicarFiltros = (e: React.FormEvent) => {
+    e.preventDefault();
+    fetchLogs(filtros);
+  };
+
+  const limpiarFiltros = () => {
+    setFiltros({});
+    fetchLogs({});
+  };
+
   return (
     <div className="max-w-4xl mx-auto py-8">
       <h1 className="text-3xl font-bold mb-6 text-center">Bitácora de Acciones</h1>
+      <form onSubmit={aplicarFiltros} className="flex flex-wrap gap-2 mb-4 items-end">
+        <select
+          className="border rounded px-2 py-1"
+          value={filtros.usuario ?? ''}
+          onChange={e => setFiltros({ ...filtros, usuario: e.target.value ? Number(e.target.value) : undefined })}
+        >
+          <option value="">Todos los usuarios</option>
+          {usuarios.map(u => (
+            <option key={u.id_usuario} value={u.id_usuario}>{u.nombre_completo}</option>
+          ))}
+        </select>
+        <input
+          type="text"
+          className="border rounded px-2 py-1"
+          placeholder="Acción comienza con..."
+          value={filtros.accion ?? ''}
+          onChange={e => setFiltros({ ...filtros, accion: e.target.value || undefined })}
+        />
+        <input
+          type="date"
+          className="border rounded px-2 py-1"
+          value={filtros.desde ?? ''}
+          onChange={e => setFiltros({ ...filtros, desde: e.target.value || undefined })}
+        />
+        <input
+          type="date"
+          className="border rounded px-2 py-1"
+          value={filtros.hasta ?? ''}
+          onChange={e => setFiltros({ ...filtros, hasta: e.target.value || undefined })}
+        />
+        <button type="submit" className="bg-blue-600 text-white rounded px-3 py-1">Filtrar</button>
+        <button type="button" onClick={limpiarFiltros} className="bg-gray-200 rounded px-3 py-1">Limpiar</button>
+      </form>
       {loading ? (
         <div className="text-center">Cargando bitácora...</div>
       ) : (
@@ -65,10 +120,21 @@ const AdminBitacora: React.FC = () => {
               })}
             </tbody>
           </table>
+          {siguiente && (
+            <div className="text-center mt-4">
+              <button
+                onClick={fetchMas}
+                disabled={cargandoMas}
+                className="bg-gray-200 rounded px-4 py-2 disabled:opacity-50"
+              >
+                {cargandoMas ? 'Cargando...' : 'Cargar más'}
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
   );
 };
 
-export default AdminBitacora; 
\ No newline at end of file
+export default AdminBitacora;
@@ -2,6 +2,7 @@ import React, { useEffect, useState } from 'react';
 import { useSearchParams, useNavigate } from 'react-router-dom';
 import { CheckCircleIcon, HomeIcon, ShoppingBagIcon } from '@heroicons/react/24/outline';
 import toast from 'react-hot-toast';
+import { transbankService } from '../services/api';
 
 interface OrderDetails {
   id_pedido: number;
@@ -15,6 +16,11 @@ interface OrderDetails {
   }>;
 }
 
+// La confirmación con Transbank puede seguir en segundo plano (status=processing):
+// se consulta el estado del pago hasta que deje de estar pendiente
+const INTERVALO_CONSULTA_MS = 2000;
+const MAX_CONSULTAS = 30;
+
 const PaymentSuccess: React.FC = () => {
   const [searchParams] = useSearchParams();
   const navigate = useNavigate();
@@ -22,6 +28,7 @@ const PaymentSuccess: React.FC = () => {
   const [loading, setLoading] = useState(true);
   
   const orderId = searchParams.get('order_id');
+  const [procesando, setProcesando] = useState(searchParams.get('status') === 'processing');
 
   useEffect(() => {
     if (orderId) {
@@ -31,6 +38,30 @@ const PaymentSuccess: React.FC = () => {
     }
   }, [orderId]);
 
+  useEffect(() => {
+    if (!orderId || !procesando) return;
+    let consultas = 0;
+    const intervalo = setInterval(async () => {
+      consultas += 1;
+      try {
+        const { pedido } = await transbankService.obtenerEstadoPedido(Number(orderId));
+        if (pedido.estado_pago && pedido.estado_pago !== 'PENDIENTE' && pedido.estado_pago !== 'PROCESANDO') {
+          setProcesando(false);
+          fetchOrderDetails();
+          if (pedido.estado_pago !== 'PAGADO') {
+            toast.error('El pago no pudo ser confirmado');
+          }
+        }
+      } catch (error) {
+        console.error('Error consultando estado del pago:', error);
+      }
+      if (consultas >= MAX_CONSULTAS) {
+        clearInterval(intervalo);
+      }
+    }, INTERVALO_CONSULTA_MS);
+    return () => clearInterval(intervalo);
+  }, [orderId, procesando]);
+
   const fetchOrderDetails = async () => {
     try {
       const response = await fetch(`http://localhost:5000/pedidos/${orderId}`);
@@ -76,6 +107,18 @@ const PaymentSuccess: React.FC = () => {
     );
   }
 
+  if (procesando) {
+    return (
+      <div className="min-h-screen bg-gray-50 flex items-center justify-center">
+        <div className="text-center">
+          <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-600 mx-auto"></div>
+          <p className="mt-4 text-gray-600">Confirmando tu pago...</p>
+          {orderId && <p className="text-sm text-gray-500 mt-2">Número de pedido: #{orderId}</p>}
+        </div>
+      </div>
+    );
+  }
+
   return (
     <div className="min-h-screen bg-gray-50">
       <div className="max-w-4xl mx-auto px-4 sm:px-6 lg:px-8 py-8">
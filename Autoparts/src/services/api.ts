@@ -6,7 +6,13 @@ import {
   Subcategoria,
   Producto,
   ProductoConStock,
+  ProductoBusqueda,
+  BitacoraLog,
+  BitacoraFiltros,
   Inventario,
+  InventarioDetalle,
+  Pagina,
+  PaginaParams,
   Carrito,
   ProductoCarrito,
   Pedido,
@@ -15,6 +21,7 @@ import {
   LoginRequest,
   RegistroRequest,
   AgregarAlCarritoRequest,
+  OperacionCarrito,
   CrearPedidoRequest
 } from '../types';
 
@@ -45,6 +52,15 @@ api.interceptors.response.use(
   }
 );
 
+// Parámetros de paginación por keyset (limit / after / total)
+const paginaQuery = ({ limit, after, total }: PaginaParams): string => {
+  const params = new URLSearchParams();
+  if (limit) params.append('limit', limit.toString());
+  if (after) params.append('after', after);
+  if (total) params.append('total', '1');
+  return params.toString();
+};
+
 // Servicios de Usuarios
 export const usuarioService = {
   login: async (credentials: LoginRequest): Promise<Usuario> => {
@@ -158,12 +174,31 @@ export const inventarioService = {
     return response.data;
   },
 
-  ingresarStock: async (data: { id_sucursal: number; id_producto: number; cantidad: number }): Promise<{ mensaje: string }> => {
+  ingresarStock: async (data: { id_sucursal: number; id_producto: number; cantidad: number }): Promise<{ mensaje: string; stock: number }> => {
     const response = await api.post('/ingresar_stock', data);
     return response.data;
   },
 
-  rebajarStock: async (data: { id_sucursal: number; id_producto: number; cantidad: number }): Promise<{ mensaje: string }> => {
+  // Carga masiva: filas en JSON o un archivo CSV (id_sucursal,id_producto,cantidad)
+  ingresarStockLote: async (
+    filas: { id_sucursal: number; id_producto: number; cantidad: number }[] | File,
+    modo: 'sumar' | 'fijar' = 'sumar',
+    todoONada = false
+  ): Promise<{ procesadas: number; errores: { fila: number; error: string }[] }> => {
+    const params = new URLSearchParams({ modo });
+    if (todoONada) params.append('todo_o_nada', '1');
+    let body: FormData | { filas: typeof filas };
+    if (filas instanceof File) {
+      body = new FormData();
+      body.append('archivo', filas);
+    } else {
+      body = { filas };
+    }
+    const response = await api.post(`/inventario/lote?${params.toString()}`, body);
+    return response.data;
+  },
+
+  rebajarStock: async (data: { id_sucursal: number; id_producto: number; cantidad: number }): Promise<{ mensaje: string; stock: number }> => {
     const response = await api.post('/rebajar_stock', data);
     return response.data;
   },
@@ -172,6 +207,11 @@ export const inventarioService = {
     const response = await api.delete(`/inventario?sucursal=${id_sucursal}&producto=${id_producto}`);
     return response.data;
   },
+
+  obtenerInventarioDetallado: async (pagina: PaginaParams = { limit: 50 }): Promise<{ inventario: InventarioDetalle[] } & Pagina> => {
+    const response = await api.get(`/inventario/detalle?${paginaQuery(pagina)}`);
+    return response.data;
+  },
 };
 
 // Servicios de Carrito
@@ -201,6 +241,12 @@ export const carritoService = {
     return response.data;
   },
 
+  // Varias operaciones en una sola transacción (restaurar un carrito, editar carritos grandes)
+  aplicarOperaciones: async (idCarrito: number, operaciones: OperacionCarrito[]): Promise<{ mensaje: string; actualizadas: number; eliminadas: number }> => {
+    const response = await api.patch(`/carritos/${idCarrito}/productos`, { operaciones });
+    return response.data;
+  },
+
   vaciarCarrito: async (idCarrito: number): Promise<{ mensaje: string }> => {
     const response = await api.delete(`/carritos/${idCarrito}/vaciar`);
     return response.data;
@@ -265,6 +311,18 @@ export const productoService = {
     return response.data;
   },
 
+  obtenerProductosPaginados: async (pagina: PaginaParams = { limit: 50 }): Promise<{ productos: ProductoConStock[] } & Pagina> => {
+    const response = await api.get(`/productos?${paginaQuery(pagina)}`);
+    return response.data;
+  },
+
+  buscarProductos: async (q: string, pagina: PaginaParams = { limit: 20 }): Promise<{ productos: ProductoBusqueda[]; total: number; siguiente: string | null }> => {
+    const params = new URLSearchParams(paginaQuery(pagina));
+    params.append('q', q);
+    const response = await api.get(`/productos/buscar?${params.toString()}`);
+    return response.data;
+  },
+
   obtenerProducto: async (id: number): Promise<ProductoConStock> => {
     const response = await api.get(`/productos/${id}`);
     return response.data;
@@ -287,10 +345,24 @@ export const productoService = {
 };
 
 export const bitacoraService = {
-  obtenerBitacora: async (): Promise<{ bitacora: Array<{ id_log: number; id_usuario: number; accion: string; fecha_accion: string }> }> => {
+  obtenerBitacora: async (): Promise<{ bitacora: BitacoraLog[] }> => {
     const response = await api.get('/bitacora');
     return response.data;
   },
+
+  // Filtros por usuario, prefijo de acción y rango de fechas; páginas de la más reciente a la más antigua
+  obtenerBitacoraPaginada: async (
+    filtros: BitacoraFiltros = {},
+    pagina: PaginaParams = { limit: 100 }
+  ): Promise<{ bitacora: BitacoraLog[] } & Pagina> => {
+    const params = new URLSearchParams(paginaQuery(pagina));
+    if (filtros.usuario) params.append('usuario', filtros.usuario.toString());
+    if (filtros.accion) params.append('accion', filtros.accion);
+    if (filtros.desde) params.append('desde', filtros.desde);
+    if (filtros.hasta) params.append('hasta', filtros.hasta);
+    const response = await api.get(`/bitacora?${params.toString()}`);
+    return response.data;
+  },
 };
 
 // Servicios de Transbank
@@ -331,8 +403,24 @@ export const transbankService = {
     return response.data;
   },
 
-  obtenerEstadisticas: async (): Promise<any> => {
-    const response = await transbankApi.get('/transbank/estadisticas');
+  obtenerEstadoPedido: async (idPedido: number): Promise<{
+    success: boolean;
+    pedido: {
+      id_pedido: number;
+      estado_pedido: string;
+      estado_pago: string | null;
+      monto_total: number;
+      fecha_pedido: string;
+      cliente: string;
+    };
+  }> => {
+    const response = await transbankApi.get(`/transbank/estado-pedido/${idPedido}`);
+    return response.data;
+  },
+
+  // fresh: calcular en vivo en lugar de leer el resumen (refrescado cada minuto)
+  obtenerEstadisticas: async (fresh = false): Promise<any> => {
+    const response = await transbankApi.get(`/transbank/estadisticas${fresh ? '?fresh=1' : ''}`);
     return response.data;
   },
 
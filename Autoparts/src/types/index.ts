@@ -49,6 +49,51 @@ export interface Inventario {
   stock: number;
 }
 
+export interface InventarioDetalle {
+  id_producto: number;
+  nombre: string;
+  marca: string;
+  descripcion: string;
+  codigo_interno: string;
+  codigo_fabricante: string;
+  imagen: string;
+  precio_unitario: number;
+  id_categoria: number;
+  stock: number;
+  sucursal_nombre: string;
+  id_sucursal: number;
+}
+
+// Paginación por keyset: "after" es el cursor "siguiente" devuelto por la página anterior
+export interface PaginaParams {
+  limit?: number;
+  after?: string | null;
+  total?: boolean;
+}
+
+export interface Pagina {
+  siguiente: string | null;
+  total?: number;
+}
+
+export interface BitacoraLog {
+  id_log: number;
+  id_usuario: number;
+  accion: string;
+  fecha_accion: string;
+}
+
+export interface BitacoraFiltros {
+  usuario?: number;
+  accion?: string;
+  desde?: string;
+  hasta?: string;
+}
+
+export interface ProductoBusqueda extends Omit<Producto, 'stock_min'> {
+  puntaje: number;
+}
+
 export interface Carrito {
   id_carrito: number;
   fecha_creacion: string;
@@ -64,6 +109,7 @@ export interface ProductoCarrito {
   marca: string;
   imagen: string;
   sucursal_nombre: string;
+  stock_disponible?: number;
 }
 
 export interface Pedido {
@@ -140,6 +186,15 @@ export interface AgregarAlCarritoRequest {
   valor_total: number;
 }
 
+// Operación del PATCH /carritos/{id}/productos: agregar suma, fijar reemplaza, eliminar quita la línea
+export interface OperacionCarrito {
+  op: 'agregar' | 'fijar' | 'eliminar';
+  id_producto: number;
+  cantidad?: number;
+  id_sucursal?: number;
+  valor_unitario?: number;
+}
+
 export interface CrearPedidoRequest {
   id_usuario: number;
   id_carrito: number;
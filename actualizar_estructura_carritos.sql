@@ -113,7 +113,7 @@ CREATE TABLE CARRITO_PRODUCTOS (
 
 -- DETALLE_PEDIDO
 CREATE TABLE DETALLE_PEDIDO (
-    ID_DETALLE NUMBER PRIMARY KEY, 
+    ID_DETALLE NUMBER GENERATED BY DEFAULT ON NULL AS IDENTITY PRIMARY KEY,
     ID_CARRITO NUMBER NOT NULL,
     DIRECCION VARCHAR2(150) NOT NULL,
     ESTADO VARCHAR2(20) DEFAULT 'PENDIENTE' 
@@ -158,5 +158,10 @@ CREATE INDEX IDX_CARRITOS_USUARIO ON CARRITOS(ID_USUARIO);
 CREATE INDEX IDX_CARRITOS_SESSION ON CARRITOS(SESSION_ID);
 CREATE INDEX IDX_CARRITOS_ESTADO ON CARRITOS(ESTADO);
 CREATE INDEX IDX_CARRITO_PRODUCTOS_FECHA ON CARRITO_PRODUCTOS(FECHA_AGREGADO);
+CREATE INDEX IDX_PRODUCTOS_NOMBRE_ID ON PRODUCTOS(NOMBRE, ID_PRODUCTO);
+CREATE INDEX IDX_INVENTARIO_PRODUCTO_STOCK ON INVENTARIO(ID_PRODUCTO, STOCK);
+CREATE INDEX IDX_BITACORA_FECHA_ID ON BITACORA(FECHA_ACCION, ID_LOG);
+CREATE INDEX IDX_BITACORA_USUARIO_FECHA ON BITACORA(ID_USUARIO, FECHA_ACCION, ID_LOG);
+CREATE INDEX IDX_BITACORA_ACCION_FECHA ON BITACORA(ACCION, FECHA_ACCION);
 
 COMMIT; 
\ No newline at end of file
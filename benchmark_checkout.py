@@ -0,0 +1,154 @@
+import argparse
+import json
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+API_URL = 'http://localhost:5000'
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def lineas_plantilla(id_carrito):
+    """Líneas del carrito de referencia, que se copian en un carrito nuevo por pedido"""
+    response = requests.get(f'{API_URL}/carritos/{id_carrito}/productos')
+    response.raise_for_status()
+    return response.json()['productos']
+
+
+def preparar_carritos(id_usuario, lineas, cantidad, concurrencia, etiqueta):
+    """Crear `cantidad` carritos del usuario con las mismas líneas (no se mide).
+
+    Cada pedido reserva el stock de su carrito (RESERVAS_STOCK), así que
+    repetir el mismo carrito mide pedidos distintos: el primero reserva y los
+    siguientes terminan en STOCK_INSUFICIENTE.
+    """
+    sesion = requests.Session()
+    operaciones = [{
+        'op': 'agregar',
+        'id_producto': linea['id_producto'],
+        'id_sucursal': linea['id_sucursal'],
+        'cantidad': linea['cantidad'],
+        'valor_unitario': linea['valor_unitario']
+    } for linea in lineas]
+
+    def un_carrito(numero):
+        response = sesion.post(f'{API_URL}/carritos', json={
+            'id_usuario': id_usuario, 'nombre_carrito': f'Benchmark {etiqueta} {numero}'
+        })
+        response.raise_for_status()
+        id_carrito = response.json()['id_carrito']
+        response = sesion.patch(f'{API_URL}/carritos/{id_carrito}/productos', json={'operaciones': operaciones})
+        response.raise_for_status()
+        return id_carrito
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        return list(executor.map(un_carrito, range(cantidad)))
+
+
+def medir_checkout(modo, datos, carritos, concurrencia):
+    """Crear un pedido por carrito con POST /pedidos?modo=... y devolver (latencias en ms de los 200, status por respuesta)"""
+    sesion = requests.Session()
+
+    def un_pedido(id_carrito):
+        inicio = time.perf_counter()
+        response = sesion.post(f'{API_URL}/pedidos', params={'modo': modo}, json={**datos, 'id_carrito': id_carrito})
+        return (time.perf_counter() - inicio) * 1000, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        resultados = list(executor.map(un_pedido, carritos))
+    latencias = [ms for ms, status in resultados if status == 200]
+    return latencias, Counter(status for _, status in resultados)
+
+
+def benchmark_checkout():
+    parser = argparse.ArgumentParser(description='Latencia de crear_pedido: sentencias sueltas vs procedimiento PL/SQL')
+    parser.add_argument('--usuario', type=int, required=True, help='ID_USUARIO existente')
+    parser.add_argument('--carrito', type=int, required=True,
+                        help='ID_CARRITO de referencia: sus líneas se copian en un carrito nuevo por pedido')
+    parser.add_argument('--pedidos', type=int, default=200, help='Pedidos por modo')
+    parser.add_argument('--concurrencia', type=int, default=4)
+    parser.add_argument('--calentamiento', type=int, default=10, help='Pedidos por modo que no se miden')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    args = parser.parse_args()
+
+    datos = {
+        'id_usuario': args.usuario,
+        'direccion': 'Benchmark checkout',
+        'metodo_pago': 'TRANSBANK',
+        'monto_total': 1000
+    }
+
+    print("⚠️  Este benchmark crea carritos y pedidos reales (CARRITOS, DETALLE_PEDIDO, PEDIDOS, PAGOS,")
+    print("    BITACORA) y reserva stock en RESERVAS_STOCK hasta que las reservas vencen")
+    print(f"📦 {args.pedidos} pedidos por modo, concurrencia {args.concurrencia}\n")
+
+    resultados = {}
+    try:
+        lineas = lineas_plantilla(args.carrito)
+        if not lineas:
+            print(f"❌ El carrito {args.carrito} no tiene productos")
+            return
+        # Ambos modos deben poder reservar todos sus pedidos; si no, los 409 achican la muestra
+        pedidos_totales = 2 * (args.pedidos + args.calentamiento)
+        for linea in lineas:
+            necesario = linea['cantidad'] * pedidos_totales
+            if linea.get('stock_disponible') is not None and linea['stock_disponible'] < necesario:
+                print(f"⚠️  Producto {linea['id_producto']} (sucursal {linea['id_sucursal']}): "
+                      f"disponible {linea['stock_disponible']}, se reservarán {necesario}")
+
+        for modo in ('sentencias', 'plsql'):
+            carritos = preparar_carritos(args.usuario, lineas, args.calentamiento + args.pedidos,
+                                         args.concurrencia, modo)
+            medir_checkout(modo, datos, carritos[:args.calentamiento], args.concurrencia)
+            latencias, status = medir_checkout(modo, datos, carritos[args.calentamiento:], args.concurrencia)
+            errores = sum(n for codigo, n in status.items() if codigo != 200)
+            resultados[modo] = {
+                'ok': len(latencias),
+                'errores': errores,
+                'status': {str(codigo): n for codigo, n in sorted(status.items())}
+            }
+            if not latencias:
+                print(f"❌ {modo}: ningún pedido respondió 200 (status {dict(status)})")
+                continue
+            resultados[modo].update({
+                'p50_ms': round(percentil(latencias, 50), 1),
+                'p99_ms': round(percentil(latencias, 99), 1),
+                'media_ms': round(statistics.mean(latencias), 1)
+            })
+            print(f"✅ {modo:<10} p50={percentil(latencias, 50):7.1f} ms  "
+                  f"p99={percentil(latencias, 99):7.1f} ms  "
+                  f"media={statistics.mean(latencias):7.1f} ms  ok={len(latencias)}  "
+                  f"errores={errores} {dict(status) if errores else ''}")
+            if errores:
+                print(f"⚠️  {modo}: {errores} pedidos no respondieron 200; las latencias no son comparables")
+    except requests.exceptions.ConnectionError:
+        print(f"❌ Error de conexión. Asegúrate de que la API esté ejecutándose en {API_URL}")
+        return
+    except requests.exceptions.HTTPError as e:
+        print(f"❌ No se pudieron preparar los carritos: {e} {e.response.text[:200]}")
+        return
+
+    if args.salida and resultados:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump({
+                'fecha': datetime.now().isoformat(timespec='seconds'),
+                'pedidos': args.pedidos,
+                'concurrencia': args.concurrencia,
+                'calentamiento': args.calentamiento,
+                'lineas_por_carrito': len(lineas),
+                'resultados': resultados
+            }, archivo, indent=2, ensure_ascii=False)
+        print(f"\n💾 Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    benchmark_checkout()
@@ -0,0 +1,95 @@
+import argparse
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+API_URL = 'http://localhost:5000'
+TRANSBANK_URL = 'http://localhost:5001'
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def un_pago(sesion, datos):
+    """Pedido -> transacción -> página de pago -> confirmación. Devuelve (ms por etapa, resultado)"""
+    tiempos = {}
+
+    inicio = time.perf_counter()
+    response = sesion.post(f'{API_URL}/pedidos', json=datos)
+    tiempos['pedido'] = (time.perf_counter() - inicio) * 1000
+    if response.status_code != 200:
+        return tiempos, 'error_pedido'
+    id_pedido = response.json()['id_pedido']
+
+    inicio = time.perf_counter()
+    response = sesion.post(f'{TRANSBANK_URL}/transbank/crear-transaccion',
+                           json={'id_pedido': id_pedido, 'monto': datos['monto_total']})
+    tiempos['crear'] = (time.perf_counter() - inicio) * 1000
+    if response.status_code != 200:
+        return tiempos, 'error_transaccion'
+    transaccion = response.json()
+
+    # El simulador decide si el comprador vuelve al comercio o abandona el pago
+    response = sesion.get(transaccion['url'], params={'token_ws': transaccion['token']}, allow_redirects=False)
+    if response.status_code not in (302, 303):
+        return tiempos, 'abandonado'
+
+    inicio = time.perf_counter()
+    response = sesion.get(response.headers['Location'], allow_redirects=False)
+    tiempos['confirmar'] = (time.perf_counter() - inicio) * 1000
+    destino = parse_qs(urlparse(response.headers.get('Location', '')).query)
+    return tiempos, destino.get('status', ['sin_redireccion'])[0]
+
+
+def benchmark_pagos():
+    parser = argparse.ArgumentParser(description='Flujo de pago completo contra el servidor Webpay simulado')
+    parser.add_argument('--usuario', type=int, required=True, help='ID_USUARIO existente')
+    parser.add_argument('--carrito', type=int, required=True, help='ID_CARRITO existente y con productos')
+    parser.add_argument('--pagos', type=int, default=500)
+    parser.add_argument('--concurrencia', type=int, default=16)
+    args = parser.parse_args()
+
+    datos = {
+        'id_usuario': args.usuario,
+        'id_carrito': args.carrito,
+        'direccion': 'Benchmark pagos',
+        'metodo_pago': 'TRANSBANK',
+        'monto_total': 1000
+    }
+
+    print("⚠️  Este benchmark crea pedidos y pagos reales en la base; la API Transbank debe")
+    print("   estar iniciada con TRANSBANK_HOST apuntando a webpay_simulado.py")
+    print(f"💳 {args.pagos} pagos, concurrencia {args.concurrencia}\n")
+
+    sesion = requests.Session()
+    adaptador = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrencia)
+    sesion.mount('http://', adaptador)
+
+    try:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrencia) as executor:
+            resultados = list(executor.map(lambda _: un_pago(sesion, datos), range(args.pagos)))
+        duracion = time.perf_counter() - inicio
+    except requests.exceptions.ConnectionError as e:
+        print(f"❌ Error de conexión: {e}")
+        return
+
+    print(f"⏱️  {args.pagos / duracion * 60:,.0f} pagos/minuto ({duracion:.1f} s)")
+    for etapa in ('pedido', 'crear', 'confirmar'):
+        latencias = [t[etapa] for t, _ in resultados if etapa in t]
+        if latencias:
+            print(f"✅ {etapa:<10} p50={percentil(latencias, 50):7.1f} ms  "
+                  f"p99={percentil(latencias, 99):7.1f} ms  "
+                  f"media={statistics.mean(latencias):7.1f} ms")
+    print(f"📊 Resultados: {dict(Counter(resultado for _, resultado in resultados))}")
+
+
+if __name__ == "__main__":
+    benchmark_pagos()
@@ -0,0 +1 @@
+"""Código compartido por las APIs de Autoparts (Interna, Externa y Transbank)"""
@@ -0,0 +1,107 @@
+"""
+Registro diferido de CARRITOS.FECHA_ULTIMA_ACTIVIDAD: los toques se acumulan
+en memoria (uno por carrito, el más reciente) y un hilo los escribe juntos
+con executemany cada `intervalo` segundos.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Solo escribe si la fecha nueva es posterior, así un lote atrasado no retrocede la actividad
+SQL_ACTUALIZAR_ACTIVIDAD = """
+    UPDATE CARRITOS SET FECHA_ULTIMA_ACTIVIDAD = :fecha
+    WHERE ID_CARRITO = :id_carrito
+      AND (FECHA_ULTIMA_ACTIVIDAD IS NULL OR FECHA_ULTIMA_ACTIVIDAD < :fecha)
+"""
+
+
+class ActividadCarritos:
+    """Toques de actividad coalescidos por carrito.
+
+    La columna solo la usa la limpieza de carritos de invitados (30 días), así
+    que puede atrasarse hasta `intervalo` segundos. Si la escritura falla, los
+    toques vuelven a quedar pendientes para el siguiente ciclo; si el proceso
+    se cae se pierden a lo más los del último intervalo.
+    """
+
+    def __init__(self, db, intervalo=30, lote=1000):
+        self.db = db
+        self.intervalo = intervalo
+        self.lote = lote
+        self._pendientes = {}
+        self._lock = threading.Lock()
+        self._escritura = threading.Lock()
+        self._hilo = None
+        self.toques = 0
+        self.escritos = 0
+        self.errores = 0
+        self.flushes = 0
+        self.ultimo_flush_ms = 0
+
+    def iniciar(self):
+        """Arrancar el hilo de escritura (se llama solo al primer toque)"""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='actividad-carritos', daemon=True)
+                self._hilo.start()
+                atexit.register(self.flush)
+
+    def tocar(self, id_carrito):
+        """Registrar actividad en el carrito ahora"""
+        if self._hilo is None:
+            self.iniciar()
+        with self._lock:
+            self._pendientes[id_carrito] = datetime.now()
+            self.toques += 1
+
+    def _ejecutar(self):
+        while True:
+            time.sleep(self.intervalo)
+            self.flush()
+
+    def flush(self):
+        """Escribir ahora todos los toques pendientes; devuelve cuántos carritos se enviaron"""
+        with self._escritura:
+            with self._lock:
+                pendientes, self._pendientes = self._pendientes, {}
+            if not pendientes:
+                return 0
+            filas = [{'id_carrito': id_carrito, 'fecha': fecha} for id_carrito, fecha in pendientes.items()]
+            inicio = time.perf_counter()
+            try:
+                with self.db.acquire() as conn:
+                    for i in range(0, len(filas), self.lote):
+                        self.db.executemany(SQL_ACTUALIZAR_ACTIVIDAD, filas[i:i + self.lote], conn=conn, commit=True)
+            except Exception as e:
+                logger.error(f"❌ Error escribiendo actividad de {len(filas)} carritos: {e}")
+                with self._lock:
+                    self.errores += 1
+                    # Devolver los toques sin pisar otros más recientes que hayan llegado mientras tanto
+                    for id_carrito, fecha in pendientes.items():
+                        if self._pendientes.get(id_carrito, fecha) <= fecha:
+                            self._pendientes[id_carrito] = fecha
+                return 0
+            with self._lock:
+                self.escritos += len(filas)
+                self.flushes += 1
+                self.ultimo_flush_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            return len(filas)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'intervalo_segundos': self.intervalo,
+                'pendientes': len(self._pendientes),
+                'toques': self.toques,
+                'carritos_escritos': self.escritos,
+                # Toques que no necesitaron su propio UPDATE
+                'coalescidos': self.toques - self.escritos - len(self._pendientes),
+                'flushes': self.flushes,
+                'errores': self.errores,
+                'ultimo_flush_ms': self.ultimo_flush_ms
+            }
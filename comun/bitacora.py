@@ -0,0 +1,137 @@
+"""
+Escritura de BITACORA fuera del request: las acciones se encolan en memoria
+y un hilo de fondo las inserta por lotes con executemany.
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# ID_USUARIO se puede omitir si se indica el pedido: se toma de PEDIDOS al insertar
+SQL_INSERT_BITACORA = """
+    INSERT INTO BITACORA (ID_USUARIO, ACCION, FECHA_ACCION)
+    VALUES (
+        NVL(:id_usuario, (SELECT p.ID_USUARIO FROM PEDIDOS p WHERE p.ID_PEDIDO = :id_pedido)),
+        :accion,
+        :fecha
+    )
+"""
+
+REINTENTOS = 3
+
+
+class BitacoraWriter:
+    """Cola acotada + hilo que vacía la cola cada `intervalo_ms` o cada `lote` entradas.
+
+    Durabilidad:
+    - registrar(..., conn=conn) inserta en el momento dentro de la transacción
+      del llamador, así la entrada se confirma (o se deshace) junto con ella.
+      Es lo que se usa para eventos de pago.
+    - registrar(...) sin conn es de mejor esfuerzo: si la cola está llena o la
+      base falla tras varios reintentos, la entrada se descarta y se cuenta.
+    """
+
+    def __init__(self, db, max_cola=10000, lote=200, intervalo_ms=500):
+        self.db = db
+        self.lote = lote
+        self.intervalo = intervalo_ms / 1000
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.encoladas = 0
+        self.escritas = 0
+        self.descartadas = 0
+        self.errores = 0
+        self.lotes = 0
+        self.max_en_cola = 0
+        self.ultimo_lote_ms = 0
+
+    def iniciar(self):
+        """Arrancar el hilo de fondo (se llama solo al primer registrar)"""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='bitacora-writer', daemon=True)
+                self._hilo.start()
+                atexit.register(self.flush)
+
+    def registrar(self, accion, id_usuario=None, id_pedido=None, conn=None):
+        """Registrar una acción en BITACORA"""
+        fila = {'id_usuario': id_usuario, 'id_pedido': id_pedido, 'accion': accion, 'fecha': datetime.now()}
+        if conn is not None:
+            with conn.cursor() as cursor:
+                cursor.execute(SQL_INSERT_BITACORA, fila)
+            return
+        if self._hilo is None:
+            self.iniciar()
+        try:
+            self._cola.put_nowait(fila)
+        except queue.Full:
+            with self._lock:
+                self.descartadas += 1
+                descartadas = self.descartadas
+            if descartadas % 100 == 1:
+                logger.warning(f"⚠️ Cola de bitácora llena, entradas descartadas: {descartadas}")
+            return
+        with self._lock:
+            self.encoladas += 1
+            self.max_en_cola = max(self.max_en_cola, self._cola.qsize())
+
+    def flush(self, timeout=5):
+        """Esperar a que se escriba lo encolado hasta ahora (por ejemplo al apagar el servicio)"""
+        limite = time.monotonic() + timeout
+        while self._cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.05)
+        return self._cola.unfinished_tasks == 0
+
+    def _ejecutar(self):
+        while True:
+            filas = [self._cola.get()]
+            limite = time.monotonic() + self.intervalo
+            while len(filas) < self.lote:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    filas.append(self._cola.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._escribir(filas)
+            for _ in filas:
+                self._cola.task_done()
+
+    def _escribir(self, filas):
+        for intento in range(1, REINTENTOS + 1):
+            inicio = time.perf_counter()
+            try:
+                with self.db.acquire() as conn:
+                    self.db.executemany(SQL_INSERT_BITACORA, filas, conn=conn, commit=True)
+            except Exception as e:
+                logger.error(f"❌ Error escribiendo bitácora (intento {intento}/{REINTENTOS}): {e}")
+                time.sleep(0.5 * intento)
+                continue
+            with self._lock:
+                self.escritas += len(filas)
+                self.lotes += 1
+                self.ultimo_lote_ms = round((time.perf_counter() - inicio) * 1000, 2)
+            return
+        with self._lock:
+            self.errores += len(filas)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'en_cola': self._cola.qsize(),
+                'max_cola': self._cola.maxsize,
+                'max_en_cola': self.max_en_cola,
+                'encoladas': self.encoladas,
+                'escritas': self.escritas,
+                'descartadas': self.descartadas,
+                'perdidas_por_error': self.errores,
+                'lotes': self.lotes,
+                'ultimo_lote_ms': self.ultimo_lote_ms
+            }
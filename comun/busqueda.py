@@ -0,0 +1,191 @@
+"""
+Índice invertido en memoria para buscar productos por nombre, marca,
+descripción y códigos (interno y de fabricante), con resultados ordenados
+por relevancia.
+"""
+
+import heapq
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+# Peso de cada campo de texto en la relevancia
+PESOS_TEXTO = {'nombre': 3.0, 'marca': 2.0, 'descripcion': 1.0}
+PESO_CODIGO_EXACTO = 10.0
+PESO_CODIGO_PREFIJO = 6.0
+PESO_CODIGO_NGRAMA = 1.0
+# Una coincidencia por prefijo de palabra vale menos que la palabra completa
+FACTOR_PREFIJO = 0.5
+LARGO_MIN_PREFIJO = 2
+LARGO_NGRAMA = 3
+
+# Campos del producto que se guardan para responder sin ir a la base
+CAMPOS_RESULTADO = ('id_producto', 'nombre', 'marca', 'descripcion', 'codigo_interno',
+                    'codigo_fabricante', 'precio_unitario', 'id_categoria', 'imagen')
+
+_NO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+
+
+def normalizar(texto):
+    """Pasar a minúsculas y quitar tildes"""
+    texto = unicodedata.normalize('NFKD', str(texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def tokenizar(texto):
+    return [t for t in _NO_ALFANUMERICO.split(normalizar(texto)) if t]
+
+
+def normalizar_codigo(codigo):
+    """Los códigos se comparan sin guiones, puntos ni espacios ("BR-123.4" == "br1234")"""
+    return _NO_ALFANUMERICO.sub('', normalizar(codigo))
+
+
+def ngramas(texto, n=LARGO_NGRAMA):
+    return {texto[i:i + n] for i in range(len(texto) - n + 1)}
+
+
+class IndiceProductos:
+    """Índice invertido seguro entre hilos.
+
+    Las palabras de NOMBRE, MARCA y DESCRIPCION se indexan completas y por
+    prefijo (para buscar mientras se escribe); los códigos se indexan
+    completos, por prefijo y por n-gramas, de modo que un fragmento del
+    código también encuentra el producto.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._terminos = defaultdict(dict)    # término -> {id_producto: peso}
+        self._prefijos = defaultdict(dict)    # prefijo de palabra -> {id_producto: peso}
+        self._codigos = defaultdict(dict)     # código, prefijo o n-grama -> {id_producto: peso}
+        self._documentos = {}                 # id_producto -> campos de CAMPOS_RESULTADO
+        self._nombres = {}                    # id_producto -> nombre normalizado (desempate al ordenar)
+        self._claves = {}                     # id_producto -> [(mapa, término)] para poder quitarlo
+        self.cargado = False
+
+    def __len__(self):
+        return len(self._documentos)
+
+    def cargar(self, productos):
+        """Reconstruir el índice completo a partir de una lista de productos (dicts)"""
+        with self._lock:
+            self._terminos.clear()
+            self._prefijos.clear()
+            self._codigos.clear()
+            self._documentos.clear()
+            self._nombres.clear()
+            self._claves.clear()
+            for producto in productos:
+                self._agregar(producto)
+            self.cargado = True
+
+    def actualizar(self, producto):
+        """Agregar un producto o reemplazar su versión anterior"""
+        with self._lock:
+            self._quitar(producto['id_producto'])
+            self._agregar(producto)
+
+    def eliminar(self, id_producto):
+        with self._lock:
+            self._quitar(id_producto)
+
+    def _agregar(self, producto):
+        id_producto = producto['id_producto']
+        self._documentos[id_producto] = {campo: producto.get(campo) for campo in CAMPOS_RESULTADO}
+        self._nombres[id_producto] = normalizar(producto.get('nombre'))
+        claves = self._claves[id_producto] = []
+
+        def indexar(mapa, termino, peso):
+            actual = mapa[termino].get(id_producto, 0)
+            if peso > actual:
+                if not actual:
+                    claves.append((mapa, termino))
+                mapa[termino][id_producto] = peso
+
+        for campo, peso in PESOS_TEXTO.items():
+            for token in tokenizar(producto.get(campo)):
+                indexar(self._terminos, token, peso)
+                for largo in range(LARGO_MIN_PREFIJO, len(token)):
+                    indexar(self._prefijos, token[:largo], peso * FACTOR_PREFIJO)
+        for campo in ('codigo_interno', 'codigo_fabricante'):
+            codigo = normalizar_codigo(producto.get(campo))
+            if not codigo:
+                continue
+            indexar(self._codigos, codigo, PESO_CODIGO_EXACTO)
+            for largo in range(LARGO_MIN_PREFIJO, len(codigo)):
+                indexar(self._codigos, codigo[:largo], PESO_CODIGO_PREFIJO)
+            for ngrama in ngramas(codigo):
+                indexar(self._codigos, ngrama, PESO_CODIGO_NGRAMA)
+
+    def _quitar(self, id_producto):
+        self._documentos.pop(id_producto, None)
+        self._nombres.pop(id_producto, None)
+        for mapa, termino in self._claves.pop(id_producto, []):
+            ids = mapa.get(termino)
+            if ids is not None:
+                ids.pop(id_producto, None)
+                if not ids:
+                    del mapa[termino]
+
+    def _puntajes_termino(self, termino):
+        """Puntaje por producto para un término de la consulta (la mejor coincidencia por producto)"""
+        puntajes = {}
+
+        def sumar(ids):
+            for id_producto, peso in ids.items():
+                if peso > puntajes.get(id_producto, 0):
+                    puntajes[id_producto] = peso
+
+        sumar(self._terminos.get(termino, {}))
+        sumar(self._prefijos.get(termino, {}))
+        sumar(self._codigos.get(termino, {}))
+        # Fragmento de código más largo que un n-grama: se exige que aparezcan todos sus n-gramas
+        if len(termino) > LARGO_NGRAMA and termino not in self._codigos:
+            candidatos = None
+            for ngrama in ngramas(termino):
+                ids = self._codigos.get(ngrama, {})
+                candidatos = set(ids) if candidatos is None else candidatos & ids.keys()
+                if not candidatos:
+                    break
+            for id_producto in candidatos or ():
+                puntajes.setdefault(id_producto, PESO_CODIGO_NGRAMA * len(termino) / LARGO_NGRAMA)
+        # Sin coincidencias: probar sin el plural ("frenos" -> "freno"), con menos peso
+        if not puntajes and len(termino) > 3 and termino.endswith('s'):
+            for singular in (termino[:-1], termino[:-2]) if termino.endswith('es') else (termino[:-1],):
+                for id_producto, peso in self._terminos.get(singular, {}).items():
+                    puntajes[id_producto] = max(puntajes.get(id_producto, 0), peso * FACTOR_PREFIJO)
+        return puntajes
+
+    def buscar(self, consulta, limite=None, despues=None):
+        """Productos que coinciden con todos los términos de la consulta, del más relevante al menos.
+
+        Devuelve (total, resultados) donde resultados es una lista de
+        (clave_orden, puntaje, producto). Con limite solo se ordena la página
+        pedida; despues es la clave_orden del último resultado de la página anterior.
+        """
+        terminos = tokenizar(consulta)
+        # Un código escrito con separadores ("BR-1234") también se busca junto
+        codigo = normalizar_codigo(consulta)
+        with self._lock:
+            total = None
+            for termino in terminos:
+                puntajes = self._puntajes_termino(termino)
+                if total is None:
+                    total = puntajes
+                else:
+                    total = {i: total[i] + p for i, p in puntajes.items() if i in total}
+                if not total:
+                    break
+            total = total or {}
+            if len(terminos) > 1 and codigo in self._codigos:
+                for id_producto, peso in self._codigos[codigo].items():
+                    total[id_producto] = max(total.get(id_producto, 0), peso * len(terminos))
+            claves = [(-round(p, 3), self._nombres[i], i) for i, p in total.items()]
+            if despues is not None:
+                despues = tuple(despues)
+                claves = [c for c in claves if c > despues]
+            claves = heapq.nsmallest(limite, claves) if limite else sorted(claves)
+            resultados = [(list(c), -c[0], self._documentos[c[2]]) for c in claves]
+        return len(total), resultados
@@ -0,0 +1,122 @@
+"""
+Caché en memoria para respuestas de solo lectura, con expiración por tiempo (TTL),
+descarte del elemento menos usado (LRU) e invalidación por espacio de nombres.
+"""
+
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Caché TTL + LRU segura entre hilos.
+
+    Las claves son tuplas cuyo primer elemento es el espacio de nombres
+    (por ejemplo la tabla: ('categorias',) o ('subcategorias', id_categoria)),
+    lo que permite invalidar de una vez todo lo que depende de una tabla.
+
+    Cada valor guardado recibe una versión única (sirve como ETag) y la hora
+    en que se cargó (sirve como Last-Modified).
+    """
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._generaciones = {}
+        self._lock = threading.Lock()
+        # Prefijo por proceso para que las versiones no se repitan tras un reinicio
+        self._prefijo = f"{os.getpid():x}{int(time.time()):x}"
+        self._secuencia = itertools.count(1)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _get_entry(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return item
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        """Devolver (True, valor) si la clave está vigente, o (False, None)"""
+        item = self._get_entry(key)
+        return (True, item[1]) if item else (False, None)
+
+    def set(self, key, value, generacion=None):
+        """Guardar un valor y devolver su entrada (expira, valor, versión, cargado_en).
+
+        Si el espacio de nombres fue invalidado mientras se calculaba, el valor
+        se entrega igual pero no se guarda.
+        """
+        with self._lock:
+            item = (time.monotonic() + self.ttl, value,
+                    f"{self._prefijo}-{next(self._secuencia)}", time.time())
+            if generacion is not None and generacion != self._generaciones.get(key[0], 0):
+                return item
+            self._data[key] = item
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return item
+
+    def get_or_load_entry(self, key, loader):
+        """Como get_or_load, pero devuelve (valor, versión, cargado_en) para respuestas condicionales"""
+        item = self._get_entry(key)
+        if item is None:
+            with self._lock:
+                generacion = self._generaciones.get(key[0], 0)
+            item = self.set(key, loader(), generacion)
+        return item[1], item[2], item[3]
+
+    def get_or_load(self, key, loader):
+        """Devolver el valor en caché o calcularlo con loader() y guardarlo"""
+        return self.get_or_load_entry(key, loader)[0]
+
+    def invalidate(self, *namespaces):
+        """Eliminar todas las entradas de los espacios de nombres indicados"""
+        with self._lock:
+            for namespace in namespaces:
+                self._generaciones[namespace] = self._generaciones.get(namespace, 0) + 1
+            for key in [k for k in self._data if k[0] in namespaces]:
+                del self._data[key]
+            self.invalidations += 1
+
+    def discard(self, key):
+        """Eliminar una sola entrada (p. ej. ('carrito', id)).
+
+        Las cargas en curso del mismo espacio de nombres se entregan pero no se
+        guardan, así no puede quedar guardado un valor leído antes de la escritura.
+        """
+        with self._lock:
+            self._generaciones[key[0]] = self._generaciones.get(key[0], 0) + 1
+            self._data.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entradas': len(self._data),
+                'max_entradas': self.maxsize,
+                'ttl_segundos': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else 0,
+                'descartes_lru': self.evictions,
+                'invalidaciones': self.invalidations
+            }
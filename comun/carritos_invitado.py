@@ -0,0 +1,345 @@
+"""
+Almacén de carritos de invitados fuera de Oracle: un dict en memoria con
+desalojo LRU o un servidor con protocolo Redis. La mayoría de estos carritos
+nunca se convierte, así que se escriben en CARRITOS/CARRITO_PRODUCTOS solo al
+convertirlos o al hacer el checkout (materializar_carrito).
+
+Los carritos del almacén usan IDs desde ID_INVITADO_BASE, muy por encima de la
+identidad de CARRITOS, así las rutas /carritos/<id> distinguen dónde buscar.
+"""
+
+import copy
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+ID_INVITADO_BASE = 10 ** 12
+
+_CAMPOS_FECHA = ('fecha_creacion', 'fecha_ultima_actividad')
+
+SQL_INSERTAR_CARRITO = """
+    INSERT INTO CARRITOS (ID_USUARIO, SESSION_ID, NOMBRE_CARRITO, ESTADO, FECHA_CREACION, FECHA_ULTIMA_ACTIVIDAD)
+    VALUES (:id_usuario, :session_id, :nombre_carrito, :estado, :fecha_creacion, :fecha_ultima_actividad)
+    RETURNING ID_CARRITO INTO :id_carrito
+"""
+
+SQL_INSERTAR_LINEA = """
+    INSERT INTO CARRITO_PRODUCTOS (ID_CARRITO, ID_PRODUCTO, ID_SUCURSAL, CANTIDAD, VALOR_UNITARIO, VALOR_TOTAL, FECHA_AGREGADO)
+    VALUES (:id_carrito, :id_producto, :id_sucursal, :cantidad, :valor_unitario, :valor_total, :fecha_agregado)
+"""
+
+
+class CarritoInvitadoNoEncontrado(Exception):
+    """El carrito no está en el almacén (nunca existió, se desalojó o venció)"""
+
+
+def es_carrito_invitado(id_carrito):
+    return id_carrito is not None and int(id_carrito) >= ID_INVITADO_BASE
+
+
+def nuevo_carrito(id_carrito, session_id, nombre_carrito):
+    ahora = datetime.now()
+    return {
+        'id_carrito': id_carrito,
+        'session_id': session_id,
+        'nombre_carrito': nombre_carrito,
+        'estado': 'ACTIVO',
+        'fecha_creacion': ahora,
+        'fecha_ultima_actividad': ahora,
+        'productos': []
+    }
+
+
+def buscar_linea(carrito, id_producto):
+    for linea in carrito['productos']:
+        if linea['id_producto'] == id_producto:
+            return linea
+    return None
+
+
+def aplicar_linea(carrito, id_producto, id_sucursal, cantidad, valor_unitario, sumar):
+    """Igual que el MERGE de CARRITO_PRODUCTOS: sumar=1 suma a la línea existente, sumar=0 la reemplaza.
+
+    id_sucursal y valor_unitario, si vienen, reemplazan los de la línea existente.
+
+    Devuelve False si la línea no existe y faltan id_sucursal o valor_unitario para crearla.
+    """
+    linea = buscar_linea(carrito, id_producto)
+    if linea is None:
+        if id_sucursal is None or valor_unitario is None:
+            return False
+        linea = {'id_producto': id_producto}
+        carrito['productos'].append(linea)
+        linea.update(id_sucursal=id_sucursal, cantidad=cantidad, valor_unitario=valor_unitario)
+    else:
+        linea['cantidad'] = linea['cantidad'] + cantidad if sumar else cantidad
+        # La sucursal nueva reemplaza a la anterior, como en el MERGE
+        if id_sucursal is not None:
+            linea['id_sucursal'] = id_sucursal
+        if valor_unitario is not None:
+            linea['valor_unitario'] = valor_unitario
+    linea['valor_total'] = linea['cantidad'] * linea['valor_unitario']
+    linea['fecha_agregado'] = datetime.now()
+    return True
+
+
+def quitar_linea(carrito, id_producto):
+    carrito['productos'] = [l for l in carrito['productos'] if l['id_producto'] != id_producto]
+
+
+def resumen_carrito(carrito):
+    """Misma forma que la consulta de /carritos/session/<session_id>"""
+    return {
+        'id_carrito': carrito['id_carrito'],
+        'nombre_carrito': carrito['nombre_carrito'],
+        'estado': carrito['estado'],
+        'fecha_creacion': carrito['fecha_creacion'],
+        'fecha_ultima_actividad': carrito['fecha_ultima_actividad'],
+        'num_productos': len(carrito['productos']),
+        'total_carrito': sum(l['valor_total'] for l in carrito['productos']) if carrito['productos'] else None
+    }
+
+
+def materializar_carrito(db, conn, carrito, id_usuario=None, estado='ACTIVO'):
+    """Escribir el carrito en CARRITOS/CARRITO_PRODUCTOS dentro de la transacción del llamador.
+
+    Con id_usuario el carrito queda del usuario (SESSION_ID NULL, por CK_CARRITO_TIPO).
+    Las líneas que Oracle rechaza (producto o sucursal que ya no existen) se
+    omiten. Devuelve (id_carrito, líneas escritas); no confirma.
+    """
+    with conn.cursor() as cursor:
+        id_var = cursor.var(int)
+        cursor.execute(SQL_INSERTAR_CARRITO, {
+            'id_usuario': id_usuario,
+            'session_id': None if id_usuario else carrito['session_id'],
+            'nombre_carrito': carrito['nombre_carrito'],
+            'estado': estado,
+            'fecha_creacion': carrito['fecha_creacion'],
+            'fecha_ultima_actividad': carrito['fecha_ultima_actividad'],
+            'id_carrito': id_var
+        })
+        id_carrito = id_var.getvalue()[0]
+    lineas = [{
+        'id_carrito': id_carrito,
+        **{campo: l[campo] for campo in ('id_producto', 'id_sucursal', 'cantidad', 'valor_unitario',
+                                         'valor_total', 'fecha_agregado')}
+    } for l in carrito['productos']]
+    if not lineas:
+        return id_carrito, 0
+    errores, _ = db.executemany(SQL_INSERTAR_LINEA, lineas, conn=conn, batcherrors=True)
+    for error in errores:
+        logger.warning(f"⚠️ Línea omitida al materializar el carrito {carrito['id_carrito']}: "
+                       f"producto {lineas[error.offset]['id_producto']} ({error.message})")
+    return id_carrito, len(lineas) - len(errores)
+
+
+class AlmacenCarritosMemoria:
+    """Carritos en un OrderedDict del proceso, desalojando el menos usado sobre `max_carritos`.
+
+    Solo sirve con un proceso (app.run); los carritos se pierden al reiniciar.
+    Los IDs parten del reloj en milisegundos para no repetirse entre reinicios.
+    """
+
+    tipo = 'memoria'
+
+    def __init__(self, max_carritos=50000, ttl_segundos=7 * 24 * 3600):
+        self.max_carritos = max_carritos
+        self.ttl = ttl_segundos
+        self._carritos = OrderedDict()
+        self._sesiones = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(ID_INVITADO_BASE + int(time.time() * 1000) * 100)
+        self.creados = 0
+        self.desalojados = 0
+        self.vencidos = 0
+        self.materializados = 0
+
+    def crear(self, session_id, nombre_carrito):
+        with self._lock:
+            carrito = nuevo_carrito(next(self._ids), session_id, nombre_carrito)
+            self._carritos[carrito['id_carrito']] = carrito
+            self._sesiones[session_id] = carrito['id_carrito']
+            self.creados += 1
+            while len(self._carritos) > self.max_carritos:
+                _, desalojado = self._carritos.popitem(last=False)
+                self._olvidar_sesion(desalojado)
+                self.desalojados += 1
+            return copy.deepcopy(carrito)
+
+    def _vigente(self, id_carrito):
+        carrito = self._carritos.get(id_carrito)
+        if carrito is None:
+            return None
+        if (datetime.now() - carrito['fecha_ultima_actividad']).total_seconds() > self.ttl:
+            del self._carritos[id_carrito]
+            self._olvidar_sesion(carrito)
+            self.vencidos += 1
+            return None
+        self._carritos.move_to_end(id_carrito)
+        return carrito
+
+    def _olvidar_sesion(self, carrito):
+        if self._sesiones.get(carrito['session_id']) == carrito['id_carrito']:
+            del self._sesiones[carrito['session_id']]
+
+    def obtener(self, id_carrito):
+        with self._lock:
+            carrito = self._vigente(id_carrito)
+            return copy.deepcopy(carrito) if carrito else None
+
+    def por_sesion(self, session_id):
+        with self._lock:
+            id_carrito = self._sesiones.get(session_id)
+            carrito = self._vigente(id_carrito) if id_carrito is not None else None
+            return copy.deepcopy(carrito) if carrito else None
+
+    def modificar(self, id_carrito, cambio):
+        """Aplicar cambio(carrito) de forma atómica y devolver su resultado"""
+        with self._lock:
+            carrito = self._vigente(id_carrito)
+            if carrito is None:
+                raise CarritoInvitadoNoEncontrado(id_carrito)
+            nuevo = copy.deepcopy(carrito)
+            resultado = cambio(nuevo)
+            nuevo['fecha_ultima_actividad'] = datetime.now()
+            self._carritos[id_carrito] = nuevo
+            return resultado
+
+    def eliminar(self, id_carrito, materializado=False):
+        with self._lock:
+            carrito = self._carritos.pop(id_carrito, None)
+            if carrito is not None:
+                self._olvidar_sesion(carrito)
+                self.materializados += int(materializado)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tipo': self.tipo,
+                'carritos': len(self._carritos),
+                'max_carritos': self.max_carritos,
+                'ttl_segundos': self.ttl,
+                'creados': self.creados,
+                'desalojados': self.desalojados,
+                'vencidos': self.vencidos,
+                'materializados': self.materializados
+            }
+
+
+class AlmacenCarritosRedis:
+    """Carritos como JSON en un servidor con protocolo Redis, compartidos entre procesos.
+
+    Claves: <prefijo>:<id> con el carrito y <prefijo>:sesion:<session_id> con su
+    ID, ambas con vencimiento ttl_segundos que se renueva en cada cambio.
+    `cliente` es cualquier objeto con la API de redis-py (un servidor local o un
+    sustituto en pruebas); modificar usa WATCH/MULTI.
+    """
+
+    tipo = 'redis'
+
+    def __init__(self, cliente, ttl_segundos=7 * 24 * 3600, prefijo='carrito_invitado'):
+        self._redis = cliente
+        self.ttl = ttl_segundos
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self.creados = 0
+        self.materializados = 0
+
+    def _clave(self, id_carrito):
+        return f"{self.prefijo}:{id_carrito}"
+
+    def _clave_sesion(self, session_id):
+        return f"{self.prefijo}:sesion:{session_id}"
+
+    @staticmethod
+    def _a_json(carrito):
+        return json.dumps(carrito, default=lambda valor: valor.isoformat())
+
+    @staticmethod
+    def _desde_json(datos):
+        carrito = json.loads(datos)
+        for campo in _CAMPOS_FECHA:
+            carrito[campo] = datetime.fromisoformat(carrito[campo])
+        for linea in carrito['productos']:
+            linea['fecha_agregado'] = datetime.fromisoformat(linea['fecha_agregado'])
+        return carrito
+
+    def crear(self, session_id, nombre_carrito):
+        id_carrito = ID_INVITADO_BASE + self._redis.incr(f"{self.prefijo}:siguiente_id")
+        carrito = nuevo_carrito(id_carrito, session_id, nombre_carrito)
+        pipe = self._redis.pipeline()
+        pipe.set(self._clave(id_carrito), self._a_json(carrito), ex=self.ttl)
+        pipe.set(self._clave_sesion(session_id), id_carrito, ex=self.ttl)
+        pipe.execute()
+        with self._lock:
+            self.creados += 1
+        return carrito
+
+    def obtener(self, id_carrito):
+        datos = self._redis.get(self._clave(id_carrito))
+        return self._desde_json(datos) if datos else None
+
+    def por_sesion(self, session_id):
+        id_carrito = self._redis.get(self._clave_sesion(session_id))
+        return self.obtener(int(id_carrito)) if id_carrito else None
+
+    def modificar(self, id_carrito, cambio):
+        """Aplicar cambio(carrito) de forma atómica y devolver su resultado"""
+        clave = self._clave(id_carrito)
+
+        def transaccion(pipe):
+            datos = pipe.get(clave)
+            if not datos:
+                raise CarritoInvitadoNoEncontrado(id_carrito)
+            carrito = self._desde_json(datos)
+            resultado = cambio(carrito)
+            carrito['fecha_ultima_actividad'] = datetime.now()
+            pipe.multi()
+            pipe.set(clave, self._a_json(carrito), ex=self.ttl)
+            pipe.expire(self._clave_sesion(carrito['session_id']), self.ttl)
+            return resultado
+
+        return self._redis.transaction(transaccion, clave, value_from_callable=True)
+
+    def eliminar(self, id_carrito, materializado=False):
+        carrito = self.obtener(id_carrito)
+        claves = [self._clave(id_carrito)]
+        if carrito is not None:
+            claves.append(self._clave_sesion(carrito['session_id']))
+        self._redis.delete(*claves)
+        with self._lock:
+            self.materializados += int(materializado and carrito is not None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tipo': self.tipo,
+                'ttl_segundos': self.ttl,
+                'creados': self.creados,
+                'materializados': self.materializados
+            }
+
+
+def crear_almacen(tipo, max_carritos=50000, ttl_segundos=7 * 24 * 3600, redis_url=None):
+    """oracle, memoria o redis (None: los carritos de invitados van directo a CARRITOS como antes)"""
+    if tipo == 'oracle':
+        return None
+    if tipo == 'redis':
+        if redis is None:
+            logger.warning("⚠️ CARRITOS_INVITADO=redis pero el paquete redis no está instalado; se usa Oracle")
+            return None
+        return AlmacenCarritosRedis(redis.Redis.from_url(redis_url), ttl_segundos=ttl_segundos)
+    if tipo == 'memoria':
+        return AlmacenCarritosMemoria(max_carritos=max_carritos, ttl_segundos=ttl_segundos)
+    return None
@@ -0,0 +1,302 @@
+"""
+Capa de acceso a datos compartida: pool de conexiones Oracle,
+ejecución de consultas con medición de tiempos y mapeo de filas a dict.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import oracledb
+from flask import g, has_app_context
+from werkzeug.local import LocalProxy
+
+logger = logging.getLogger(__name__)
+
+
+def rows_to_dicts(cursor, rows):
+    """Convertir filas a diccionarios usando los nombres de columna en minúsculas"""
+    columns = [col[0].lower() for col in cursor.description]
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def row_to_dict(cursor, row):
+    """Convertir una fila a diccionario (o None si no hay fila)"""
+    if row is None:
+        return None
+    columns = [col[0].lower() for col in cursor.description]
+    return dict(zip(columns, row))
+
+
+class RowStream:
+    """Filas de una consulta leídas de a lotes, con su propia conexión del pool.
+
+    Se itera una sola vez; la conexión se devuelve al pool al terminar de
+    iterar o al llamar close() (por ejemplo si el cliente corta la descarga).
+    """
+
+    def __init__(self, database, conn, cursor):
+        self._database = database
+        self._conn = conn
+        self._cursor = cursor
+        self.columns = [col[0].lower() for col in cursor.description]
+
+    def __iter__(self):
+        try:
+            while True:
+                rows = self._cursor.fetchmany()
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            self.close()
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            self._cursor.close()
+        except oracledb.Error:
+            pass
+        self._database._release(conn)
+
+
+class QueryStats:
+    """Contadores de ejecución por sentencia SQL (cantidad, tiempo total y máximo)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, sql, elapsed_ms):
+        key = ' '.join(sql.split())[:200]
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            stat['count'] += 1
+            stat['total_ms'] += elapsed_ms
+            stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    'sql': sql,
+                    'count': stat['count'],
+                    'total_ms': round(stat['total_ms'], 2),
+                    'avg_ms': round(stat['total_ms'] / stat['count'], 2),
+                    'max_ms': round(stat['max_ms'], 2)
+                }
+                for sql, stat in sorted(self._stats.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class Database:
+    """Pool de conexiones Oracle con una conexión por request de Flask"""
+
+    def __init__(self, user, password, dsn, wallet_dir=None, wallet_password=None,
+                 min=2, max=10, increment=1, ping_interval=60, timeout=300,
+                 wait_timeout=5000, stmtcachesize=50):
+        self.pool_params = {
+            'user': user,
+            'password': password,
+            'dsn': dsn,
+            'min': min,
+            'max': max,
+            'increment': increment,
+            'getmode': oracledb.POOL_GETMODE_TIMEDWAIT,
+            'wait_timeout': wait_timeout,
+            'timeout': timeout,
+            # El pool hace ping a las conexiones ociosas más de ping_interval
+            # segundos antes de entregarlas y reemplaza las que estén caídas,
+            # así las consultas no pagan un ping() cada vez
+            'ping_interval': ping_interval,
+            # Cada conexión mantiene parseadas las sentencias más usadas
+            'stmtcachesize': stmtcachesize
+        }
+        if wallet_dir:
+            self.pool_params.update(
+                config_dir=wallet_dir,
+                wallet_location=wallet_dir,
+                wallet_password=wallet_password
+            )
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.stats = QueryStats()
+        # Conexión del request actual, para el código que trabaja con cursores directamente
+        self.connection = LocalProxy(self.get_connection)
+
+    @classmethod
+    def from_env(cls, wallet_dir=r"wallet"):
+        """Crear la base de datos a partir de las variables de entorno de las APIs"""
+        return cls(
+            user=os.getenv("usuario"),
+            password=os.getenv("clave"),
+            dsn=os.getenv("dsn"),
+            wallet_dir=wallet_dir,
+            wallet_password=os.getenv("wallet_password"),
+            min=int(os.getenv("POOL_MIN", "2")),
+            max=int(os.getenv("POOL_MAX", "10")),
+            increment=int(os.getenv("POOL_INCREMENT", "1")),
+            ping_interval=int(os.getenv("POOL_PING_INTERVAL", "60")),
+            timeout=int(os.getenv("POOL_TIMEOUT", "300")),
+            wait_timeout=int(os.getenv("POOL_WAIT_TIMEOUT", "5000")),
+            stmtcachesize=int(os.getenv("POOL_STMT_CACHE", "50"))
+        )
+
+    @property
+    def pool(self):
+        """Pool de conexiones, creado la primera vez que se necesita"""
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = oracledb.create_pool(**self.pool_params)
+                    logger.info("✅ Pool de conexiones Oracle creado (min=%s, max=%s)",
+                                self.pool_params['min'], self.pool_params['max'])
+        return self._pool
+
+    def init_app(self, app):
+        """Registrar la devolución de conexiones al pool al terminar cada request"""
+        app.teardown_appcontext(self.release_connection)
+
+    # ------------------- CONEXIONES -------------------
+    def get_connection(self):
+        """Obtener la conexión del request actual, tomándola del pool la primera vez"""
+        if not has_app_context():
+            raise RuntimeError('get_connection requiere un contexto de Flask; usa acquire() fuera de un request')
+        if 'db_connection' not in g:
+            g.db_connection = self.pool.acquire()
+        return g.db_connection
+
+    def release_connection(self, error=None):
+        """Devolver la conexión del request al pool"""
+        conn = g.pop('db_connection', None)
+        if conn is not None:
+            self._release(conn)
+
+    @contextmanager
+    def acquire(self):
+        """Conexión del pool para código que corre fuera de un request (hilos de fondo, scripts)"""
+        conn = self.pool.acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def _release(self, conn):
+        try:
+            # Lo que no se confirmó se descarta
+            conn.rollback()
+            self.pool.release(conn)
+        except oracledb.Error:
+            # Conexión dañada: se elimina del pool para que no se reutilice
+            self.pool.drop(conn)
+
+    def is_available(self):
+        """Verificar que la base de datos responde (para health checks)"""
+        try:
+            with self.acquire() as conn:
+                conn.ping()
+            return True
+        except Exception as e:
+            logger.error(f"❌ Base de datos no disponible: {e}")
+            return False
+
+    def pool_info(self):
+        """Estado actual del pool"""
+        if self._pool is None:
+            return {'creado': False}
+        return {
+            'creado': True,
+            'abiertas': self._pool.opened,
+            'ocupadas': self._pool.busy,
+            'min': self._pool.min,
+            'max': self._pool.max
+        }
+
+    # ------------------- EJECUCIÓN -------------------
+    def _conn(self, conn):
+        return conn if conn is not None else self.get_connection()
+
+    def _timed(self, sql, fn):
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            self.stats.record(sql, (time.perf_counter() - start) * 1000)
+
+    def execute(self, sql, params=None, commit=False, conn=None, **kwparams):
+        """Ejecutar una sentencia DML y devolver la cantidad de filas afectadas"""
+        conn = self._conn(conn)
+        with conn.cursor() as cursor:
+            self._timed(sql, lambda: cursor.execute(sql, params, **kwparams))
+            rowcount = cursor.rowcount
+        if commit:
+            conn.commit()
+        return rowcount
+
+    def executemany(self, sql, rows, commit=False, conn=None, batcherrors=False, arraydmlrowcounts=False):
+        """Ejecutar una sentencia con un arreglo de binds en un solo viaje a la base de datos.
+
+        Devuelve (errores, filas_por_registro); los errores solo se recogen con
+        batcherrors=True y las filas por registro con arraydmlrowcounts=True.
+        """
+        conn = self._conn(conn)
+        with conn.cursor() as cursor:
+            self._timed(sql, lambda: cursor.executemany(
+                sql, rows, batcherrors=batcherrors, arraydmlrowcounts=arraydmlrowcounts))
+            errors = cursor.getbatcherrors() if batcherrors else []
+            rowcounts = cursor.getarraydmlrowcounts() if arraydmlrowcounts else []
+        if commit:
+            conn.commit()
+        return errors, rowcounts
+
+    def fetch_one(self, sql, params=None, as_dict=False, conn=None, **kwparams):
+        """Ejecutar una consulta y devolver la primera fila"""
+        conn = self._conn(conn)
+        with conn.cursor() as cursor:
+            self._timed(sql, lambda: cursor.execute(sql, params, **kwparams))
+            row = cursor.fetchone()
+            return row_to_dict(cursor, row) if as_dict else row
+
+    def fetch_all(self, sql, params=None, as_dict=False, conn=None, arraysize=None, **kwparams):
+        """Ejecutar una consulta y devolver todas las filas"""
+        conn = self._conn(conn)
+        with conn.cursor() as cursor:
+            if arraysize:
+                cursor.arraysize = arraysize
+                cursor.prefetchrows = arraysize + 1
+            self._timed(sql, lambda: cursor.execute(sql, params, **kwparams))
+            rows = cursor.fetchall()
+            return rows_to_dicts(cursor, rows) if as_dict else rows
+
+    def stream(self, sql, params=None, arraysize=1000, **kwparams):
+        """Ejecutar una consulta y devolver un RowStream para recorrerla sin cargarla entera.
+
+        Usa una conexión aparte de la del request porque la respuesta se sigue
+        enviando después de que termina la vista.
+        """
+        conn = self.pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.arraysize = arraysize
+            cursor.prefetchrows = arraysize + 1
+            self._timed(sql, lambda: cursor.execute(sql, params, **kwparams))
+            return RowStream(self, conn, cursor)
+        except Exception:
+            self._release(conn)
+            raise
+
+    def commit(self):
+        self.get_connection().commit()
+
+    def rollback(self):
+        self.get_connection().rollback()
@@ -0,0 +1,175 @@
+"""
+Purga de carritos de invitados abandonados: borra de verdad los CARRITOS sin
+actividad en `dias` días y sus CARRITO_PRODUCTOS, en lotes acotados con un
+commit por lote y una pausa entre lotes para no competir con el tráfico.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Condición de carrito purgable; los que tienen un DETALLE_PEDIDO se conservan (FK)
+_CONDICION_PURGABLE = """
+    c.SESSION_ID IS NOT NULL
+    AND c.FECHA_ULTIMA_ACTIVIDAD < SYSDATE - :dias
+    AND NOT EXISTS (SELECT 1 FROM DETALLE_PEDIDO d WHERE d.ID_CARRITO = c.ID_CARRITO)
+"""
+
+# Siguiente lote de candidatos por keyset de ID_CARRITO
+SQL_CANDIDATOS = f"""
+    SELECT c.ID_CARRITO FROM CARRITOS c
+    WHERE c.ID_CARRITO > :ultimo AND {_CONDICION_PURGABLE}
+    ORDER BY c.ID_CARRITO
+    FETCH FIRST :lote ROWS ONLY
+"""
+
+# Bloquea los candidatos del rango volviendo a evaluar la condición; los que
+# otra transacción tiene tomados quedan para la próxima pasada
+SQL_BLOQUEAR = f"""
+    SELECT c.ID_CARRITO FROM CARRITOS c
+    WHERE c.ID_CARRITO BETWEEN :desde AND :hasta AND {_CONDICION_PURGABLE}
+    FOR UPDATE SKIP LOCKED
+"""
+
+SQL_BORRAR_LINEAS = "DELETE FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito"
+SQL_BORRAR_CARRITO = "DELETE FROM CARRITOS WHERE ID_CARRITO = :id_carrito"
+
+SQL_PENDIENTES = f"SELECT COUNT(*) FROM CARRITOS c WHERE {_CONDICION_PURGABLE}"
+
+
+class PurgaCarritos:
+    """Hilo que purga los carritos de invitados abandonados cada `intervalo` segundos.
+
+    Antes de cada ciclo se escriben los toques de actividad pendientes en
+    memoria (`actividad`), así un carrito usado hace poco no se ve abandonado.
+    """
+
+    def __init__(self, db, actividad=None, dias=30, lote=500, pausa_ms=200, intervalo=3600):
+        self.db = db
+        self.actividad = actividad
+        self.dias = dias
+        self.lote = lote
+        self.pausa = pausa_ms / 1000
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._ejecutando = threading.Lock()
+        self._hilo = None
+        self.ciclos = 0
+        self.lotes = 0
+        self.carritos_borrados = 0
+        self.lineas_borradas = 0
+        self.omitidos = 0
+        self.en_curso = None
+        self.ultimo_ciclo = None
+
+    def iniciar(self):
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='purga-carritos', daemon=True)
+                self._hilo.start()
+                logger.info(f"🧹 Purga de carritos de invitados cada {self.intervalo}s (inactivos > {self.dias} días)")
+
+    def _ejecutar(self):
+        while True:
+            try:
+                self.ejecutar_ciclo()
+            except Exception as e:
+                logger.error(f"❌ Error en la purga de carritos: {e}")
+            time.sleep(self.intervalo)
+
+    def ejecutar_ciclo(self):
+        """Purgar todos los carritos abandonados una vez; devuelve (carritos, líneas) o None si ya había un ciclo en curso"""
+        if not self._ejecutando.acquire(blocking=False):
+            return None
+        try:
+            if self.actividad is not None:
+                self.actividad.flush()
+            inicio = time.perf_counter()
+            carritos = lineas = 0
+            ultimo = 0
+            with self._lock:
+                self.en_curso = {'lotes': 0, 'carritos': 0, 'lineas': 0, 'ultimo_id': 0,
+                                 'inicio': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            with self.db.acquire() as conn:
+                while True:
+                    candidatos = self.db.fetch_all(SQL_CANDIDATOS, {
+                        'ultimo': ultimo, 'dias': self.dias, 'lote': self.lote
+                    }, conn=conn)
+                    if not candidatos:
+                        break
+                    borrados, borradas = self._purgar_lote(conn, candidatos[0][0], candidatos[-1][0], len(candidatos))
+                    carritos += borrados
+                    lineas += borradas
+                    ultimo = candidatos[-1][0]
+                    with self._lock:
+                        self.en_curso.update(lotes=self.en_curso['lotes'] + 1, carritos=carritos,
+                                             lineas=lineas, ultimo_id=ultimo)
+                    if len(candidatos) < self.lote:
+                        break
+                    time.sleep(self.pausa)
+            duracion = time.perf_counter() - inicio
+            with self._lock:
+                self.ciclos += 1
+                self.ultimo_ciclo = {
+                    'carritos': carritos,
+                    'lineas': lineas,
+                    'duracion_ms': round(duracion * 1000, 2),
+                    'fin': time.strftime('%Y-%m-%dT%H:%M:%S')
+                }
+            if carritos:
+                logger.info(f"🧹 Purga: {carritos} carritos de invitados y {lineas} líneas borrados en {duracion:.1f}s")
+            return carritos, lineas
+        finally:
+            with self._lock:
+                self.en_curso = None
+            self._ejecutando.release()
+
+    def _purgar_lote(self, conn, desde, hasta, candidatos):
+        """Borrar un lote en su propia transacción; devuelve (carritos, líneas)"""
+        try:
+            bloqueados = self.db.fetch_all(SQL_BLOQUEAR, {'desde': desde, 'hasta': hasta, 'dias': self.dias}, conn=conn)
+            if not bloqueados:
+                conn.rollback()
+                self._contar_lote(0, 0, candidatos)
+                return 0, 0
+            filas = [{'id_carrito': id_carrito} for (id_carrito,) in bloqueados]
+            _, por_carrito = self.db.executemany(SQL_BORRAR_LINEAS, filas, conn=conn, arraydmlrowcounts=True)
+            self.db.executemany(SQL_BORRAR_CARRITO, filas, conn=conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        lineas = sum(por_carrito)
+        self._contar_lote(len(filas), lineas, candidatos)
+        return len(filas), lineas
+
+    def _contar_lote(self, carritos, lineas, candidatos):
+        with self._lock:
+            self.lotes += 1
+            self.carritos_borrados += carritos
+            self.lineas_borradas += lineas
+            # Tomados por otra transacción o reactivados entre la búsqueda y el bloqueo
+            self.omitidos += candidatos - carritos
+
+    def pendientes(self):
+        """Carritos que la próxima pasada purgaría"""
+        return self.db.fetch_one(SQL_PENDIENTES, {'dias': self.dias})[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'activa': self._hilo is not None and self._hilo.is_alive(),
+                'intervalo_segundos': self.intervalo,
+                'dias_inactividad': self.dias,
+                'lote': self.lote,
+                'pausa_ms': round(self.pausa * 1000),
+                'ciclos': self.ciclos,
+                'lotes': self.lotes,
+                'carritos_borrados': self.carritos_borrados,
+                'lineas_borradas': self.lineas_borradas,
+                'omitidos': self.omitidos,
+                'en_curso': dict(self.en_curso) if self.en_curso else None,
+                'ultimo_ciclo': self.ultimo_ciclo
+            }
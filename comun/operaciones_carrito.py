@@ -0,0 +1,55 @@
+"""
+Operaciones en lote sobre las líneas de un carrito (PATCH /carritos/<id>/productos):
+validación y reducción a una operación por producto, sin tocar la base.
+"""
+
+
+def combinar_operaciones_carrito(operaciones):
+    """Validar las operaciones y reducirlas a una por producto, respetando el orden.
+
+    Devuelve (upserts, eliminados, errores). agregar suma, fijar reemplaza y
+    eliminar quita la línea; por ejemplo eliminar + agregar 2 equivale a fijar 2.
+    """
+    finales = {}
+    errores = []
+    for numero, op in enumerate(operaciones, start=1):
+        accion = op.get('op') if isinstance(op, dict) else None
+        if accion not in ('agregar', 'fijar', 'eliminar'):
+            errores.append({'operacion': numero, 'error': 'op debe ser agregar, fijar o eliminar'})
+            continue
+        try:
+            id_producto = int(op['id_producto'])
+            cantidad = int(op['cantidad']) if accion != 'eliminar' else 0
+            id_sucursal = int(op['id_sucursal']) if op.get('id_sucursal') is not None else None
+            valor_unitario = float(op['valor_unitario']) if op.get('valor_unitario') is not None else None
+        except (KeyError, TypeError, ValueError):
+            errores.append({'operacion': numero, 'error': 'id_producto y cantidad deben ser numéricos'})
+            continue
+        if accion != 'eliminar' and cantidad <= 0:
+            errores.append({'operacion': numero, 'error': 'La cantidad debe ser mayor a 0'})
+            continue
+        if accion == 'agregar' and (id_sucursal is None or valor_unitario is None):
+            errores.append({'operacion': numero, 'error': 'agregar requiere id_sucursal y valor_unitario'})
+            continue
+
+        anterior = finales.get(id_producto)
+        if accion == 'eliminar':
+            finales[id_producto] = None
+            continue
+        nueva = {'id_producto': id_producto, 'id_sucursal': id_sucursal, 'cantidad': cantidad,
+                 'valor_unitario': valor_unitario, 'sumar': 1 if accion == 'agregar' else 0, 'operacion': numero}
+        if anterior is not None:
+            for campo in ('id_sucursal', 'valor_unitario'):
+                if nueva[campo] is None:
+                    nueva[campo] = anterior[campo]
+        if anterior is not None and accion == 'agregar':
+            # Dos cambios sobre la misma línea: se suman sobre el resultado anterior
+            nueva['cantidad'] += anterior['cantidad']
+            nueva['sumar'] = anterior['sumar']
+        elif anterior is None and id_producto in finales:
+            # La línea se eliminó antes en el mismo lote: ahora se crea de nuevo
+            nueva['sumar'] = 0
+        finales[id_producto] = nueva
+    upserts = [op for op in finales.values() if op is not None]
+    eliminados = [id_producto for id_producto, op in finales.items() if op is None]
+    return upserts, eliminados, errores
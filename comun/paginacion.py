@@ -0,0 +1,40 @@
+"""
+Utilidades para paginación por keyset: límite de página y cursores opacos
+que codifican la última clave ordenada devuelta.
+"""
+
+import base64
+import json
+
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 500
+
+
+def parse_limit(value, default=LIMITE_POR_DEFECTO, maximum=LIMITE_MAXIMO):
+    """Interpretar el parámetro limit; lanza ValueError si no es un entero positivo"""
+    if value in (None, ''):
+        return default
+    limite = int(value)
+    if limite <= 0:
+        raise ValueError('limit debe ser mayor a 0')
+    return min(limite, maximum)
+
+
+def encode_cursor(*values):
+    """Codificar la clave de la última fila como un cursor opaco para el parámetro after"""
+    raw = json.dumps(list(values), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Decodificar un cursor generado por encode_cursor (None si no viene)"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor inválido')
+    return values
@@ -0,0 +1,228 @@
+"""
+Reservas de stock con vencimiento: el checkout reserva las cantidades del
+carrito y el pago las confirma (rebajando STOCK) o las libera.
+
+Disponible = INVENTARIO.STOCK - reservas ACTIVA que no han vencido. Las
+reservas son filas nuevas en RESERVAS_STOCK, así el checkout no toca INVENTARIO.
+Quien reserva o rebaja stock primero toma la fila de RESERVAS_CONTROL del
+(producto, sucursal): un UPDATE de su contador que queda bloqueado hasta el
+COMMIT, una clave a la vez y siempre en el mismo orden. Eso serializa solo a quienes compiten por el mismo disponible; las
+filas de INVENTARIO no se bloquean para leer ni para ingresar stock.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Reservado vigente para un (producto, sucursal); lo resuelve IDX_RESERVAS_ACTIVAS
+SQL_RESERVADO = """
+    NVL((SELECT SUM(r.CANTIDAD) FROM RESERVAS_STOCK r
+         WHERE r.ID_PRODUCTO = {alias}.ID_PRODUCTO AND r.ID_SUCURSAL = {alias}.ID_SUCURSAL
+           AND r.ESTADO = 'ACTIVA' AND r.FECHA_EXPIRACION > SYSDATE), 0)
+"""
+
+# Lo mismo sin contar las reservas de un pedido: al pagarlo, puede tomar su propia
+# reserva (aunque ya se haya liberado o vencido) pero no la de otros pedidos
+SQL_RESERVADO_OTROS = """
+    NVL((SELECT SUM(r.CANTIDAD) FROM RESERVAS_STOCK r
+         WHERE r.ID_PRODUCTO = {alias}.ID_PRODUCTO AND r.ID_SUCURSAL = {alias}.ID_SUCURSAL
+           AND r.ID_PEDIDO <> :id_pedido
+           AND r.ESTADO = 'ACTIVA' AND r.FECHA_EXPIRACION > SYSDATE), 0)
+"""
+
+# Stock, reservado y disponible de un producto en una sucursal
+SQL_STOCK_DISPONIBLE = f"""
+    SELECT i.STOCK, {SQL_RESERVADO.format(alias='i')} AS RESERVADO,
+           i.STOCK - {SQL_RESERVADO.format(alias='i')} AS DISPONIBLE
+    FROM INVENTARIO i
+    WHERE i.ID_PRODUCTO = :id_producto AND i.ID_SUCURSAL = :id_sucursal
+"""
+
+# Toma (o crea) la fila de control de un (producto, sucursal). Se ejecuta una clave a
+# la vez en orden (ID_SUCURSAL, ID_PRODUCTO): un solo UPDATE sobre varias filas no
+# garantiza el orden en que las bloquea y dos checkouts con productos en común
+# podrían bloquearse en cruz (ORA-00060). Si otra transacción está creando la misma
+# fila, el INSERT espera a que confirme y se toma la fila existente
+SQL_TOMAR_CONTROL = """
+    BEGIN
+        UPDATE RESERVAS_CONTROL SET VERSION = VERSION + 1
+        WHERE ID_PRODUCTO = :id_producto AND ID_SUCURSAL = :id_sucursal;
+        IF SQL%ROWCOUNT = 0 THEN
+            INSERT INTO RESERVAS_CONTROL (ID_PRODUCTO, ID_SUCURSAL, VERSION)
+            VALUES (:id_producto, :id_sucursal, 1);
+        END IF;
+    EXCEPTION
+        WHEN DUP_VAL_ON_INDEX THEN
+            UPDATE RESERVAS_CONTROL SET VERSION = VERSION + 1
+            WHERE ID_PRODUCTO = :id_producto AND ID_SUCURSAL = :id_sucursal;
+    END;
+"""
+
+SQL_CLAVES_CARRITO = """
+    SELECT DISTINCT ID_PRODUCTO, ID_SUCURSAL FROM CARRITO_PRODUCTOS WHERE ID_CARRITO = :id_carrito
+"""
+
+SQL_FALTANTES_CARRITO = f"""
+    SELECT cp.ID_PRODUCTO, cp.ID_SUCURSAL, cp.CANTIDAD,
+           NVL(i.STOCK, 0) - {SQL_RESERVADO.format(alias='cp')} AS DISPONIBLE
+    FROM CARRITO_PRODUCTOS cp
+    LEFT JOIN INVENTARIO i ON i.ID_PRODUCTO = cp.ID_PRODUCTO AND i.ID_SUCURSAL = cp.ID_SUCURSAL
+    WHERE cp.ID_CARRITO = :id_carrito
+      AND NVL(i.STOCK, 0) - {SQL_RESERVADO.format(alias='cp')} < cp.CANTIDAD
+"""
+
+SQL_INSERTAR_RESERVAS = """
+    INSERT INTO RESERVAS_STOCK (ID_PEDIDO, ID_PRODUCTO, ID_SUCURSAL, CANTIDAD, ESTADO, FECHA_EXPIRACION)
+    SELECT :id_pedido, cp.ID_PRODUCTO, cp.ID_SUCURSAL, cp.CANTIDAD, 'ACTIVA', SYSDATE + :ttl_minutos / 1440
+    FROM CARRITO_PRODUCTOS cp
+    WHERE cp.ID_CARRITO = :id_carrito
+"""
+
+SQL_REBAJAR_STOCK_PEDIDO = f"""
+    UPDATE INVENTARIO i SET i.STOCK = i.STOCK - :cantidad
+    WHERE i.ID_PRODUCTO = :id_producto AND i.ID_SUCURSAL = :id_sucursal
+      AND i.STOCK - {SQL_RESERVADO_OTROS.format(alias='i')} >= :cantidad
+"""
+
+SQL_CERRAR_RESERVAS = """
+    UPDATE RESERVAS_STOCK SET ESTADO = :estado, FECHA_CIERRE = SYSDATE
+    WHERE ID_PEDIDO = :id_pedido AND ESTADO = 'ACTIVA'
+"""
+
+SQL_EXPIRAR_VENCIDAS = """
+    UPDATE RESERVAS_STOCK SET ESTADO = 'EXPIRADA', FECHA_CIERRE = SYSDATE
+    WHERE ESTADO = 'ACTIVA' AND FECHA_EXPIRACION <= SYSDATE AND ROWNUM <= :lote
+"""
+
+SQL_PURGAR_CERRADAS = """
+    DELETE FROM RESERVAS_STOCK
+    WHERE ESTADO <> 'ACTIVA' AND FECHA_CIERRE < SYSDATE - :dias AND ROWNUM <= :lote
+"""
+
+
+class ReservasStock:
+    """Operaciones sobre RESERVAS_STOCK y un barrido periódico de las vencidas.
+
+    reservar/confirmar/liberar trabajan sobre la conexión del llamador y no
+    confirman: la reserva se guarda (o se deshace) junto con el pedido o el pago.
+    """
+
+    def __init__(self, db, ttl_minutos=20, intervalo=60, lote=500, dias_historial=7):
+        self.db = db
+        self.ttl_minutos = ttl_minutos
+        self.intervalo = intervalo
+        self.lote = lote
+        self.dias_historial = dias_historial
+        self._lock = threading.Lock()
+        self._hilo = None
+        self.barridos = 0
+        self.expiradas = 0
+        self.purgadas = 0
+        self.ultimo_barrido_ms = 0
+
+    def reservar(self, conn, id_pedido, id_carrito):
+        """Reservar las cantidades del carrito para el pedido.
+
+        Devuelve la lista de líneas sin disponible suficiente; si no está vacía
+        no se reservó nada y el llamador debe deshacer la transacción.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute(SQL_CLAVES_CARRITO, id_carrito=id_carrito)
+            self.bloquear(conn, [{'id_producto': p, 'id_sucursal': s} for p, s in cursor.fetchall()])
+            cursor.execute(SQL_FALTANTES_CARRITO, id_carrito=id_carrito)
+            faltantes = [
+                {'id_producto': p, 'id_sucursal': s, 'cantidad': c, 'disponible': max(d, 0)}
+                for p, s, c, d in cursor.fetchall()
+            ]
+            if not faltantes:
+                cursor.execute(SQL_INSERTAR_RESERVAS, id_pedido=id_pedido, id_carrito=id_carrito,
+                               ttl_minutos=self.ttl_minutos)
+        return faltantes
+
+    def bloquear(self, conn, lineas):
+        """Tomar las filas de control de los (producto, sucursal) indicados antes de bajar su stock.
+
+        `lineas` es una lista de dicts con id_producto e id_sucursal; quedan
+        bloqueadas hasta que el llamador confirme o deshaga. Todos los caminos
+        (checkout, pago, rebaja y carga de stock) las toman en el mismo orden.
+        """
+        claves = sorted({(l['id_sucursal'], l['id_producto']) for l in lineas})
+        filas = [{'id_producto': p, 'id_sucursal': s} for s, p in claves]
+        if filas:
+            # executemany ejecuta el bloque fila por fila, en el orden del arreglo
+            self.db.executemany(SQL_TOMAR_CONTROL, filas, conn=conn)
+
+    def rebajar(self, conn, id_pedido, lineas):
+        """Rebajar el STOCK de las líneas de un pedido pagado; devuelve las que no alcanzaron.
+
+        `lineas` son dicts con id_producto, id_sucursal y cantidad. Con las filas
+        de control tomadas, el pedido solo consume stock que no está reservado
+        para otros pedidos, también si su propia reserva ya no está activa.
+        """
+        if not lineas:
+            return []
+        self.bloquear(conn, lineas)
+        filas = [{**linea, 'id_pedido': id_pedido} for linea in lineas]
+        _, actualizadas = self.db.executemany(SQL_REBAJAR_STOCK_PEDIDO, filas, conn=conn, arraydmlrowcounts=True)
+        return [linea for linea, n in zip(lineas, actualizadas) if n == 0]
+
+    def confirmar(self, conn, id_pedido):
+        """El pago se autorizó: la reserva pasa a CONFIRMADA (el STOCK se rebaja aparte)"""
+        return self.db.execute(SQL_CERRAR_RESERVAS, {'estado': 'CONFIRMADA', 'id_pedido': id_pedido}, conn=conn)
+
+    def liberar(self, conn, id_pedido):
+        """El pago falló o expiró: la cantidad vuelve a estar disponible"""
+        return self.db.execute(SQL_CERRAR_RESERVAS, {'estado': 'LIBERADA', 'id_pedido': id_pedido}, conn=conn)
+
+    # ------------------- BARRIDO -------------------
+    def iniciar(self):
+        """Arrancar el hilo que marca las reservas vencidas y purga el historial"""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='barrido-reservas', daemon=True)
+                self._hilo.start()
+
+    def _ejecutar(self):
+        while True:
+            try:
+                self.barrer()
+            except Exception as e:
+                logger.error(f"❌ Error en el barrido de reservas: {e}")
+            time.sleep(self.intervalo)
+
+    def barrer(self):
+        """Expirar reservas vencidas y borrar las cerradas antiguas, de a `lote` filas por commit"""
+        inicio = time.perf_counter()
+        expiradas = purgadas = 0
+        with self.db.acquire() as conn:
+            for sql, params in ((SQL_EXPIRAR_VENCIDAS, {'lote': self.lote}),
+                                (SQL_PURGAR_CERRADAS, {'lote': self.lote, 'dias': self.dias_historial})):
+                while True:
+                    filas = self.db.execute(sql, params, conn=conn, commit=True)
+                    if sql is SQL_EXPIRAR_VENCIDAS:
+                        expiradas += filas
+                    else:
+                        purgadas += filas
+                    if filas < self.lote:
+                        break
+        with self._lock:
+            self.barridos += 1
+            self.expiradas += expiradas
+            self.purgadas += purgadas
+            self.ultimo_barrido_ms = round((time.perf_counter() - inicio) * 1000, 2)
+        if expiradas:
+            logger.info(f"⌛ {expiradas} reservas de stock vencidas liberadas")
+        return expiradas, purgadas
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ttl_minutos': self.ttl_minutos,
+                'barrido_activo': self._hilo is not None and self._hilo.is_alive(),
+                'barridos': self.barridos,
+                'expiradas': self.expiradas,
+                'purgadas': self.purgadas,
+                'ultimo_barrido_ms': self.ultimo_barrido_ms
+            }
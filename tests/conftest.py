@@ -0,0 +1,13 @@
+"""
+Las pruebas importan los módulos compartidos (comun/) y los de cada API como
+lo hacen los servicios: desde la raíz del repositorio y desde la carpeta de la API.
+"""
+
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for ruta in (RAIZ, os.path.join(RAIZ, 'API Transbank')):
+    if ruta not in sys.path:
+        sys.path.insert(0, ruta)
@@ -0,0 +1,81 @@
+import pytest
+
+from comun.busqueda import IndiceProductos, normalizar, normalizar_codigo, tokenizar
+
+PRODUCTOS = [
+    {'id_producto': 1, 'nombre': 'Pastillas de freno delanteras', 'marca': 'Bosch',
+     'descripcion': 'Juego de 4 pastillas', 'codigo_interno': 'BR-1234.5', 'codigo_fabricante': '0986AB'},
+    {'id_producto': 2, 'nombre': 'Disco de freno', 'marca': 'Brembo',
+     'descripcion': 'Disco ventilado', 'codigo_interno': 'BR-9876', 'codigo_fabricante': None},
+    {'id_producto': 3, 'nombre': 'Filtro de aceite', 'marca': 'Bosch',
+     'descripcion': 'Para motores bencineros', 'codigo_interno': 'FI-0001', 'codigo_fabricante': 'P7001'},
+    {'id_producto': 4, 'nombre': 'Batería', 'marca': 'Varta',
+     'descripcion': 'Batería 12V', 'codigo_interno': 'BA-555', 'codigo_fabricante': None},
+]
+
+
+@pytest.fixture
+def indice():
+    indice = IndiceProductos()
+    indice.cargar(PRODUCTOS)
+    return indice
+
+
+def ids(resultado):
+    return [producto['id_producto'] for _, _, producto in resultado[1]]
+
+
+def test_normalizacion():
+    assert normalizar('Batería ÁCIDO') == 'bateria acido'
+    assert tokenizar('Disco-de freno, 12V') == ['disco', 'de', 'freno', '12v']
+    assert normalizar_codigo('BR-123.4') == normalizar_codigo('br1234') == 'br1234'
+
+
+def test_nombre_pesa_mas_que_descripcion(indice):
+    # "pastillas" está en el nombre del 1; nadie más la tiene
+    assert ids(indice.buscar('pastillas')) == [1]
+    # Mismo puntaje (marca): desempata el nombre
+    assert ids(indice.buscar('bosch')) == [3, 1]
+    assert ids(indice.buscar('freno')) == [2, 1]
+
+
+def test_todos_los_terminos(indice):
+    assert ids(indice.buscar('freno bosch')) == [1]
+    assert indice.buscar('freno varta') == (0, [])
+
+
+def test_tildes_y_prefijos(indice):
+    assert ids(indice.buscar('bateria')) == [4]
+    assert ids(indice.buscar('fil')) == [3]
+
+
+def test_plural(indice):
+    assert ids(indice.buscar('discos')) == [2]
+
+
+def test_codigos(indice):
+    assert ids(indice.buscar('BR-1234.5')) == [1]
+    assert ids(indice.buscar('br12')) == [1]
+    # Fragmento del medio del código, por n-gramas
+    assert ids(indice.buscar('9876')) == [2]
+    assert ids(indice.buscar('p7001')) == [3]
+
+
+def test_paginacion_con_despues(indice):
+    total, pagina = indice.buscar('freno', limite=1)
+    assert total == 2 and len(pagina) == 1
+    clave = pagina[0][0]
+    _, siguiente = indice.buscar('freno', limite=1, despues=clave)
+    assert [p['id_producto'] for _, _, p in siguiente] == [1]
+    assert indice.buscar('freno', limite=1, despues=siguiente[0][0])[1] == []
+
+
+def test_actualizar_y_eliminar(indice):
+    indice.actualizar({**PRODUCTOS[3], 'nombre': 'Acumulador'})
+    assert indice.buscar('acumulador')[0] == 1
+    assert ids(indice.buscar('varta')) == [4]
+    indice.eliminar(4)
+    assert indice.buscar('varta') == (0, [])
+    assert len(indice) == 3
+    # No quedan términos huérfanos del producto eliminado
+    assert 'acumulador' not in indice._terminos
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from comun.cache import TTLCache
+
+
+def test_get_or_load_carga_una_vez():
+    cache = TTLCache()
+    llamadas = []
+    cargar = lambda: llamadas.append(1) or ['frenos']
+    assert cache.get_or_load(('categorias',), cargar) == ['frenos']
+    assert cache.get_or_load(('categorias',), cargar) == ['frenos']
+    assert len(llamadas) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_version_cambia_al_recargar():
+    cache = TTLCache()
+    _, version, _ = cache.get_or_load_entry(('categorias',), lambda: 1)
+    assert cache.get_or_load_entry(('categorias',), lambda: 2)[1] == version
+    cache.invalidate('categorias')
+    valor, nueva, _ = cache.get_or_load_entry(('categorias',), lambda: 2)
+    assert valor == 2 and nueva != version
+
+
+def test_expira_por_ttl(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: ahora[0])
+    cache = TTLCache(ttl=10)
+    cache.set(('marcas',), 'a')
+    assert cache.get(('marcas',)) == (True, 'a')
+    ahora[0] += 11
+    assert cache.get(('marcas',)) == (False, None)
+
+
+def test_descarta_el_menos_usado():
+    cache = TTLCache(maxsize=2)
+    cache.set(('a',), 1)
+    cache.set(('b',), 2)
+    cache.get(('a',))
+    cache.set(('c',), 3)
+    assert cache.get(('b',)) == (False, None)
+    assert cache.get(('a',)) == (True, 1)
+    assert cache.stats()['descartes_lru'] == 1
+
+
+def test_invalidate_solo_su_espacio_de_nombres():
+    cache = TTLCache()
+    cache.set(('subcategorias', 1), 'x')
+    cache.set(('subcategorias', 2), 'y')
+    cache.set(('categorias',), 'z')
+    cache.invalidate('subcategorias')
+    assert cache.get(('subcategorias', 1)) == (False, None)
+    assert cache.get(('subcategorias', 2)) == (False, None)
+    assert cache.get(('categorias',)) == (True, 'z')
+
+
+def test_carga_en_curso_no_se_guarda_tras_invalidar():
+    cache = TTLCache()
+
+    def cargar():
+        # Una escritura invalida mientras se lee de la base
+        cache.invalidate('productos')
+        return 'viejo'
+
+    assert cache.get_or_load(('productos',), cargar) == 'viejo'
+    assert cache.get(('productos',)) == (False, None)
+
+
+def test_discard_una_entrada():
+    cache = TTLCache()
+    cache.set(('carrito', 1), 'a')
+    cache.set(('carrito', 2), 'b')
+    cache.discard(('carrito', 1))
+    assert cache.get(('carrito', 1)) == (False, None)
+    assert cache.get(('carrito', 2)) == (True, 'b')
+
+
+def test_error_del_loader_no_se_guarda():
+    cache = TTLCache()
+
+    def fallar():
+        raise LookupError('no existe')
+
+    with pytest.raises(LookupError):
+        cache.get_or_load(('carrito', 9), fallar)
+    assert cache.get(('carrito', 9)) == (False, None)
@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from comun.carritos_invitado import (ID_INVITADO_BASE, AlmacenCarritosMemoria, AlmacenCarritosRedis,
+                                     CarritoInvitadoNoEncontrado, aplicar_linea, buscar_linea,
+                                     es_carrito_invitado, nuevo_carrito, quitar_linea, resumen_carrito)
+
+
+@pytest.fixture
+def carrito():
+    return nuevo_carrito(ID_INVITADO_BASE + 1, 'sesion-1', 'Mi carrito')
+
+
+def test_es_carrito_invitado():
+    assert es_carrito_invitado(ID_INVITADO_BASE)
+    assert es_carrito_invitado(str(ID_INVITADO_BASE + 5))
+    assert not es_carrito_invitado(123)
+    assert not es_carrito_invitado(None)
+
+
+def test_aplicar_linea_suma_o_reemplaza(carrito):
+    assert aplicar_linea(carrito, 10, 1, 2, 1500, sumar=1)
+    assert aplicar_linea(carrito, 10, None, 3, None, sumar=1)
+    linea = buscar_linea(carrito, 10)
+    assert linea['cantidad'] == 5 and linea['valor_total'] == 7500
+    assert aplicar_linea(carrito, 10, None, 1, 2000, sumar=0)
+    assert linea['cantidad'] == 1 and linea['valor_total'] == 2000
+    assert len(carrito['productos']) == 1
+
+
+def test_aplicar_linea_cambia_la_sucursal(carrito):
+    aplicar_linea(carrito, 10, 1, 2, 1000, sumar=1)
+    aplicar_linea(carrito, 10, 3, 1, None, sumar=1)
+    linea = buscar_linea(carrito, 10)
+    assert linea['id_sucursal'] == 3 and linea['cantidad'] == 3
+    # Sin sucursal (fijar) se conserva la que tenía
+    aplicar_linea(carrito, 10, None, 1, None, sumar=0)
+    assert linea['id_sucursal'] == 3
+
+
+def test_aplicar_linea_nueva_requiere_sucursal_y_valor(carrito):
+    assert not aplicar_linea(carrito, 10, None, 1, 1500, sumar=1)
+    assert not aplicar_linea(carrito, 10, 1, 1, None, sumar=0)
+    assert carrito['productos'] == []
+
+
+def test_quitar_linea_y_resumen(carrito):
+    assert resumen_carrito(carrito)['total_carrito'] is None
+    aplicar_linea(carrito, 10, 1, 2, 1000, sumar=1)
+    aplicar_linea(carrito, 11, 1, 1, 500, sumar=1)
+    resumen = resumen_carrito(carrito)
+    assert resumen['num_productos'] == 2 and resumen['total_carrito'] == 2500
+    quitar_linea(carrito, 10)
+    assert buscar_linea(carrito, 10) is None
+    assert resumen_carrito(carrito)['total_carrito'] == 500
+
+
+def test_memoria_crear_obtener_y_sesion():
+    almacen = AlmacenCarritosMemoria()
+    creado = almacen.crear('sesion-1', 'Carrito')
+    assert es_carrito_invitado(creado['id_carrito'])
+    assert almacen.obtener(creado['id_carrito'])['session_id'] == 'sesion-1'
+    assert almacen.por_sesion('sesion-1')['id_carrito'] == creado['id_carrito']
+    assert almacen.obtener(creado['id_carrito'] + 1) is None
+
+
+def test_memoria_entrega_copias():
+    almacen = AlmacenCarritosMemoria()
+    creado = almacen.crear('sesion-1', 'Carrito')
+    copia = almacen.obtener(creado['id_carrito'])
+    copia['productos'].append({'id_producto': 1})
+    assert almacen.obtener(creado['id_carrito'])['productos'] == []
+
+
+def test_memoria_modificar():
+    almacen = AlmacenCarritosMemoria()
+    id_carrito = almacen.crear('sesion-1', 'Carrito')['id_carrito']
+    assert almacen.modificar(id_carrito, lambda c: aplicar_linea(c, 10, 1, 2, 1000, sumar=1))
+    assert buscar_linea(almacen.obtener(id_carrito), 10)['cantidad'] == 2
+
+    def fallar(c):
+        c['productos'].clear()
+        raise ValueError('sin stock')
+
+    # Un cambio que falla no deja nada a medias
+    with pytest.raises(ValueError):
+        almacen.modificar(id_carrito, fallar)
+    assert len(almacen.obtener(id_carrito)['productos']) == 1
+    with pytest.raises(CarritoInvitadoNoEncontrado):
+        almacen.modificar(id_carrito + 1, lambda c: None)
+
+
+def test_memoria_desaloja_el_menos_usado():
+    almacen = AlmacenCarritosMemoria(max_carritos=2)
+    primero = almacen.crear('s1', 'a')['id_carrito']
+    segundo = almacen.crear('s2', 'b')['id_carrito']
+    almacen.obtener(primero)
+    almacen.crear('s3', 'c')
+    assert almacen.obtener(segundo) is None
+    assert almacen.por_sesion('s2') is None
+    assert almacen.obtener(primero) is not None
+    assert almacen.stats()['desalojados'] == 1
+
+
+def test_memoria_vence_por_inactividad():
+    almacen = AlmacenCarritosMemoria(ttl_segundos=60)
+    id_carrito = almacen.crear('s1', 'a')['id_carrito']
+    almacen._carritos[id_carrito]['fecha_ultima_actividad'] -= timedelta(seconds=61)
+    assert almacen.obtener(id_carrito) is None
+    assert almacen.por_sesion('s1') is None
+    assert almacen.stats()['vencidos'] == 1
+
+
+def test_memoria_eliminar_materializado():
+    almacen = AlmacenCarritosMemoria()
+    id_carrito = almacen.crear('s1', 'a')['id_carrito']
+    almacen.eliminar(id_carrito, materializado=True)
+    almacen.eliminar(id_carrito, materializado=True)
+    assert almacen.obtener(id_carrito) is None
+    assert almacen.stats()['materializados'] == 1
+
+
+def test_redis_json_conserva_fechas(carrito):
+    aplicar_linea(carrito, 10, 1, 2, 1000, sumar=1)
+    copia = AlmacenCarritosRedis._desde_json(AlmacenCarritosRedis._a_json(carrito))
+    assert copia == carrito
+    assert isinstance(copia['productos'][0]['fecha_agregado'], datetime)
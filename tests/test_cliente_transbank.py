@@ -0,0 +1,34 @@
+import pytest
+
+requests = pytest.importorskip('requests')
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError  # noqa: E402
+
+from cliente_transbank import _no_enviada  # noqa: E402
+
+URL = '/rswebpaytransaction/api/webpay/v1.2/transactions'
+
+
+def error_conexion(motivo):
+    # requests envuelve el MaxRetryError de urllib3, que trae la causa en .reason
+    return requests.exceptions.ConnectionError(MaxRetryError(None, URL, reason=motivo))
+
+
+def test_timeout_de_conexion_no_se_envio():
+    assert _no_enviada(requests.exceptions.ConnectTimeout())
+
+
+def test_conexion_rechazada_no_se_envio():
+    assert _no_enviada(error_conexion(NewConnectionError(None, 'Connection refused')))
+
+
+def test_timeout_de_lectura_pudo_enviarse():
+    assert not _no_enviada(requests.exceptions.ReadTimeout())
+
+
+def test_conexion_cortada_pudo_enviarse():
+    assert not _no_enviada(error_conexion(ProtocolError('Connection aborted.')))
+    assert not _no_enviada(requests.exceptions.ConnectionError('Connection reset by peer'))
+
+
+def test_error_sin_argumentos():
+    assert not _no_enviada(requests.exceptions.ConnectionError())
@@ -0,0 +1,76 @@
+from comun.operaciones_carrito import combinar_operaciones_carrito
+
+
+def agregar(id_producto, cantidad, id_sucursal=1, valor_unitario=1000):
+    return {'op': 'agregar', 'id_producto': id_producto, 'cantidad': cantidad,
+            'id_sucursal': id_sucursal, 'valor_unitario': valor_unitario}
+
+
+def test_una_operacion_por_producto():
+    upserts, eliminados, errores = combinar_operaciones_carrito([
+        agregar(1, 2),
+        {'op': 'fijar', 'id_producto': 2, 'cantidad': 5},
+        {'op': 'eliminar', 'id_producto': 3},
+    ])
+    assert errores == []
+    assert eliminados == [3]
+    assert [(u['id_producto'], u['cantidad'], u['sumar']) for u in upserts] == [(1, 2, 1), (2, 5, 0)]
+
+
+def test_agregar_dos_veces_suma():
+    upserts, _, _ = combinar_operaciones_carrito([agregar(1, 2), agregar(1, 3)])
+    assert len(upserts) == 1
+    assert upserts[0]['cantidad'] == 5 and upserts[0]['sumar'] == 1
+    assert upserts[0]['operacion'] == 2
+
+
+def test_fijar_y_luego_agregar_suma_sobre_lo_fijado():
+    upserts, _, _ = combinar_operaciones_carrito([
+        {'op': 'fijar', 'id_producto': 1, 'cantidad': 4},
+        agregar(1, 1, valor_unitario=900),
+    ])
+    assert upserts[0]['cantidad'] == 5 and upserts[0]['sumar'] == 0
+    assert upserts[0]['valor_unitario'] == 900
+
+
+def test_agregar_y_luego_fijar_reemplaza_y_conserva_sucursal():
+    upserts, _, _ = combinar_operaciones_carrito([
+        agregar(1, 2, id_sucursal=7, valor_unitario=500),
+        {'op': 'fijar', 'id_producto': 1, 'cantidad': 1},
+    ])
+    assert upserts[0]['cantidad'] == 1 and upserts[0]['sumar'] == 0
+    assert upserts[0]['id_sucursal'] == 7 and upserts[0]['valor_unitario'] == 500
+
+
+def test_eliminar_y_agregar_equivale_a_fijar():
+    upserts, eliminados, _ = combinar_operaciones_carrito([
+        {'op': 'eliminar', 'id_producto': 1},
+        agregar(1, 2),
+    ])
+    assert eliminados == []
+    assert upserts[0]['cantidad'] == 2 and upserts[0]['sumar'] == 0
+
+
+def test_agregar_y_eliminar_quita_la_linea():
+    upserts, eliminados, _ = combinar_operaciones_carrito([agregar(1, 2), {'op': 'eliminar', 'id_producto': 1}])
+    assert upserts == [] and eliminados == [1]
+
+
+def test_valores_como_texto():
+    upserts, _, errores = combinar_operaciones_carrito([agregar('10', '3', '2', '1500.5')])
+    assert errores == []
+    assert upserts[0] == {'id_producto': 10, 'id_sucursal': 2, 'cantidad': 3,
+                          'valor_unitario': 1500.5, 'sumar': 1, 'operacion': 1}
+
+
+def test_errores_por_operacion():
+    _, _, errores = combinar_operaciones_carrito([
+        {'op': 'mover', 'id_producto': 1},
+        'no es un dict',
+        {'op': 'fijar', 'id_producto': 'x', 'cantidad': 1},
+        {'op': 'fijar', 'id_producto': 1, 'cantidad': 0},
+        {'op': 'agregar', 'id_producto': 1, 'cantidad': 1},
+        agregar(2, 1),
+    ])
+    assert [e['operacion'] for e in errores] == [1, 2, 3, 4, 5]
+    assert errores[4]['error'] == 'agregar requiere id_sucursal y valor_unitario'
@@ -0,0 +1,54 @@
+import base64
+from datetime import date
+
+import pytest
+
+from comun.paginacion import LIMITE_MAXIMO, LIMITE_POR_DEFECTO, decode_cursor, encode_cursor, parse_limit
+
+
+def test_parse_limit_por_defecto():
+    assert parse_limit(None) == LIMITE_POR_DEFECTO
+    assert parse_limit('') == LIMITE_POR_DEFECTO
+    assert parse_limit(None, default=10) == 10
+
+
+def test_parse_limit_acota_al_maximo():
+    assert parse_limit('20') == 20
+    assert parse_limit(str(LIMITE_MAXIMO + 1)) == LIMITE_MAXIMO
+    assert parse_limit('30', maximum=25) == 25
+
+
+@pytest.mark.parametrize('valor', ['0', '-5', 'abc', '1.5'])
+def test_parse_limit_invalido(valor):
+    with pytest.raises(ValueError):
+        parse_limit(valor)
+
+
+def test_cursor_ida_y_vuelta():
+    cursor = encode_cursor('Pastillas de freno', 42)
+    assert '=' not in cursor
+    assert decode_cursor(cursor, 2) == ['Pastillas de freno', 42]
+
+
+def test_cursor_con_tildes_y_valores_no_json():
+    cursor = encode_cursor('Balatas ñandú', None)
+    assert decode_cursor(cursor, 2) == ['Balatas ñandú', None]
+    # Lo que JSON no sabe serializar (fechas, Decimal) viaja como texto
+    assert decode_cursor(encode_cursor(date(2024, 5, 1)), 1) == ['2024-05-01']
+
+
+def test_cursor_vacio():
+    assert decode_cursor(None, 2) is None
+    assert decode_cursor('', 2) is None
+
+
+@pytest.mark.parametrize('cursor', ['no-es-base64!', encode_cursor('solo uno'), encode_cursor(1, 2, 3)])
+def test_cursor_invalido(cursor):
+    with pytest.raises(ValueError, match='Cursor inválido'):
+        decode_cursor(cursor, 2)
+
+
+def test_cursor_que_no_es_lista():
+    cursor = base64.urlsafe_b64encode(b'{"a":1}').decode('ascii')
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, 1)
@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+
+import pytest
+
+from comun.reservas import (SQL_CERRAR_RESERVAS, SQL_CLAVES_CARRITO, SQL_EXPIRAR_VENCIDAS, SQL_FALTANTES_CARRITO,
+                            SQL_INSERTAR_RESERVAS, SQL_PURGAR_CERRADAS, SQL_REBAJAR_STOCK_PEDIDO, SQL_TOMAR_CONTROL,
+                            ReservasStock)
+
+
+class CursorFalso:
+    def __init__(self, conexion):
+        self.conexion = conexion
+        self._filas = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, **params):
+        self.conexion.sentencias.append((sql, params))
+        self._filas = self.conexion.resultados.get(sql, [])
+
+    def fetchall(self):
+        return self._filas
+
+
+class ConexionFalsa:
+    """Registra las sentencias y devuelve filas fijas por sentencia"""
+
+    def __init__(self, resultados=None):
+        self.resultados = resultados or {}
+        self.sentencias = []
+
+    def cursor(self):
+        return CursorFalso(self)
+
+
+class DatabaseFalsa:
+    """Lo que ReservasStock usa de comun.db.Database, con filas afectadas fijas por sentencia"""
+
+    def __init__(self, filas_afectadas=None, filas_por_registro=None):
+        self.filas_afectadas = filas_afectadas or {}
+        self.filas_por_registro = filas_por_registro or {}
+        self.llamadas = []
+
+    def execute(self, sql, params=None, commit=False, conn=None):
+        self.llamadas.append(('execute', sql, params, commit))
+        afectadas = self.filas_afectadas.get(sql, 0)
+        return afectadas.pop(0) if isinstance(afectadas, list) else afectadas
+
+    def executemany(self, sql, rows, commit=False, conn=None, batcherrors=False, arraydmlrowcounts=False):
+        self.llamadas.append(('executemany', sql, rows, commit))
+        return [], self.filas_por_registro.get(sql, [])
+
+    @contextmanager
+    def acquire(self):
+        yield ConexionFalsa()
+
+    def filas(self, sql):
+        return [llamada[2] for llamada in self.llamadas if llamada[1] == sql]
+
+
+@pytest.fixture
+def db():
+    return DatabaseFalsa()
+
+
+def test_reservar_sin_faltantes_inserta_reservas(db):
+    conn = ConexionFalsa({SQL_CLAVES_CARRITO: [(7, 1)], SQL_FALTANTES_CARRITO: []})
+    faltantes = ReservasStock(db, ttl_minutos=15).reservar(conn, id_pedido=10, id_carrito=3)
+    assert faltantes == []
+    assert db.filas(SQL_TOMAR_CONTROL) == [[{'id_producto': 7, 'id_sucursal': 1}]]
+    sentencias = [sql for sql, _ in conn.sentencias]
+    assert sentencias == [SQL_CLAVES_CARRITO, SQL_FALTANTES_CARRITO, SQL_INSERTAR_RESERVAS]
+    assert conn.sentencias[-1][1] == {'id_pedido': 10, 'id_carrito': 3, 'ttl_minutos': 15}
+
+
+def test_reservar_con_faltantes_no_reserva(db):
+    conn = ConexionFalsa({
+        SQL_CLAVES_CARRITO: [(7, 1), (8, 1)],
+        SQL_FALTANTES_CARRITO: [(8, 1, 5, 2), (7, 1, 3, -4)]
+    })
+    faltantes = ReservasStock(db).reservar(conn, id_pedido=10, id_carrito=3)
+    assert faltantes == [
+        {'id_producto': 8, 'id_sucursal': 1, 'cantidad': 5, 'disponible': 2},
+        # Más reservado que stock: se informa 0 disponible, no negativo
+        {'id_producto': 7, 'id_sucursal': 1, 'cantidad': 3, 'disponible': 0}
+    ]
+    assert SQL_INSERTAR_RESERVAS not in [sql for sql, _ in conn.sentencias]
+
+
+def test_bloquear_en_orden_y_sin_repetir(db):
+    ReservasStock(db).bloquear(ConexionFalsa(), [
+        {'id_producto': 5, 'id_sucursal': 2},
+        {'id_producto': 9, 'id_sucursal': 1},
+        {'id_producto': 5, 'id_sucursal': 2},
+        {'id_producto': 3, 'id_sucursal': 2},
+    ])
+    assert db.filas(SQL_TOMAR_CONTROL) == [[
+        {'id_producto': 9, 'id_sucursal': 1},
+        {'id_producto': 3, 'id_sucursal': 2},
+        {'id_producto': 5, 'id_sucursal': 2},
+    ]]
+
+
+def test_bloquear_sin_lineas(db):
+    ReservasStock(db).bloquear(ConexionFalsa(), [])
+    assert db.llamadas == []
+
+
+def test_rebajar_devuelve_lineas_sin_stock():
+    db = DatabaseFalsa(filas_por_registro={SQL_REBAJAR_STOCK_PEDIDO: [1, 0]})
+    lineas = [{'id_producto': 1, 'id_sucursal': 1, 'cantidad': 2},
+              {'id_producto': 2, 'id_sucursal': 1, 'cantidad': 9}]
+    sin_stock = ReservasStock(db).rebajar(ConexionFalsa(), 10, lineas)
+    assert sin_stock == [lineas[1]]
+    # Las filas de control se toman antes de rebajar y el pedido viaja en cada fila
+    assert [llamada[1] for llamada in db.llamadas] == [SQL_TOMAR_CONTROL, SQL_REBAJAR_STOCK_PEDIDO]
+    assert all(fila['id_pedido'] == 10 for fila in db.filas(SQL_REBAJAR_STOCK_PEDIDO)[0])
+
+
+def test_confirmar_y_liberar_cierran_las_activas():
+    db = DatabaseFalsa(filas_afectadas={SQL_CERRAR_RESERVAS: 2})
+    reservas = ReservasStock(db)
+    assert reservas.confirmar(ConexionFalsa(), 10) == 2
+    assert reservas.liberar(ConexionFalsa(), 11) == 2
+    assert db.filas(SQL_CERRAR_RESERVAS) == [{'estado': 'CONFIRMADA', 'id_pedido': 10},
+                                             {'estado': 'LIBERADA', 'id_pedido': 11}]
+    # No confirman: la reserva se guarda junto con el pago del llamador
+    assert not any(llamada[3] for llamada in db.llamadas)
+
+
+def test_barrer_por_lotes_hasta_agotar():
+    db = DatabaseFalsa(filas_afectadas={SQL_EXPIRAR_VENCIDAS: [3, 3, 1], SQL_PURGAR_CERRADAS: [2]})
+    reservas = ReservasStock(db, lote=3, dias_historial=7)
+    assert reservas.barrer() == (7, 2)
+    assert len(db.filas(SQL_EXPIRAR_VENCIDAS)) == 3
+    assert db.filas(SQL_PURGAR_CERRADAS) == [{'lote': 3, 'dias': 7}]
+    # Un commit por lote
+    assert all(llamada[3] for llamada in db.llamadas)
+    stats = reservas.stats()
+    assert (stats['barridos'], stats['expiradas'], stats['purgadas']) == (1, 7, 2)
+
+
+def test_barrer_sin_vencidas():
+    reservas = ReservasStock(DatabaseFalsa())
+    assert reservas.barrer() == (0, 0)
+    assert reservas.stats()['expiradas'] == 0